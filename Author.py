@@ -5,6 +5,10 @@ from sqlalchemy import orm
 
 class Author(Base):
     __tablename__ = "Authors"
+    __table_args__ = (sqlalchemy.Index("authors_ix_1", "last_name", "first_name"),
+                      sqlalchemy.Index("authors_ix_2", "first_name"),
+                      sqlalchemy.Index("authors_ft_1", "first_name", "last_name", mysql_prefix="FULLTEXT").ddl_if(dialect=("mysql", "mariadb")))
     author_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, primary_key=True)
     first_name = sqlalchemy.Column(sqlalchemy.String(100), nullable=False)
     last_name = sqlalchemy.Column(sqlalchemy.String(100), nullable=False)
+    books = orm.relationship("Book", secondary="Books_Authors", viewonly=True, order_by="Book.isbn")
@@ -5,8 +5,11 @@ from sqlalchemy import orm
 
 class Book(Base):
     __tablename__ = "Books"
+    __table_args__ = (sqlalchemy.UniqueConstraint("title", "year_of_publishing", name="books_un_1"),
+                      sqlalchemy.Index("books_ix_1", "year_of_publishing"),
+                      sqlalchemy.Index("books_ft_1", "title", mysql_prefix="FULLTEXT").ddl_if(dialect=("mysql", "mariadb")))
     isbn = sqlalchemy.Column(sqlalchemy.String(100), nullable=False, primary_key=True)
     title = sqlalchemy.Column(sqlalchemy.String(100), nullable=False)
     year_of_publishing = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
-    sqlalchemy.UniqueConstraint("title", "year_of_publishing",  name="books_un_1")
+    authors = orm.relationship("Author", secondary="Books_Authors", viewonly=True, order_by="Author.author_id")
     
\ No newline at end of file
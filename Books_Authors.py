@@ -5,6 +5,10 @@ from sqlalchemy import orm
 
 class Books_Authors(Base):
     __tablename__ = "Books_Authors"
+    __table_args__ = (sqlalchemy.Index("books_authors_ix_1", "isbn"),
+                      sqlalchemy.Index("books_authors_ix_2", "author_id"))
     id = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, primary_key=True)
-    isbn = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("Books.isbn"), nullable=False)
+    isbn = sqlalchemy.Column(sqlalchemy.String(100), sqlalchemy.ForeignKey("Books.isbn"), nullable=False)
     author_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("Authors.author_id"), nullable=False)
+    book = orm.relationship("Book", viewonly=True)
+    author = orm.relationship("Author", viewonly=True)
@@ -0,0 +1,106 @@
+from fastapi import APIRouter
+from typing import Optional
+from fastapi.responses import JSONResponse, PlainTextResponse
+from db import get_all_pool_statistics, get_replica_statistics as get_read_replica_statistics
+from cache import get_cache_statistics as get_entity_cache_statistics
+from metrics import render_metrics
+from coalescing import get_read_coalescing_statistics as get_read_coalescer_statistics
+from changes import get_change_feed_statistics as get_change_log_statistics
+from admission import get_admission_statistics as get_admission_control_statistics
+from write_batching import get_write_batching_statistics as get_write_batcher_statistics
+from changes import parse_entity_names
+from model import invalidate_entities
+from utils import get_error_body
+from serialization import FastJSONResponse
+
+router = APIRouter()
+
+
+@router.get("/api/admin/pool",
+            tags=["admin"])
+async def get_pool_statistics():
+    """
+    Method that handles a GET request for the statistics of the database connection pools
+    (checked out connections, overflow and time spent waiting for a connection).
+    """
+    return JSONResponse(status_code=200, content=get_all_pool_statistics())
+
+
+@router.get("/api/admin/replicas",
+            tags=["admin"])
+async def get_replica_statistics():
+    """
+    Method that handles a GET request for the health, the replication lag and the load of the read replicas.
+    """
+    return JSONResponse(status_code=200, content=get_read_replica_statistics())
+
+
+@router.get("/api/admin/cache",
+            tags=["admin"])
+async def get_cache_statistics():
+    """
+    Method that handles a GET request for the hit/miss/eviction counters of the entity cache.
+    """
+    return JSONResponse(status_code=200, content=get_entity_cache_statistics())
+
+
+@router.get("/api/admin/write-batching",
+            tags=["admin"])
+async def get_write_batching_statistics():
+    """
+    Method that handles a GET request for the queue depth and the batch sizes of the write batchers.
+    """
+    return JSONResponse(status_code=200, content=get_write_batcher_statistics())
+
+
+@router.get("/api/admin/read-coalescing",
+            tags=["admin"])
+async def get_read_coalescing_statistics():
+    """
+    Method that handles a GET request for the number of coalesced reads in flight and of the reads that joined them.
+    """
+    return JSONResponse(status_code=200, content=get_read_coalescer_statistics())
+
+
+@router.get("/api/admin/admission",
+            tags=["admin"])
+async def get_admission_statistics():
+    """
+    Method that handles a GET request for the slots in use, the queue depth and the shed requests of the concurrency limiters.
+    """
+    return JSONResponse(status_code=200, content=get_admission_control_statistics())
+
+
+@router.get("/api/admin/changes",
+            tags=["admin"])
+async def get_change_feed_statistics():
+    """
+    Method that handles a GET request for the range of sequence numbers held by the change log and its number of subscribers.
+    """
+    return JSONResponse(status_code=200, content=get_change_log_statistics())
+
+
+@router.post("/api/admin/invalidate",
+             tags=["admin"])
+async def invalidate(entities: Optional[str] = None):
+    """
+    Method that handles the notification of the writes made outside of this process (e.g. by the command line
+    importer or by hand) on the entities listed by 'entities' (e.g. 'books,authors', all of them if it is missing):
+    their cached entries are removed, their ETags change, their search indexes are built again and the subscribers
+    of the change feed get a 'reload' change.
+    Every process of the service keeps its own cache, versions and indexes, so every one of them has to be notified.
+    """
+    try:
+        entity_names = parse_entity_names(entities)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_ENTITIES"))
+    return JSONResponse(status_code=200, content={"invalidated": invalidate_entities(entity_names)})
+
+
+@router.get("/metrics",
+            include_in_schema=False)
+async def get_metrics():
+    """
+    Method that handles a GET request for the metrics, in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
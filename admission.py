@@ -0,0 +1,210 @@
+import asyncio
+import os
+from collections import deque
+from db import DB_POOL_SIZE, DB_MAX_OVERFLOW, get_bool_env
+from metrics import Counter, Gauge, get_route_template
+from replication import is_write_request
+from serialization import FastJSONResponse
+from utils import get_error_body
+from write_batching import WRITE_BATCHING
+
+# when enabled, the API requests wait for a free slot of their class (read or write) and of their route, if it has
+# a limit of its own - the requests that find the wait queue full or wait too long are answered with a 503 at once
+ADMISSION_CONTROL = get_bool_env("ADMISSION_CONTROL")
+# by default the writes get half of the base pool, the reads the rest of the pool and its overflow,
+# so that a burst of one class never takes all the connections the other one needs
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY", str(max(1, DB_POOL_SIZE // 2))))
+ADMISSION_READ_CONCURRENCY = int(os.getenv("ADMISSION_READ_CONCURRENCY",
+                                           str(max(1, DB_POOL_SIZE + DB_MAX_OVERFLOW - ADMISSION_WRITE_CONCURRENCY))))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "1"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+# comma separated '<METHOD> <route template>=<limit>' pairs, e.g. 'POST /api/books/import=1,GET /api/books/export=2'
+ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "")
+
+# the requests of these paths are never held back: the operators need the admin routes most when the service is
+# overloaded, and the change feed subscriptions stay open for good without holding a connection of the database
+ADMISSION_EXEMPT_PATH_PREFIXES = ("/api/admin/", "/api/changes")
+# with WRITE_BATCHING on, the single inserts wait in the bounded queue of a write batcher, which commits them with one
+# connection per entity: they take no slot of the write limiter, since the queued requests holding one until their
+# batch commits would cap every batch at ADMISSION_WRITE_CONCURRENCY inserts (they still take their route limiter, if any)
+BATCHED_WRITE_ROUTES = frozenset(("/api/books/", "/api/authors/", "/api/books_authors/")) if WRITE_BATCHING else frozenset()
+
+admission_active_requests = Gauge("admission_active_requests", "Number of requests holding a slot of a concurrency limiter.",
+                                  ("limiter",))
+admission_queued_requests = Gauge("admission_queued_requests", "Number of requests waiting for a slot of a concurrency limiter.",
+                                  ("limiter",))
+admission_rejected_requests_total = Counter("admission_rejected_requests_total",
+                                            "Number of requests shed by a concurrency limiter (reason: queue_full or timeout).",
+                                            ("limiter", "reason"))
+
+OVERLOADED_BODY = get_error_body(503, "The service is overloaded, retry later.", "OVERLOADED")
+
+
+def parse_route_limits(route_limits):
+    """
+    Parses the ADMISSION_ROUTE_LIMITS setting into a dictionary of the limits by (method, route template).
+    :param route_limits: the comma separated '<METHOD> <route template>=<limit>' pairs
+    """
+    limits = {}
+    for route_limit in route_limits.split(","):
+        if not route_limit.strip():
+            continue
+        route, limit = route_limit.rsplit("=", 1)
+        method, path = route.split()
+        limits[(method.upper(), path)] = int(limit)
+    return limits
+
+
+class ConcurrencyLimiter:
+    """
+    Lets at most 'limit' requests run at a time and at most 'queue_size' more wait, in arrival order,
+    for 'queue_timeout' seconds at most. A released slot is handed over to the first waiting request.
+    The limiter belongs to the event loop of the application, so it needs no lock.
+    """
+    def __init__(self, name, limit, queue_size=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        """
+        :param name: the name of the limiter, used by the metrics
+        :param limit: the maximum number of requests running at a time
+        :param queue_size: the maximum number of waiting requests - the requests beyond it are rejected at once
+        :param queue_timeout: the maximum time a request waits for a slot
+        """
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def update_gauges(self):
+        admission_active_requests.set((self.name,), self.active)
+        admission_queued_requests.set((self.name,), len(self.waiters))
+
+    def discard_waiter(self, waiter):
+        # a cancelled waiter may already have been skipped by 'release'
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+        self.update_gauges()
+
+    def reject(self, reason):
+        admission_rejected_requests_total.inc((self.name, reason))
+        if reason == "timeout":
+            self.timed_out += 1
+        else:
+            self.rejected += 1
+        return False
+
+    async def acquire(self):
+        """
+        Waits for a slot. Returns False if the request is to be shed (the queue is full or the wait timed out).
+        """
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            self.update_gauges()
+            return True
+        if len(self.waiters) >= self.queue_size:
+            return self.reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.update_gauges()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.discard_waiter(waiter)
+            return self.reject("timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the request was cancelled
+                self.release()
+            else:
+                self.discard_waiter(waiter)
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # the slot goes to the waiting request as it is, so 'active' does not change
+                waiter.set_result(None)
+                self.update_gauges()
+                return
+        self.active -= 1
+        self.update_gauges()
+
+    def statistics(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "queue_size": self.queue_size,
+            "queue_timeout_seconds": self.queue_timeout,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+
+
+read_limiter = ConcurrencyLimiter("read", ADMISSION_READ_CONCURRENCY)
+write_limiter = ConcurrencyLimiter("write", ADMISSION_WRITE_CONCURRENCY)
+route_limiters = {(method, path): ConcurrencyLimiter(f"{method} {path}", limit)
+                  for (method, path), limit in parse_route_limits(ADMISSION_ROUTE_LIMITS).items()}
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware that sheds load before it reaches the model layer: an API request first takes a slot of the limiter
+    of its route (if the route has one), then a slot of the read or write limiter (the read-only POST routes, e.g. the
+    lookups, are reads), and holds them until its response is sent. When a limiter is saturated the request waits in its bounded queue and, once the queue is full or the wait
+    timed out, it is answered with a 503 and a 'Retry-After' header instead of waiting for a database connection.
+    """
+    def __init__(self, app, retry_after_seconds=ADMISSION_RETRY_AFTER_SECONDS):
+        self.app = app
+        self.retry_after_seconds = retry_after_seconds
+
+    def get_limiters(self, scope):
+        limiters = []
+        if route_limiters:
+            route_limiter = route_limiters.get((scope["method"], get_route_template(scope)))
+            if route_limiter is not None:
+                limiters.append(route_limiter)
+        if not is_write_request(scope):
+            limiters.append(read_limiter)
+        elif not (scope["method"] == "POST" and scope["path"] in BATCHED_WRITE_ROUTES):
+            limiters.append(write_limiter)
+        return limiters
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["path"].startswith(ADMISSION_EXEMPT_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        acquired = []
+        try:
+            for limiter in self.get_limiters(scope):
+                if not await limiter.acquire():
+                    response = FastJSONResponse(status_code=503, content=OVERLOADED_BODY,
+                                                headers={"Retry-After": str(self.retry_after_seconds)})
+                    await response(scope, receive, send)
+                    return
+                acquired.append(limiter)
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in acquired:
+                limiter.release()
+
+
+def get_admission_statistics():
+    """
+    Returns the slots in use, the queue depth and the rejection counters of all the concurrency limiters.
+    """
+    return {
+        "enabled": ADMISSION_CONTROL,
+        "limiters": {limiter.name: limiter.statistics() for limiter in (read_limiter, write_limiter, *route_limiters.values())}
+    }
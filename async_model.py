@@ -0,0 +1,176 @@
+import anyio
+import anyio.lowlevel
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from db import DB_ASYNC, Session, async_engine, engine, get_read_engine, get_async_read_engine
+from model import OperationResponseWrapper
+from replication import is_write_request
+
+
+async def run_model_operation(operation, *args, **kwargs):
+    """
+    Runs one of the 'model' wrappers without blocking the event loop.
+    With DB_ASYNC enabled the wrapper runs on an AsyncSession of the asyncio engine (the ORM code
+    is driven through 'run_sync', so the I/O is awaited on the event loop), otherwise it runs
+    on the blocking engine in the threadpool.
+    :param operation: the model wrapper that is to be called (it must accept a 'session' argument)
+    :param args: the positional arguments of the wrapper
+    :param kwargs: the keyword arguments of the wrapper
+    """
+    if not DB_ASYNC:
+        return await run_in_threadpool(operation, *args, **kwargs)
+
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    # the session is bound to the replica that is picked here if the wrapper only reads
+    async with AsyncSession(async_engine, info={"read_bind": get_async_read_engine().sync_engine}) as session:
+        return await session.run_sync(lambda sync_session: operation(*args, session=sync_session, **kwargs))
+
+
+class UnitOfWork:
+    """
+    The session shared by the model operations of a request: they all run on one session (a single checkout
+    of a pooled connection) and in one transaction. Their writes are only flushed, 'complete' commits them
+    at once - or none of them, if one of the operations failed and rolled the transaction back.
+    The session is opened by the first operation, so the requests answered without the database check out nothing.
+    The session of a read-only unit of work is bound to a replica by its first read.
+    """
+    def __init__(self, read_only=False):
+        self.read_only = read_only
+        self.session = None
+        self.written = False
+        self.error = None
+        self.after_commit_callbacks = []
+        self.commit_callbacks = []
+
+    def get_session(self):
+        if self.session is None:
+            info = {"unit_of_work": self}
+            if DB_ASYNC:
+                from sqlalchemy.ext.asyncio import AsyncSession
+                if self.read_only:
+                    info["read_bind"] = get_async_read_engine().sync_engine
+                self.session = AsyncSession(async_engine, info=info)
+            else:
+                if self.read_only:
+                    info["read_bind"] = get_read_engine()
+                self.session = Session(bind=engine, info=info)
+        return self.session
+
+    async def run(self, operation, *args, **kwargs):
+        """
+        Runs one of the 'model' wrappers on the session of the unit of work, the same way 'run_model_operation' does.
+        :param operation: the model wrapper that is to be called (it must accept a 'session' argument)
+        :param args: the positional arguments of the wrapper
+        :param kwargs: the keyword arguments of the wrapper
+        """
+        session = self.get_session()
+        if not DB_ASYNC:
+            return await run_in_threadpool(operation, *args, session=session, **kwargs)
+        return await session.run_sync(lambda sync_session: operation(*args, session=sync_session, **kwargs))
+
+    def end(self, session, commit):
+        committed = False
+        try:
+            if commit and self.written and self.error is None:
+                session.commit()
+                committed = True
+        except Exception as e:
+            session.rollback()
+            self.error = e
+        finally:
+            session.close()
+            # the written rows are registered even if they were rolled back, as they may have been cached meanwhile
+            for callback, args in self.after_commit_callbacks:
+                callback(*args)
+            self.after_commit_callbacks.clear()
+            if committed:
+                for callback, args in self.commit_callbacks:
+                    callback(*args)
+            self.commit_callbacks.clear()
+
+    async def finish(self, commit):
+        session, self.session = self.session, None
+        if session is None:
+            return
+        with anyio.CancelScope(shield=True):
+            if not DB_ASYNC:
+                await run_in_threadpool(self.end, session, commit)
+            else:
+                await session.run_sync(lambda sync_session: self.end(sync_session, commit))
+
+    async def complete(self, response=None):
+        """
+        Commits the writes of the operations and releases the session (and its connection) - called by the handlers
+        before they answer. Returns the response of the last operation or, if the unit of work failed,
+        an OperationResponseWrapper with the error.
+        :param response: the OperationResponseWrapper of the last operation
+        """
+        await self.finish(commit=True)
+        if self.error is not None and (response is None or response.error is None):
+            return OperationResponseWrapper(error=self.error, completed_operation=False)
+        return response
+
+    async def close(self):
+        """
+        Rolls back whatever was not committed by 'complete' (e.g. if the handler raised) and releases the session.
+        """
+        await self.finish(commit=False)
+
+
+async def get_unit_of_work(request: Request):
+    """
+    FastAPI dependency that provides the request-scoped unit of work - a read-only one for the requests that do not
+    write (the GET requests and the read-only POST routes, e.g. the lookups).
+    """
+    unit_of_work = UnitOfWork(read_only=not is_write_request(request.scope))
+    try:
+        yield unit_of_work
+    finally:
+        await unit_of_work.close()
+
+
+async def stream_model_operation(operation, *args, **kwargs):
+    """
+    Iterates one of the generator 'model' wrappers without blocking the event loop, the same way
+    'run_model_operation' runs the other wrappers: every item is produced either in the threadpool
+    or, with DB_ASYNC enabled, in a 'run_sync' call on an AsyncSession that stays open until the iteration ends.
+    The generator is closed (and so is its session) even if the iteration is abandoned, e.g. when the client
+    of a streaming response disconnects - the cleanup is shielded from the cancellation of the request.
+    :param operation: the model generator wrapper that is to be iterated (it must accept a 'session' argument)
+    :param args: the positional arguments of the wrapper
+    :param kwargs: the keyword arguments of the wrapper
+    """
+    end = object()
+    if not DB_ASYNC:
+        items = operation(*args, **kwargs)
+        try:
+            while True:
+                item = await run_in_threadpool(next, items, end)
+                # the response writes nothing once the client is gone, so the cancellation is only seen here
+                await anyio.lowlevel.checkpoint()
+                if item is end:
+                    break
+                yield item
+        finally:
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(items.close)
+        return
+
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    session = AsyncSession(async_engine, info={"read_bind": get_async_read_engine().sync_engine})
+    items = operation(*args, session=session.sync_session, **kwargs)
+    try:
+        while True:
+            # a cancelled fetch would leave the connection in the middle of a batch query
+            with anyio.CancelScope(shield=True):
+                item = await session.run_sync(lambda sync_session: next(items, end))
+            await anyio.lowlevel.checkpoint()
+            if item is end:
+                break
+            yield item
+    finally:
+        with anyio.CancelScope(shield=True):
+            await session.run_sync(lambda sync_session: items.close())
+            await session.close()
@@ -1,36 +1,110 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from typing import List
-from model import get_all_authors_with_filters, get_author_by_author_id, delete_author_by_author_id, insert_author, update_author
-from utils import GenericSuccess, get_error_body, AUTHOR_NOT_FOUND_BODY, GENERIC_SUCCESS_STATUS_BODY, CREATE_GENERIC_SUCCESS_STATUS_BODY
-from view import Error, Author
+from fastapi import APIRouter, Body, Depends, Header, Query, Request
+from sqlalchemy.exc import IntegrityError
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Literal, Optional
+from async_model import UnitOfWork, get_unit_of_work, stream_model_operation
+from coalescing import read_coalescer
+from model import get_authors_written_at, get_all_authors_with_filters, get_authors_etag, get_author_etag, get_books_of_author, get_author_by_author_id, stream_authors, get_authors_by_author_ids, delete_author_by_author_id, insert_author, insert_authors, upsert_author
+from utils import GenericSuccess, BulkResult, ImportResult, IMPORT_CHUNK_SIZE, get_error_body, get_bulk_result_body, BULK_INSERT_CHUNK_SIZE, EXPORT_BATCH_SIZE, LOOKUP_CHUNK_SIZE, LOOKUP_MAX_IDENTIFIERS, get_lookup_body, decode_cursor, get_next_cursor_headers, INVALID_CURSOR_BODY, AUTHOR_NOT_FOUND_BODY, GENERIC_SUCCESS_STATUS_BODY, CREATE_GENERIC_SUCCESS_STATUS_BODY, IDENTIFIER_MISMATCH_BODY, get_not_modified_response
+from serialization import FastJSONResponse, HALSerializer, EXPORT_MEDIA_TYPES, stream_export
+from metrics import time_stage
+from importer import ImportAborted, import_upload
+from write_batching import WRITE_BATCHING, author_write_batcher
+from view import Error, Book, Author, AuthorLookup
 
 router = APIRouter()
+author_serializer = HALSerializer(Author)
+book_serializer = HALSerializer(Book)
 
 
 @router.get("/api/authors/",
             responses={200: {"model": List[Author]},
+                       400: {"model": Error},
                        500: {"model": Error}},
             response_model=List[Author],
             tags=["authors"])
-def get_authors(page: int = 1, items_per_page: int = 15):
+async def get_authors(request: Request,
+                      page: int = Query(1, ge=1),
+                      items_per_page: int = Query(15, ge=1),
+                      after: Optional[str] = None,
+                      first_name: Optional[str] = None,
+                      last_name: Optional[str] = None,
+                      sort_by: Literal["author_id", "first_name", "last_name"] = "author_id",
+                      order: Literal["asc", "desc"] = "asc",
+                      fields: Optional[str] = None,
+                      if_none_match: Optional[str] = Header(None)):
     """
     Method that handles a generic GET request for all of the existent authors.
+    Pagination is done either by 'page' or by the opaque 'after' cursor found in the
+    'X-Next-Cursor' header of the previous page.
+    Filtering is done by 'first_name' or 'last_name'.
+    Only indexed columns can be used for filtering and sorting.
+    Only the fields listed by 'fields' (e.g. 'author_id,links') are selected and returned, all of them if it is missing.
+    Answers with 304 if the 'If-None-Match' header holds the current ETag of the authors.
+    The identical requests handled at the same time share one database call and one serialized response.
     """
-    author_list = []
+    try:
+        field_names, include_links = author_serializer.parse_fields(fields)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_FIELDS"))
 
-    db_response = get_all_authors_with_filters()
+    etag = get_authors_etag()
+    not_modified_response = get_not_modified_response(if_none_match, etag)
+    if not_modified_response:
+        return not_modified_response
 
-    if db_response.error:
+    filters = {name: value for name, value in {"first_name": first_name, "last_name": last_name}.items() if value is not None}
+
+    try:
+        after_value = decode_cursor(after, composite=sort_by != "author_id") if after is not None else None
+    except ValueError:
+        return FastJSONResponse(status_code=400, content=INVALID_CURSOR_BODY)
+
+    async def get_response(unit_of_work):
+        headers = None
+        db_response = await unit_of_work.run(get_all_authors_with_filters, page=page, items_per_page=items_per_page, after=after_value,
+                                             sort_by=sort_by, descending=order == "desc", columns=author_serializer.get_columns(field_names, include_links, "author_id", sort_by), **filters)
+        db_response = await unit_of_work.complete(db_response)
+
+        if db_response.error:
+            status_code = 500
+            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+        else:
+            status_code = 200
+            response_body = author_serializer.serialize(db_response.payload, field_names, include_links)
+            headers = get_next_cursor_headers(db_response.payload, items_per_page, "author_id", sort_by)
+            headers["ETag"] = etag
+
+        return FastJSONResponse(status_code=status_code, content=response_body, headers=headers)
+
+    return await read_coalescer.run(request, etag, get_response, get_authors_written_at())
+
+
+@router.get("/api/authors/export",
+            responses={200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}},
+                       500: {"model": Error}},
+            response_class=StreamingResponse,
+            tags=["authors"])
+async def export_authors(format: Literal["ndjson", "csv"] = "ndjson",
+                         batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1)):
+    """
+    Method that handles an export of all the authors, ordered by the 'author_id' field, as NDJSON or CSV.
+    The authors are read 'batch_size' rows at a time, every batch by a query of its own that starts after the last
+    primary key of the previous one (keyset pagination), and every batch is sent as soon as it is read,
+    so the export takes constant memory whatever the number of authors is.
+    """
+    partitions = stream_model_operation(stream_authors, batch_size, columns=author_serializer.field_names)
+
+    try:
+        first_partition = await partitions.__anext__()
+    except StopAsyncIteration:
+        first_partition = []
+    except Exception as e:
+        await partitions.aclose()
         status_code = 500
-        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    else:
-        status_code = 200
-        for author in db_response.payload:
-            author_list.append(Author.from_orm(author).dict())
-        response_body = author_list[(page - 1) * items_per_page:page * items_per_page]
+        return FastJSONResponse(status_code=status_code, content=get_error_body(status_code, str(e), "EXCEPTION"))
 
-    return JSONResponse(status_code=status_code, content=response_body)
+    return StreamingResponse(stream_export(author_serializer, format, first_partition, partitions), media_type=EXPORT_MEDIA_TYPES[format])
 
 
 @router.get("/api/authors/{author_id}",
@@ -39,11 +113,64 @@ def get_authors(page: int = 1, items_per_page: int = 15):
                        500: {"model": Error}},
             response_model=Author,
             tags=["authors"])
-def get_author(author_id: str):
+async def get_author(request: Request, author_id: str, fields: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
     """
     Method that handles a GET request for a authors by the 'author_id' field.
+    Only the fields listed by 'fields' (e.g. 'author_id,links') are selected and returned, all of them if it is missing.
+    Answers with 304 if the 'If-None-Match' header holds the current ETag of the author.
+    The identical requests handled at the same time share one database call and one serialized response.
     """
-    db_response = get_author_by_author_id(str(author_id))
+    try:
+        field_names, include_links = author_serializer.parse_fields(fields)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_FIELDS"))
+
+    etag = get_author_etag(author_id)
+    if etag is None:
+        # the identifier is not a valid value of the primary key, which the database could still coerce into one
+        return FastJSONResponse(status_code=404, content=AUTHOR_NOT_FOUND_BODY)
+
+    not_modified_response = get_not_modified_response(if_none_match, etag)
+    if not_modified_response:
+        return not_modified_response
+
+    columns = author_serializer.get_columns(field_names, include_links) if fields is not None else None
+
+    async def get_response(unit_of_work):
+        db_response = await unit_of_work.run(get_author_by_author_id, str(author_id), columns=columns)
+        db_response = await unit_of_work.complete(db_response)
+
+        if db_response.error:
+            status_code = 500
+            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+        elif not db_response.completed_operation:
+            status_code = 404
+            response_body = AUTHOR_NOT_FOUND_BODY
+        else:
+            status_code = 200
+            if fields is not None:
+                response_body = author_serializer.serialize([db_response.payload], field_names, include_links)[0]
+            else:
+                with time_stage("get_author", "Author", "pydantic"):
+                    response_body = Author.from_orm(db_response.payload).dict()
+
+        return FastJSONResponse(status_code=status_code, content=response_body, headers={"ETag": etag} if status_code == 200 and etag is not None else None)
+
+    return await read_coalescer.run(request, etag, get_response, get_authors_written_at())
+
+
+@router.get("/api/authors/{author_id}/books",
+            responses={200: {"model": List[Book]},
+                       404: {"model": Error},
+                       500: {"model": Error}},
+            response_model=List[Book],
+            tags=["authors"])
+async def get_author_books(author_id: str, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a GET request for the books of a(n) author by its 'author_id' field.
+    """
+    db_response = await unit_of_work.run(get_books_of_author, str(author_id))
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -53,9 +180,9 @@ def get_author(author_id: str):
         response_body = AUTHOR_NOT_FOUND_BODY
     else:
         status_code = 200
-        response_body = Author.from_orm(db_response.payload).dict()
+        response_body = book_serializer.serialize(db_response.payload)
 
-    return JSONResponse(status_code=status_code, content=response_body)
+    return FastJSONResponse(status_code=status_code, content=response_body)
 
 
 @router.delete("/api/authors/{author_id}",
@@ -64,11 +191,12 @@ def get_author(author_id: str):
                           404: {"model": Error},
                           200: {"model": GenericSuccess}},
                tags=["authors"])
-def delete_author(author_id: str):
+async def delete_author(author_id: str, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a DELETE request for a authors by the 'author_id' field.
     """
-    db_response = delete_author_by_author_id(str(author_id))
+    db_response = await unit_of_work.run(delete_author_by_author_id, str(author_id))
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -88,7 +216,7 @@ def delete_author(author_id: str):
                         500: {"model": Error}},
              response_model=GenericSuccess,
              tags=["authors"])
-def post_author(author: Author):
+async def post_author(author: Author, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a POST request for a author.
     """
@@ -96,7 +224,12 @@ def post_author(author: Author):
     author_dict = author.dict()
     del author_dict["links"]
 
-    db_response = insert_author(**author_dict)
+    if WRITE_BATCHING:
+        db_response = await author_write_batcher.submit(author_dict)
+    else:
+        db_response = await unit_of_work.run(insert_author, **author_dict)
+
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -108,35 +241,117 @@ def post_author(author: Author):
     return JSONResponse(status_code=status_code, content=response_body)
 
 
+@router.post("/api/authors/bulk",
+             responses={201: {"model": BulkResult},
+                        207: {"model": BulkResult}},
+             response_model=BulkResult,
+             tags=["authors"])
+async def post_authors_bulk(authors: List[Author], chunk_size: int = Query(BULK_INSERT_CHUNK_SIZE, ge=1), unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a POST request for many authors.
+    The authors are inserted in chunks of 'chunk_size' rows and every one of them gets its own result,
+    so a failing author (e.g. a duplicate) does not abort the others.
+    """
+    authors_list = []
+    for author in authors:
+        author_dict = author.dict()
+        del author_dict["links"]
+        authors_list.append(author_dict)
+
+    db_response = await unit_of_work.run(insert_authors, authors_list, chunk_size)
+    db_response = await unit_of_work.complete(db_response)
+
+    status_code = 201 if db_response.completed_operation else 207
+    # the whole batch fails if the commit does
+    response_body = get_bulk_result_body(db_response.payload or [db_response.error] * len(authors_list))
+
+    return JSONResponse(status_code=status_code, content=response_body)
+
+
+@router.post("/api/authors/import",
+             responses={200: {"model": ImportResult},
+                        500: {"model": Error}},
+             response_model=ImportResult,
+             tags=["authors"])
+async def import_authors(request: Request,
+                         format: Literal["ndjson", "csv"] = "ndjson",
+                         mode: Literal["insert", "upsert"] = "insert",
+                         chunk_size: int = Query(IMPORT_CHUNK_SIZE, ge=1),
+                         skip: int = Query(0, ge=0)):
+    """
+    Method that handles the import of a CSV (with a header line) or NDJSON file of authors, sent as the body of the request.
+    The records are validated, deduplicated and written in chunks of 'chunk_size' - 'mode' tells if the existing authors
+    are rejected or updated. The result counts the records and lists the first errors.
+    If the database fails, the error tells how many records were committed: a retry can skip them ('skip').
+    """
+    try:
+        response_body = await import_upload(request, "authors", format, mode, chunk_size, skip)
+        status_code = 200
+    except ImportAborted as e:
+        status_code = 500
+        response_body = get_error_body(status_code, str(e), "IMPORT_ABORTED")
+
+    return FastJSONResponse(status_code=status_code, content=response_body)
+
+
+@router.post("/api/authors/lookup",
+             responses={200: {"model": AuthorLookup},
+                        500: {"model": Error}},
+             response_model=AuthorLookup,
+             tags=["authors"])
+async def lookup_authors(author_ids: List[str] = Body(..., max_items=LOOKUP_MAX_IDENTIFIERS),
+                         chunk_size: int = Query(LOOKUP_CHUNK_SIZE, ge=1),
+                         unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a lookup of many authors by their 'author_id' field, in a single query per 'chunk_size' author_ids.
+    The found authors are returned in the order of the author_ids, the author_ids that do not exist are listed under 'missing'.
+    """
+    db_response = await unit_of_work.run(get_authors_by_author_ids, author_ids, chunk_size)
+    db_response = await unit_of_work.complete(db_response)
+
+    if db_response.error:
+        status_code = 500
+        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+    else:
+        status_code = 200
+        response_body = get_lookup_body(author_ids, db_response.payload, author_serializer)
+
+    return FastJSONResponse(status_code=status_code, content=response_body)
+
+
 @router.put("/api/authors/{author_id}",
             responses={200: {"model": GenericSuccess},
                        201: {"model": GenericSuccess},
                        500: {"model": Error},
-                       406: {"model": Error}},
+                       406: {"model": Error},
+                       409: {"model": Error}},
             response_model=GenericSuccess,
             tags=["authors"])
-def put_author(author_id: str, author: Author):
+async def put_author(author_id: str, author: Author, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a PUT request for a(n) author by its 'author_id' field.
-    Creates the author if it doesn't already exist.
+    Creates the author if it doesn't already exist, in a single upsert statement.
+    The 'author_id' of the body has to match the one of the path.
     """
     request_body = author.dict()
     del request_body["links"]
 
-    db_response = update_author(author_id, request_body)
+    if str(request_body["author_id"]) != str(author_id):
+        return JSONResponse(status_code=406, content=IDENTIFIER_MISMATCH_BODY)
 
-    if db_response.error:
+    db_response = await unit_of_work.run(upsert_author, request_body)
+    db_response = await unit_of_work.complete(db_response)
+
+    if isinstance(db_response.error, IntegrityError):
+        # e.g. another row already has the values of a unique key
+        status_code = 409
+        response_body = get_error_body(status_code, str(db_response.error), "CONFLICT")
+    elif db_response.error:
         status_code = 500
         response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    elif db_response.completed_operation is False:
-        db_response = insert_author(**request_body)
-
-        if db_response.error:
-            status_code = 500
-            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-        else:
-            status_code = 201
-            response_body = CREATE_GENERIC_SUCCESS_STATUS_BODY
+    elif db_response.payload:
+        status_code = 201
+        response_body = CREATE_GENERIC_SUCCESS_STATUS_BODY
     else:
         status_code = 200
         response_body = GENERIC_SUCCESS_STATUS_BODY
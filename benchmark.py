@@ -0,0 +1,580 @@
+"""
+Load-test and micro-benchmark suite of the service.
+
+    python benchmark.py --books 5000 --authors 1000 --links 10000 --duration 30 --concurrency 16 --mix mixed
+
+The database (a throwaway SQLite file by default, or any SQLAlchemy URL given by --db-url, e.g. a MariaDB
+started by docker-compose) gets its tables recreated and seeded, 'main:app' is started by uvicorn against it
+and a mixed read/write workload is driven over the routes of the books, authors and books_authors routers.
+The model wrappers and the serialization of the view models are then timed in-process.
+The results are saved as JSON and '--compare' prints the changes against the results of another run.
+The workload is seeded, so two runs with the same arguments send the same requests.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+MIXES = {
+    # fraction of the operations that are writes
+    "read": 0.05,
+    "mixed": 0.2,
+    "write": 0.5
+}
+BULK_SIZE = 10
+ITEMS_PER_PAGE = 15
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Returns the nearest-rank percentile of already sorted values.
+    :param sorted_values: the values, in ascending order
+    :param percentile: the percentile (0 - 100)
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, round(percentile / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def get_latency_summary(latencies):
+    """
+    Summarizes latencies (in seconds) into milliseconds.
+    :param latencies: the measured latencies
+    """
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": get_percentile(latencies, 50) * 1000,
+        "p95_ms": get_percentile(latencies, 95) * 1000,
+        "p99_ms": get_percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_database(books, authors, links, seed):
+    """
+    Recreates the tables of the configured database and fills them with generated rows.
+    :param books: the number of books
+    :param authors: the number of authors
+    :param links: the number of books_authors rows
+    :param seed: the seed of the generated values
+    """
+    from sqlalchemy import insert, text
+    from db import Base, engine
+    from Book import Book
+    from Author import Author
+    from Books_Authors import Books_Authors
+
+    rng = random.Random(seed)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    if engine.dialect.name == "sqlite":
+        # lets the readers go on while a writer holds the database
+        with engine.connect() as connection:
+            connection.execute(text("PRAGMA journal_mode=WAL"))
+
+    book_rows = [{"isbn": f"isbn-{index:08d}", "title": f"Title {rng.randrange(10 ** 6):06d}",
+                  "year_of_publishing": rng.randint(1900, 2024)} for index in range(books)]
+    author_rows = [{"author_id": index, "first_name": f"First {rng.randrange(1000):03d}",
+                    "last_name": f"Last {rng.randrange(10 ** 4):04d}"} for index in range(1, authors + 1)]
+    link_rows = [{"id": index, "isbn": rng.choice(book_rows)["isbn"], "author_id": rng.randint(1, authors)}
+                 for index in range(1, links + 1)] if books and authors else []
+
+    with engine.begin() as connection:
+        for entity, rows in ((Book, book_rows), (Author, author_rows), (Books_Authors, link_rows)):
+            for start in range(0, len(rows), 1000):
+                connection.execute(insert(entity), rows[start:start + 1000])
+
+    return {
+        "isbns": [row["isbn"] for row in book_rows],
+        "author_ids": [row["author_id"] for row in author_rows],
+        "link_ids": [row["id"] for row in link_rows]
+    }
+
+
+class Workload:
+    """
+    The operations of the load test, one or more for every route of the entity routers.
+    Every operation sends a request and returns its name and response; the deletes only remove
+    rows created by the workload, so the seeded data volume stays the same.
+    """
+    def __init__(self, keys, write_fraction):
+        self.isbns = keys["isbns"]
+        self.author_ids = keys["author_ids"]
+        self.link_ids = keys["link_ids"]
+        self.created = {"books": [], "authors": [], "books_authors": []}
+        self.etags = {}
+        self.next_key = itertools.count(max(self.author_ids + self.link_ids, default=0) + 1)
+        self.reads = [self.list_books, self.list_books_by_year, self.list_books_sorted, self.get_book,
+                      self.get_book_conditional, self.get_book_authors, self.list_authors, self.get_author,
+                      self.get_author_books, self.lookup_authors, self.list_books_authors, self.get_books_authors,
+                      self.search]
+        self.writes = [self.post_book, self.post_books_bulk, self.put_book, self.delete_book,
+                       self.post_author, self.post_authors_bulk, self.put_author, self.delete_author,
+                       self.post_books_authors, self.post_books_authors_bulk, self.put_books_authors,
+                       self.delete_books_authors]
+        self.write_fraction = write_fraction
+
+    async def run_random_operation(self, client, rng):
+        operations = self.writes if rng.random() < self.write_fraction else self.reads
+        return await rng.choice(operations)(client, rng)
+
+    def new_book(self, rng):
+        key = next(self.next_key)
+        return {"isbn": f"bench-{key}", "title": f"Title {key}", "year_of_publishing": rng.randint(1900, 2024)}
+
+    def new_author(self, rng):
+        key = next(self.next_key)
+        return {"author_id": key, "first_name": f"First {key}", "last_name": f"Last {rng.randrange(10 ** 4):04d}"}
+
+    def new_books_authors(self, rng):
+        return {"id": next(self.next_key), "isbn": rng.choice(self.isbns), "author_id": rng.choice(self.author_ids)}
+
+    async def list_books(self, client, rng):
+        return "list_books", await client.get("/api/books/", params={"page": rng.randint(1, 10), "items_per_page": ITEMS_PER_PAGE})
+
+    async def list_books_by_year(self, client, rng):
+        year_from = rng.randint(1900, 2020)
+        return "list_books_by_year", await client.get("/api/books/", params={"year_from": year_from, "year_to": year_from + 4,
+                                                                             "sort_by": "year_of_publishing"})
+
+    async def list_books_sorted(self, client, rng):
+        return "list_books_sorted", await client.get("/api/books/", params={"sort_by": "title", "order": "desc"})
+
+    async def get_book(self, client, rng):
+        isbn = rng.choice(self.isbns)
+        response = await client.get(f"/api/books/{isbn}")
+        self.etags[isbn] = response.headers.get("ETag")
+        return "get_book", response
+
+    async def get_book_conditional(self, client, rng):
+        isbn = rng.choice(self.isbns)
+        headers = {"If-None-Match": self.etags[isbn]} if self.etags.get(isbn) else {}
+        response = await client.get(f"/api/books/{isbn}", headers=headers)
+        self.etags[isbn] = response.headers.get("ETag", self.etags.get(isbn))
+        return "get_book_conditional", response
+
+    async def get_book_authors(self, client, rng):
+        return "get_book_authors", await client.get(f"/api/books/{rng.choice(self.isbns)}/authors")
+
+    async def list_authors(self, client, rng):
+        return "list_authors", await client.get("/api/authors/", params={"sort_by": "last_name", "page": rng.randint(1, 10)})
+
+    async def get_author(self, client, rng):
+        return "get_author", await client.get(f"/api/authors/{rng.choice(self.author_ids)}")
+
+    async def get_author_books(self, client, rng):
+        return "get_author_books", await client.get(f"/api/authors/{rng.choice(self.author_ids)}/books")
+
+    async def lookup_authors(self, client, rng):
+        author_ids = rng.sample(self.author_ids, min(ITEMS_PER_PAGE, len(self.author_ids)))
+        return "lookup_authors", await client.post("/api/authors/lookup", json=author_ids)
+
+    async def list_books_authors(self, client, rng):
+        return "list_books_authors", await client.get("/api/books_authors/", params={"isbn": rng.choice(self.isbns)})
+
+    async def get_books_authors(self, client, rng):
+        return "get_books_authors", await client.get(f"/api/books_authors/{rng.choice(self.link_ids)}")
+
+    async def search(self, client, rng):
+        return "search", await client.get("/api/search", params={"q": f"{rng.choice(['title', 'first', 'last'])} {rng.randrange(10)}"})
+
+    async def post_book(self, client, rng):
+        book = self.new_book(rng)
+        response = await client.post("/api/books/", json=book)
+        if response.status_code == 201:
+            self.created["books"].append(book["isbn"])
+        return "post_book", response
+
+    async def post_books_bulk(self, client, rng):
+        books = [self.new_book(rng) for _ in range(BULK_SIZE)]
+        response = await client.post("/api/books/bulk", json=books)
+        self.created["books"].extend(book["isbn"] for book in books)
+        return "post_books_bulk", response
+
+    async def put_book(self, client, rng):
+        isbn = rng.choice(self.isbns)
+        book = {"isbn": isbn, "title": f"Title {rng.randrange(10 ** 6):06d}", "year_of_publishing": rng.randint(1900, 2024)}
+        return "put_book", await client.put(f"/api/books/{isbn}", json=book)
+
+    async def delete_book(self, client, rng):
+        if not self.created["books"]:
+            return await self.post_book(client, rng)
+        return "delete_book", await client.delete(f"/api/books/{self.created['books'].pop()}")
+
+    async def post_author(self, client, rng):
+        author = self.new_author(rng)
+        response = await client.post("/api/authors/", json=author)
+        if response.status_code == 201:
+            self.created["authors"].append(author["author_id"])
+        return "post_author", response
+
+    async def post_authors_bulk(self, client, rng):
+        authors = [self.new_author(rng) for _ in range(BULK_SIZE)]
+        response = await client.post("/api/authors/bulk", json=authors)
+        self.created["authors"].extend(author["author_id"] for author in authors)
+        return "post_authors_bulk", response
+
+    async def put_author(self, client, rng):
+        author_id = rng.choice(self.author_ids)
+        author = {"author_id": author_id, "first_name": f"First {rng.randrange(1000):03d}", "last_name": f"Last {rng.randrange(10 ** 4):04d}"}
+        return "put_author", await client.put(f"/api/authors/{author_id}", json=author)
+
+    async def delete_author(self, client, rng):
+        if not self.created["authors"]:
+            return await self.post_author(client, rng)
+        return "delete_author", await client.delete(f"/api/authors/{self.created['authors'].pop()}")
+
+    async def post_books_authors(self, client, rng):
+        books_authors = self.new_books_authors(rng)
+        response = await client.post("/api/books_authors/", json=books_authors)
+        if response.status_code == 201:
+            self.created["books_authors"].append(books_authors["id"])
+        return "post_books_authors", response
+
+    async def post_books_authors_bulk(self, client, rng):
+        many_books_authors = [self.new_books_authors(rng) for _ in range(BULK_SIZE)]
+        response = await client.post("/api/books_authors/bulk", json=many_books_authors)
+        self.created["books_authors"].extend(books_authors["id"] for books_authors in many_books_authors)
+        return "post_books_authors_bulk", response
+
+    async def put_books_authors(self, client, rng):
+        id = rng.choice(self.link_ids)
+        books_authors = {"id": id, "isbn": rng.choice(self.isbns), "author_id": rng.choice(self.author_ids)}
+        return "put_books_authors", await client.put(f"/api/books_authors/{id}", json=books_authors)
+
+    async def delete_books_authors(self, client, rng):
+        if not self.created["books_authors"]:
+            return await self.post_books_authors(client, rng)
+        return "delete_books_authors", await client.delete(f"/api/books_authors/{self.created['books_authors'].pop()}")
+
+
+async def run_load(base_url, workload, concurrency, duration, max_requests, seed):
+    """
+    Drives the workload with 'concurrency' clients until the duration elapses or 'max_requests' are sent.
+    :param base_url: the URL of the running service
+    :param workload: the operations that are sent
+    :param concurrency: the number of concurrent clients
+    :param duration: the maximum length of the run, in seconds
+    :param max_requests: the maximum number of requests (None for no limit)
+    :param seed: the seed of the choices of the clients
+    """
+    import httpx
+
+    samples = []
+    sent_requests = itertools.count()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        deadline = start + duration
+
+        async def run_client(client_index):
+            rng = random.Random(seed * 1000 + client_index)
+            while time.perf_counter() < deadline and (max_requests is None or next(sent_requests) < max_requests):
+                request_start = time.perf_counter()
+                try:
+                    name, response = await workload.run_random_operation(client, rng)
+                    status_code = response.status_code
+                except httpx.HTTPError as error:
+                    name, status_code = type(error).__name__, 0
+                samples.append((name, time.perf_counter() - request_start, status_code))
+
+        await asyncio.gather(*(run_client(client_index) for client_index in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return get_load_results(samples, elapsed)
+
+
+def get_load_results(samples, elapsed):
+    """
+    Summarizes the (operation, latency, status code) samples of a load test.
+    :param samples: the samples of all the requests
+    :param elapsed: the length of the run, in seconds
+    """
+    operations = {}
+    for name, latency, status_code in samples:
+        operations.setdefault(name, []).append((latency, status_code))
+
+    def summarize(operation_samples):
+        status_codes = {}
+        for _, status_code in operation_samples:
+            status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+        return {
+            "requests": len(operation_samples),
+            "throughput_rps": len(operation_samples) / elapsed if elapsed else 0.0,
+            "errors": sum(1 for _, status_code in operation_samples if status_code == 0 or status_code >= 500),
+            "status_codes": status_codes,
+            **get_latency_summary([latency for latency, _ in operation_samples])
+        }
+
+    return {
+        "elapsed_seconds": elapsed,
+        "total": summarize([(latency, status_code) for _, latency, status_code in samples]),
+        "operations": {name: summarize(operation_samples) for name, operation_samples in sorted(operations.items())}
+    }
+
+
+def start_server(port, env):
+    """
+    Starts 'main:app' in a uvicorn process and waits until it answers.
+    :param port: the port of the server
+    :param env: the environment of the process
+    """
+    import httpx
+
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                               "--log-level", "warning", "--no-access-log"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode}.")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start in 30 seconds.")
+
+
+def time_call(function, number, repeat):
+    """
+    Times a call like 'timeit' does and returns the per-call durations in microseconds.
+    :param function: the function without arguments that is timed
+    :param number: the number of calls of a round
+    :param repeat: the number of rounds
+    """
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - start) / number * 10 ** 6)
+    return {"calls": number * repeat, "min_us": min(rounds), "median_us": statistics.median(rounds), "max_us": max(rounds)}
+
+
+def run_micro_benchmarks(keys, number, repeat):
+    """
+    Times the model wrappers and the serialization of a page of every view model, in-process.
+    :param keys: the seeded primary key values
+    :param number: the number of calls of a round
+    :param repeat: the number of rounds
+    """
+    import main  # binds the view models to the routes of the application, which their links need
+    import db
+    import model
+    import view
+    from sqlalchemy import select
+    from Book import Book
+    from cache import entity_cache
+    from serialization import FastJSONResponse, HALSerializer
+
+    isbn = keys["isbns"][0]
+    author_id = keys["author_ids"][0]
+
+    def get_uncached_book():
+        if entity_cache is not None:
+            entity_cache.clear()
+        model.get_book_by_isbn(isbn)
+
+    book_serializer = HALSerializer(view.Book)
+    book_rows = model.get_all_books_with_filters(page=1, items_per_page=ITEMS_PER_PAGE, columns=book_serializer.field_names).payload
+    book_instances = model.get_all_books_with_filters(page=1, items_per_page=ITEMS_PER_PAGE).payload
+    author_serializer = HALSerializer(view.Author)
+    author_instances = model.get_all_authors_with_filters(page=1, items_per_page=ITEMS_PER_PAGE).payload
+    serialized_books = book_serializer.serialize(book_rows)
+    book = model.get_book_by_isbn(isbn).payload
+    book_fields = {"isbn": book.isbn, "title": book.title, "year_of_publishing": book.year_of_publishing}
+    # the by-id hot path with the statement built per call, as the generic wrappers used to do, and prebuilt
+    session = db.Session(bind=db.engine)
+
+    def build_statement_by_isbn():
+        return select(Book).where(Book.isbn == isbn).limit(1)
+
+    def get_prebuilt_statement_by_isbn():
+        return model.get_select_by_identifier_statement(Book, "isbn")
+
+    cases = {
+        "statement by isbn: build + cache key (built per call)": lambda: build_statement_by_isbn()._generate_cache_key(),
+        "statement by isbn: build + cache key (prebuilt)": lambda: get_prebuilt_statement_by_isbn()._generate_cache_key(),
+        "statement by isbn: execute (built per call)": lambda: session.execute(build_statement_by_isbn()).scalars().first(),
+        "statement by isbn: execute (prebuilt)": lambda: session.execute(get_prebuilt_statement_by_isbn(),
+                                                                         {"identifier_value": isbn}).scalars().first(),
+        "model.get_book_by_isbn (cached)": lambda: model.get_book_by_isbn(isbn),
+        "model.get_book_by_isbn (uncached)": get_uncached_book,
+        "model.get_all_books_with_filters (columns)": lambda: model.get_all_books_with_filters(
+            page=1, items_per_page=ITEMS_PER_PAGE, columns=book_serializer.field_names),
+        "model.get_all_books_with_filters (entities)": lambda: model.get_all_books_with_filters(page=1, items_per_page=ITEMS_PER_PAGE),
+        "model.get_all_books_with_filters (year range)": lambda: model.get_all_books_with_filters(
+            items_per_page=ITEMS_PER_PAGE, sort_by="year_of_publishing", ranges={"year_of_publishing": (1950, 1960)},
+            columns=book_serializer.field_names),
+        "model.get_all_authors_with_filters (entities)": lambda: model.get_all_authors_with_filters(page=1, items_per_page=ITEMS_PER_PAGE),
+        "model.get_authors_of_book": lambda: model.get_authors_of_book(isbn),
+        "model.get_books_of_author": lambda: model.get_books_of_author(author_id),
+        "model.upsert_book (update)": lambda: model.upsert_book(book_fields),
+        "view.Book.from_orm().dict() (page)": lambda: [view.Book.from_orm(row).dict() for row in book_instances],
+        "view.Author.from_orm().dict() (page)": lambda: [view.Author.from_orm(row).dict() for row in author_instances],
+        "serialization.HALSerializer(Book).serialize (page)": lambda: book_serializer.serialize(book_rows),
+        "serialization.HALSerializer(Author).serialize (page)": lambda: author_serializer.serialize(author_instances),
+        "serialization.FastJSONResponse (page)": lambda: FastJSONResponse(content=serialized_books)
+    }
+    try:
+        return {name: time_call(function, number, repeat) for name, function in cases.items()}
+    finally:
+        session.close()
+
+
+def compare_results(baseline, current):
+    """
+    Prints the relative changes of the throughput and latencies of a run against another one.
+    :param baseline: the results of the reference run
+    :param current: the results of the current run
+    """
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"Changes against {baseline['metadata'].get('commit')} ({baseline['metadata'].get('timestamp')}):")
+    baseline_operations = baseline.get("load", {}).get("operations", {})
+    for name, result in current.get("load", {}).get("operations", {}).items():
+        old = baseline_operations.get(name)
+        if old:
+            print(f"  {name:<40} rps {change(old['throughput_rps'], result['throughput_rps']):>8}"
+                  f"  p50 {change(old['p50_ms'], result['p50_ms']):>8}  p95 {change(old['p95_ms'], result['p95_ms']):>8}"
+                  f"  p99 {change(old['p99_ms'], result['p99_ms']):>8}")
+    baseline_micro = baseline.get("micro", {})
+    for name, result in current.get("micro", {}).items():
+        old = baseline_micro.get(name)
+        if old:
+            print(f"  {name:<60} median {change(old['median_us'], result['median_us']):>8}")
+
+
+def print_results(results):
+    load = results.get("load")
+    if load:
+        print(f"Load test: {load['total']['requests']} requests in {load['elapsed_seconds']:.1f}s")
+        print(f"  {'operation':<28}{'requests':>9}{'rps':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name, result in list(load["operations"].items()) + [("total", load["total"])]:
+            print(f"  {name:<28}{result['requests']:>9}{result['throughput_rps']:>9.1f}{result['errors']:>8}"
+                  f"{result.get('p50_ms', 0):>9.2f}{result.get('p95_ms', 0):>9.2f}{result.get('p99_ms', 0):>9.2f}")
+    micro = results.get("micro")
+    if micro:
+        print("Micro-benchmarks (per call):")
+        for name, result in micro.items():
+            print(f"  {name:<60}{result['median_us']:>12.1f} us")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Load-test and micro-benchmark suite of the service.")
+    parser.add_argument("--db-url", help="SQLAlchemy URL of a throwaway database whose tables are recreated "
+                                         "(a temporary SQLite file by default)")
+    parser.add_argument("--async-db-url", help="SQLAlchemy URL of the same database for the asyncio engine (DB_ASYNC=1)")
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--authors", type=int, default=500)
+    parser.add_argument("--links", type=int, default=4000, help="number of books_authors rows")
+    parser.add_argument("--mix", choices=MIXES, default="mixed", help="share of the writes in the workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20, help="maximum length of the load test, in seconds")
+    parser.add_argument("--requests", type=int, help="maximum number of requests of the load test")
+    parser.add_argument("--number", type=int, default=200, help="calls per round of a micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds of a micro-benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="path of the JSON results (benchmark-<commit>-<time>.json by default)")
+    parser.add_argument("--compare", help="path of the JSON results of a previous run")
+    return parser.parse_args()
+
+
+def main():
+    arguments = get_arguments()
+
+    temporary_directory = None
+    db_url = arguments.db_url
+    async_db_url = arguments.async_db_url
+    if db_url is None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        database_path = os.path.join(temporary_directory.name, "benchmark.db")
+        db_url = f"sqlite:///{database_path}"
+        async_db_url = async_db_url or f"sqlite+aiosqlite:///{database_path}"
+
+    # 'db' reads its configuration when it is imported, so it has to be set before
+    os.environ["DB_URL"] = db_url
+    if async_db_url:
+        os.environ["ASYNC_DB_URL"] = async_db_url
+
+    keys = seed_database(arguments.books, arguments.authors, arguments.links, arguments.seed)
+    results = {
+        "metadata": {
+            "commit": get_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": db_url.split("://")[0],
+            "db_async": os.getenv("DB_ASYNC", "false"),
+            "arguments": {name: value for name, value in vars(arguments).items() if name not in ("db_url", "async_db_url")}
+        }
+    }
+
+    if not arguments.skip_load:
+        port = get_free_port()
+        server = start_server(port, dict(os.environ))
+        try:
+            workload = Workload(keys, MIXES[arguments.mix])
+            results["load"] = asyncio.run(run_load(f"http://127.0.0.1:{port}", workload, arguments.concurrency,
+                                                   arguments.duration, arguments.requests, arguments.seed))
+        finally:
+            server.terminate()
+            server.wait()
+        # the micro-benchmarks run on the seeded data, not on the one changed by the load test
+        keys = seed_database(arguments.books, arguments.authors, arguments.links, arguments.seed)
+
+    if not arguments.skip_micro:
+        results["micro"] = run_micro_benchmarks(keys, arguments.number, arguments.repeat)
+
+    output = arguments.output or f"benchmark-{results['metadata']['commit'] or 'unknown'}-{int(time.time())}.json"
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    print_results(results)
+    print(f"Results saved to {output}")
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            compare_results(json.load(baseline_file), results)
+
+    if temporary_directory is not None:
+        temporary_directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,112 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from typing import List
-from model import get_all_books_with_filters, get_book_by_isbn, delete_book_by_isbn, insert_book, update_book
-from utils import GenericSuccess, get_error_body, BOOK_NOT_FOUND_BODY, GENERIC_SUCCESS_STATUS_BODY, CREATE_GENERIC_SUCCESS_STATUS_BODY
-from view import Error, Book
+from fastapi import APIRouter, Body, Depends, Header, Query, Request
+from sqlalchemy.exc import IntegrityError
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Literal, Optional
+from async_model import UnitOfWork, get_unit_of_work, stream_model_operation
+from coalescing import read_coalescer
+from model import get_books_written_at, get_all_books_with_filters, get_books_etag, get_book_etag, get_authors_of_book, get_book_by_isbn, stream_books, get_books_by_isbns, delete_book_by_isbn, insert_book, insert_books, upsert_book
+from utils import GenericSuccess, BulkResult, ImportResult, IMPORT_CHUNK_SIZE, get_error_body, get_bulk_result_body, BULK_INSERT_CHUNK_SIZE, EXPORT_BATCH_SIZE, LOOKUP_CHUNK_SIZE, LOOKUP_MAX_IDENTIFIERS, get_lookup_body, decode_cursor, get_next_cursor_headers, INVALID_CURSOR_BODY, BOOK_NOT_FOUND_BODY, GENERIC_SUCCESS_STATUS_BODY, CREATE_GENERIC_SUCCESS_STATUS_BODY, IDENTIFIER_MISMATCH_BODY, get_not_modified_response
+from serialization import FastJSONResponse, HALSerializer, EXPORT_MEDIA_TYPES, stream_export
+from metrics import time_stage
+from importer import ImportAborted, import_upload
+from write_batching import WRITE_BATCHING, book_write_batcher
+from view import Error, Book, Author, BookLookup
 
 router = APIRouter()
+book_serializer = HALSerializer(Book)
+author_serializer = HALSerializer(Author)
 
 
 @router.get("/api/books/",
             responses={200: {"model": List[Book]},
+                       400: {"model": Error},
                        500: {"model": Error}},
             response_model=List[Book],
             tags=["books"])
-def get_books(page: int = 1, items_per_page: int = 15):
+async def get_books(request: Request,
+                    page: int = Query(1, ge=1),
+                    items_per_page: int = Query(15, ge=1),
+                    after: Optional[str] = None,
+                    title: Optional[str] = None,
+                    year_of_publishing: Optional[int] = None,
+                    year_from: Optional[int] = None,
+                    year_to: Optional[int] = None,
+                    sort_by: Literal["isbn", "title", "year_of_publishing"] = "isbn",
+                    order: Literal["asc", "desc"] = "asc",
+                    fields: Optional[str] = None,
+                    if_none_match: Optional[str] = Header(None)):
     """
     Method that handles a generic GET request for all of the existent books.
+    Pagination is done either by 'page' or by the opaque 'after' cursor found in the
+    'X-Next-Cursor' header of the previous page.
+    Filtering is done by 'title', 'year_of_publishing' or by the 'year_from'/'year_to' range.
+    Only indexed columns can be used for filtering and sorting.
+    Only the fields listed by 'fields' (e.g. 'isbn,links') are selected and returned, all of them if it is missing.
+    Answers with 304 if the 'If-None-Match' header holds the current ETag of the books.
+    The identical requests handled at the same time share one database call and one serialized response.
     """
-    book_list = []
+    try:
+        field_names, include_links = book_serializer.parse_fields(fields)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_FIELDS"))
 
-    db_response = get_all_books_with_filters()
+    etag = get_books_etag()
+    not_modified_response = get_not_modified_response(if_none_match, etag)
+    if not_modified_response:
+        return not_modified_response
 
-    if db_response.error:
+    filters = {name: value for name, value in {"title": title, "year_of_publishing": year_of_publishing}.items() if value is not None}
+
+    try:
+        after_value = decode_cursor(after, composite=sort_by != "isbn") if after is not None else None
+    except ValueError:
+        return FastJSONResponse(status_code=400, content=INVALID_CURSOR_BODY)
+
+    async def get_response(unit_of_work):
+        headers = None
+        db_response = await unit_of_work.run(get_all_books_with_filters, page=page, items_per_page=items_per_page, after=after_value,
+                                             sort_by=sort_by, descending=order == "desc", columns=book_serializer.get_columns(field_names, include_links, "isbn", sort_by), ranges={"year_of_publishing": (year_from, year_to)}, **filters)
+        db_response = await unit_of_work.complete(db_response)
+
+        if db_response.error:
+            status_code = 500
+            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+        else:
+            status_code = 200
+            response_body = book_serializer.serialize(db_response.payload, field_names, include_links)
+            headers = get_next_cursor_headers(db_response.payload, items_per_page, "isbn", sort_by)
+            headers["ETag"] = etag
+
+        return FastJSONResponse(status_code=status_code, content=response_body, headers=headers)
+
+    return await read_coalescer.run(request, etag, get_response, get_books_written_at())
+
+
+@router.get("/api/books/export",
+            responses={200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}},
+                       500: {"model": Error}},
+            response_class=StreamingResponse,
+            tags=["books"])
+async def export_books(format: Literal["ndjson", "csv"] = "ndjson",
+                       batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1)):
+    """
+    Method that handles an export of all the books, ordered by the 'isbn' field, as NDJSON or CSV.
+    The books are read 'batch_size' rows at a time, every batch by a query of its own that starts after the last
+    primary key of the previous one (keyset pagination), and every batch is sent as soon as it is read,
+    so the export takes constant memory whatever the number of books is.
+    """
+    partitions = stream_model_operation(stream_books, batch_size, columns=book_serializer.field_names)
+
+    try:
+        first_partition = await partitions.__anext__()
+    except StopAsyncIteration:
+        first_partition = []
+    except Exception as e:
+        await partitions.aclose()
         status_code = 500
-        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    else:
-        status_code = 200
-        for book in db_response.payload:
-            book_list.append(Book.from_orm(book).dict())
-        response_body = book_list[(page - 1) * items_per_page:page * items_per_page]
+        return FastJSONResponse(status_code=status_code, content=get_error_body(status_code, str(e), "EXCEPTION"))
 
-    return JSONResponse(status_code=status_code, content=response_body)
+    return StreamingResponse(stream_export(book_serializer, format, first_partition, partitions), media_type=EXPORT_MEDIA_TYPES[format])
 
 
 @router.get("/api/books/{isbn}",
@@ -39,11 +115,64 @@ def get_books(page: int = 1, items_per_page: int = 15):
                        500: {"model": Error}},
             response_model=Book,
             tags=["books"])
-def get_book(isbn: str):
+async def get_book(request: Request, isbn: str, fields: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
     """
     Method that handles a GET request for a books by the 'isbn' field.
+    Only the fields listed by 'fields' (e.g. 'isbn,links') are selected and returned, all of them if it is missing.
+    Answers with 304 if the 'If-None-Match' header holds the current ETag of the book.
+    The identical requests handled at the same time share one database call and one serialized response.
     """
-    db_response = get_book_by_isbn(str(isbn))
+    try:
+        field_names, include_links = book_serializer.parse_fields(fields)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_FIELDS"))
+
+    etag = get_book_etag(isbn)
+    if etag is None:
+        # the identifier is not a valid value of the primary key, which the database could still coerce into one
+        return FastJSONResponse(status_code=404, content=BOOK_NOT_FOUND_BODY)
+
+    not_modified_response = get_not_modified_response(if_none_match, etag)
+    if not_modified_response:
+        return not_modified_response
+
+    columns = book_serializer.get_columns(field_names, include_links) if fields is not None else None
+
+    async def get_response(unit_of_work):
+        db_response = await unit_of_work.run(get_book_by_isbn, str(isbn), columns=columns)
+        db_response = await unit_of_work.complete(db_response)
+
+        if db_response.error:
+            status_code = 500
+            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+        elif not db_response.completed_operation:
+            status_code = 404
+            response_body = BOOK_NOT_FOUND_BODY
+        else:
+            status_code = 200
+            if fields is not None:
+                response_body = book_serializer.serialize([db_response.payload], field_names, include_links)[0]
+            else:
+                with time_stage("get_book", "Book", "pydantic"):
+                    response_body = Book.from_orm(db_response.payload).dict()
+
+        return FastJSONResponse(status_code=status_code, content=response_body, headers={"ETag": etag} if status_code == 200 and etag is not None else None)
+
+    return await read_coalescer.run(request, etag, get_response, get_books_written_at())
+
+
+@router.get("/api/books/{isbn}/authors",
+            responses={200: {"model": List[Author]},
+                       404: {"model": Error},
+                       500: {"model": Error}},
+            response_model=List[Author],
+            tags=["books"])
+async def get_book_authors(isbn: str, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a GET request for the authors of a(n) book by its 'isbn' field.
+    """
+    db_response = await unit_of_work.run(get_authors_of_book, str(isbn))
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -53,9 +182,9 @@ def get_book(isbn: str):
         response_body = BOOK_NOT_FOUND_BODY
     else:
         status_code = 200
-        response_body = Book.from_orm(db_response.payload).dict()
+        response_body = author_serializer.serialize(db_response.payload)
 
-    return JSONResponse(status_code=status_code, content=response_body)
+    return FastJSONResponse(status_code=status_code, content=response_body)
 
 
 @router.delete("/api/books/{isbn}",
@@ -64,11 +193,12 @@ def get_book(isbn: str):
                           404: {"model": Error},
                           200: {"model": GenericSuccess}},
                tags=["books"])
-def delete_book(isbn: str):
+async def delete_book(isbn: str, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a DELETE request for a books by the 'isbn' field.
     """
-    db_response = delete_book_by_isbn(str(isbn))
+    db_response = await unit_of_work.run(delete_book_by_isbn, str(isbn))
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -88,7 +218,7 @@ def delete_book(isbn: str):
                         500: {"model": Error}},
              response_model=GenericSuccess,
              tags=["books"])
-def post_book(book: Book):
+async def post_book(book: Book, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a POST request for a book.
     """
@@ -96,7 +226,12 @@ def post_book(book: Book):
     book_dict = book.dict()
     del book_dict["links"]
 
-    db_response = insert_book(**book_dict)
+    if WRITE_BATCHING:
+        db_response = await book_write_batcher.submit(book_dict)
+    else:
+        db_response = await unit_of_work.run(insert_book, **book_dict)
+
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -108,35 +243,117 @@ def post_book(book: Book):
     return JSONResponse(status_code=status_code, content=response_body)
 
 
+@router.post("/api/books/bulk",
+             responses={201: {"model": BulkResult},
+                        207: {"model": BulkResult}},
+             response_model=BulkResult,
+             tags=["books"])
+async def post_books_bulk(books: List[Book], chunk_size: int = Query(BULK_INSERT_CHUNK_SIZE, ge=1), unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a POST request for many books.
+    The books are inserted in chunks of 'chunk_size' rows and every one of them gets its own result,
+    so a failing book (e.g. a duplicate) does not abort the others.
+    """
+    books_list = []
+    for book in books:
+        book_dict = book.dict()
+        del book_dict["links"]
+        books_list.append(book_dict)
+
+    db_response = await unit_of_work.run(insert_books, books_list, chunk_size)
+    db_response = await unit_of_work.complete(db_response)
+
+    status_code = 201 if db_response.completed_operation else 207
+    # the whole batch fails if the commit does
+    response_body = get_bulk_result_body(db_response.payload or [db_response.error] * len(books_list))
+
+    return JSONResponse(status_code=status_code, content=response_body)
+
+
+@router.post("/api/books/import",
+             responses={200: {"model": ImportResult},
+                        500: {"model": Error}},
+             response_model=ImportResult,
+             tags=["books"])
+async def import_books(request: Request,
+                       format: Literal["ndjson", "csv"] = "ndjson",
+                       mode: Literal["insert", "upsert"] = "insert",
+                       chunk_size: int = Query(IMPORT_CHUNK_SIZE, ge=1),
+                       skip: int = Query(0, ge=0)):
+    """
+    Method that handles the import of a CSV (with a header line) or NDJSON file of books, sent as the body of the request.
+    The records are validated, deduplicated and written in chunks of 'chunk_size' - 'mode' tells if the existing books
+    are rejected or updated. The result counts the records and lists the first errors.
+    If the database fails, the error tells how many records were committed: a retry can skip them ('skip').
+    """
+    try:
+        response_body = await import_upload(request, "books", format, mode, chunk_size, skip)
+        status_code = 200
+    except ImportAborted as e:
+        status_code = 500
+        response_body = get_error_body(status_code, str(e), "IMPORT_ABORTED")
+
+    return FastJSONResponse(status_code=status_code, content=response_body)
+
+
+@router.post("/api/books/lookup",
+             responses={200: {"model": BookLookup},
+                        500: {"model": Error}},
+             response_model=BookLookup,
+             tags=["books"])
+async def lookup_books(isbns: List[str] = Body(..., max_items=LOOKUP_MAX_IDENTIFIERS),
+                       chunk_size: int = Query(LOOKUP_CHUNK_SIZE, ge=1),
+                       unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a lookup of many books by their 'isbn' field, in a single query per 'chunk_size' isbns.
+    The found books are returned in the order of the isbns, the isbns that do not exist are listed under 'missing'.
+    """
+    db_response = await unit_of_work.run(get_books_by_isbns, isbns, chunk_size)
+    db_response = await unit_of_work.complete(db_response)
+
+    if db_response.error:
+        status_code = 500
+        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+    else:
+        status_code = 200
+        response_body = get_lookup_body(isbns, db_response.payload, book_serializer)
+
+    return FastJSONResponse(status_code=status_code, content=response_body)
+
+
 @router.put("/api/books/{isbn}",
             responses={200: {"model": GenericSuccess},
                        201: {"model": GenericSuccess},
                        500: {"model": Error},
-                       406: {"model": Error}},
+                       406: {"model": Error},
+                       409: {"model": Error}},
             response_model=GenericSuccess,
             tags=["books"])
-def put_book(isbn: str, book: Book):
+async def put_book(isbn: str, book: Book, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a PUT request for a(n) book by its 'isbn' field.
-    Creates the book if it doesn't already exist.
+    Creates the book if it doesn't already exist, in a single upsert statement.
+    The 'isbn' of the body has to match the one of the path.
     """
     request_body = book.dict()
     del request_body["links"]
 
-    db_response = update_book(isbn, request_body)
+    if str(request_body["isbn"]) != str(isbn):
+        return JSONResponse(status_code=406, content=IDENTIFIER_MISMATCH_BODY)
 
-    if db_response.error:
+    db_response = await unit_of_work.run(upsert_book, request_body)
+    db_response = await unit_of_work.complete(db_response)
+
+    if isinstance(db_response.error, IntegrityError):
+        # e.g. another row already has the values of a unique key
+        status_code = 409
+        response_body = get_error_body(status_code, str(db_response.error), "CONFLICT")
+    elif db_response.error:
         status_code = 500
         response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    elif db_response.completed_operation is False:
-        db_response = insert_book(**request_body)
-
-        if db_response.error:
-            status_code = 500
-            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-        else:
-            status_code = 201
-            response_body = CREATE_GENERIC_SUCCESS_STATUS_BODY
+    elif db_response.payload:
+        status_code = 201
+        response_body = CREATE_GENERIC_SUCCESS_STATUS_BODY
     else:
         status_code = 200
         response_body = GENERIC_SUCCESS_STATUS_BODY
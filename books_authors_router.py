@@ -1,36 +1,109 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from typing import List
-from model import get_all_books_authors_with_filters, get_books_authors_by_id, delete_books_authors_by_id, insert_books_authors, update_books_authors
-from utils import GenericSuccess, get_error_body, BOOKS_AUTHORS_NOT_FOUND_BODY, GENERIC_SUCCESS_STATUS_BODY, CREATE_GENERIC_SUCCESS_STATUS_BODY
-from view import Error, Books_Authors
+from fastapi import APIRouter, Body, Depends, Header, Query, Request
+from sqlalchemy.exc import IntegrityError
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Literal, Optional
+from async_model import UnitOfWork, get_unit_of_work, stream_model_operation
+from coalescing import read_coalescer
+from model import get_books_authors_written_at, get_all_books_authors_with_filters, get_all_books_authors_etag, get_books_authors_etag, get_books_authors_by_id, stream_books_authors, get_many_books_authors_by_ids, delete_books_authors_by_id, insert_books_authors, insert_many_books_authors, upsert_books_authors
+from utils import GenericSuccess, BulkResult, ImportResult, IMPORT_CHUNK_SIZE, get_error_body, get_bulk_result_body, BULK_INSERT_CHUNK_SIZE, EXPORT_BATCH_SIZE, LOOKUP_CHUNK_SIZE, LOOKUP_MAX_IDENTIFIERS, get_lookup_body, decode_cursor, get_next_cursor_headers, INVALID_CURSOR_BODY, BOOKS_AUTHORS_NOT_FOUND_BODY, GENERIC_SUCCESS_STATUS_BODY, CREATE_GENERIC_SUCCESS_STATUS_BODY, IDENTIFIER_MISMATCH_BODY, get_not_modified_response
+from serialization import FastJSONResponse, HALSerializer, EXPORT_MEDIA_TYPES, stream_export
+from metrics import time_stage
+from importer import ImportAborted, import_upload
+from write_batching import WRITE_BATCHING, books_authors_write_batcher
+from view import Error, Books_Authors, Books_AuthorsLookup
 
 router = APIRouter()
+books_authors_serializer = HALSerializer(Books_Authors)
 
 
 @router.get("/api/books_authors/",
             responses={200: {"model": List[Books_Authors]},
+                       400: {"model": Error},
                        500: {"model": Error}},
             response_model=List[Books_Authors],
             tags=["books_authors"])
-def get_books_authors(page: int = 1, items_per_page: int = 15):
+async def get_books_authors(request: Request,
+                            page: int = Query(1, ge=1),
+                            items_per_page: int = Query(15, ge=1),
+                            after: Optional[str] = None,
+                            isbn: Optional[str] = None,
+                            author_id: Optional[int] = None,
+                            sort_by: Literal["id", "isbn", "author_id"] = "id",
+                            order: Literal["asc", "desc"] = "asc",
+                            fields: Optional[str] = None,
+                            if_none_match: Optional[str] = Header(None)):
     """
     Method that handles a generic GET request for all of the existent books_authors.
+    Pagination is done either by 'page' or by the opaque 'after' cursor found in the
+    'X-Next-Cursor' header of the previous page.
+    Filtering is done by 'isbn' or 'author_id'.
+    Only indexed columns can be used for filtering and sorting.
+    Only the fields listed by 'fields' (e.g. 'id,links') are selected and returned, all of them if it is missing.
+    Answers with 304 if the 'If-None-Match' header holds the current ETag of the books_authors.
+    The identical requests handled at the same time share one database call and one serialized response.
     """
-    books_authors_list = []
+    try:
+        field_names, include_links = books_authors_serializer.parse_fields(fields)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_FIELDS"))
 
-    db_response = get_all_books_authors_with_filters()
+    etag = get_all_books_authors_etag()
+    not_modified_response = get_not_modified_response(if_none_match, etag)
+    if not_modified_response:
+        return not_modified_response
 
-    if db_response.error:
+    filters = {name: value for name, value in {"isbn": isbn, "author_id": author_id}.items() if value is not None}
+
+    try:
+        after_value = decode_cursor(after, composite=sort_by != "id") if after is not None else None
+    except ValueError:
+        return FastJSONResponse(status_code=400, content=INVALID_CURSOR_BODY)
+
+    async def get_response(unit_of_work):
+        headers = None
+        db_response = await unit_of_work.run(get_all_books_authors_with_filters, page=page, items_per_page=items_per_page, after=after_value,
+                                             sort_by=sort_by, descending=order == "desc", columns=books_authors_serializer.get_columns(field_names, include_links, "id", sort_by), **filters)
+        db_response = await unit_of_work.complete(db_response)
+
+        if db_response.error:
+            status_code = 500
+            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+        else:
+            status_code = 200
+            response_body = books_authors_serializer.serialize(db_response.payload, field_names, include_links)
+            headers = get_next_cursor_headers(db_response.payload, items_per_page, "id", sort_by)
+            headers["ETag"] = etag
+
+        return FastJSONResponse(status_code=status_code, content=response_body, headers=headers)
+
+    return await read_coalescer.run(request, etag, get_response, get_books_authors_written_at())
+
+
+@router.get("/api/books_authors/export",
+            responses={200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}},
+                       500: {"model": Error}},
+            response_class=StreamingResponse,
+            tags=["books_authors"])
+async def export_books_authors(format: Literal["ndjson", "csv"] = "ndjson",
+                               batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1)):
+    """
+    Method that handles an export of all the books_authors, ordered by the 'id' field, as NDJSON or CSV.
+    The books_authors are read 'batch_size' rows at a time, every batch by a query of its own that starts after the last
+    primary key of the previous one (keyset pagination), and every batch is sent as soon as it is read,
+    so the export takes constant memory whatever the number of books_authors is.
+    """
+    partitions = stream_model_operation(stream_books_authors, batch_size, columns=books_authors_serializer.field_names)
+
+    try:
+        first_partition = await partitions.__anext__()
+    except StopAsyncIteration:
+        first_partition = []
+    except Exception as e:
+        await partitions.aclose()
         status_code = 500
-        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    else:
-        status_code = 200
-        for books_authors in db_response.payload:
-            books_authors_list.append(Books_Authors.from_orm(books_authors).dict())
-        response_body = books_authors_list[(page - 1) * items_per_page:page * items_per_page]
+        return FastJSONResponse(status_code=status_code, content=get_error_body(status_code, str(e), "EXCEPTION"))
 
-    return JSONResponse(status_code=status_code, content=response_body)
+    return StreamingResponse(stream_export(books_authors_serializer, format, first_partition, partitions), media_type=EXPORT_MEDIA_TYPES[format])
 
 
 @router.get("/api/books_authors/{id}",
@@ -39,23 +112,50 @@ def get_books_authors(page: int = 1, items_per_page: int = 15):
                        500: {"model": Error}},
             response_model=Books_Authors,
             tags=["books_authors"])
-def get_books_authors(id: str):
+async def get_books_authors(request: Request, id: str, fields: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
     """
     Method that handles a GET request for a books_authors by the 'id' field.
+    Only the fields listed by 'fields' (e.g. 'id,links') are selected and returned, all of them if it is missing.
+    Answers with 304 if the 'If-None-Match' header holds the current ETag of the books_authors.
+    The identical requests handled at the same time share one database call and one serialized response.
     """
-    db_response = get_books_authors_by_id(str(id))
+    try:
+        field_names, include_links = books_authors_serializer.parse_fields(fields)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_FIELDS"))
 
-    if db_response.error:
-        status_code = 500
-        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    elif not db_response.completed_operation:
-        status_code = 404
-        response_body = BOOKS_AUTHORS_NOT_FOUND_BODY
-    else:
-        status_code = 200
-        response_body = Books_Authors.from_orm(db_response.payload).dict()
+    etag = get_books_authors_etag(id)
+    if etag is None:
+        # the identifier is not a valid value of the primary key, which the database could still coerce into one
+        return FastJSONResponse(status_code=404, content=BOOKS_AUTHORS_NOT_FOUND_BODY)
 
-    return JSONResponse(status_code=status_code, content=response_body)
+    not_modified_response = get_not_modified_response(if_none_match, etag)
+    if not_modified_response:
+        return not_modified_response
+
+    columns = books_authors_serializer.get_columns(field_names, include_links) if fields is not None else None
+
+    async def get_response(unit_of_work):
+        db_response = await unit_of_work.run(get_books_authors_by_id, str(id), columns=columns)
+        db_response = await unit_of_work.complete(db_response)
+
+        if db_response.error:
+            status_code = 500
+            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+        elif not db_response.completed_operation:
+            status_code = 404
+            response_body = BOOKS_AUTHORS_NOT_FOUND_BODY
+        else:
+            status_code = 200
+            if fields is not None:
+                response_body = books_authors_serializer.serialize([db_response.payload], field_names, include_links)[0]
+            else:
+                with time_stage("get_books_authors", "Books_Authors", "pydantic"):
+                    response_body = Books_Authors.from_orm(db_response.payload).dict()
+
+        return FastJSONResponse(status_code=status_code, content=response_body, headers={"ETag": etag} if status_code == 200 and etag is not None else None)
+
+    return await read_coalescer.run(request, etag, get_response, get_books_authors_written_at())
 
 
 @router.delete("/api/books_authors/{id}",
@@ -64,11 +164,12 @@ def get_books_authors(id: str):
                           404: {"model": Error},
                           200: {"model": GenericSuccess}},
                tags=["books_authors"])
-def delete_books_authors(id: str):
+async def delete_books_authors(id: str, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a DELETE request for a books_authors by the 'id' field.
     """
-    db_response = delete_books_authors_by_id(str(id))
+    db_response = await unit_of_work.run(delete_books_authors_by_id, str(id))
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -88,7 +189,7 @@ def delete_books_authors(id: str):
                         500: {"model": Error}},
              response_model=GenericSuccess,
              tags=["books_authors"])
-def post_books_authors(books_authors: Books_Authors):
+async def post_books_authors(books_authors: Books_Authors, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a POST request for a books_authors.
     """
@@ -96,7 +197,12 @@ def post_books_authors(books_authors: Books_Authors):
     books_authors_dict = books_authors.dict()
     del books_authors_dict["links"]
 
-    db_response = insert_books_authors(**books_authors_dict)
+    if WRITE_BATCHING:
+        db_response = await books_authors_write_batcher.submit(books_authors_dict)
+    else:
+        db_response = await unit_of_work.run(insert_books_authors, **books_authors_dict)
+
+    db_response = await unit_of_work.complete(db_response)
 
     if db_response.error:
         status_code = 500
@@ -108,35 +214,117 @@ def post_books_authors(books_authors: Books_Authors):
     return JSONResponse(status_code=status_code, content=response_body)
 
 
+@router.post("/api/books_authors/bulk",
+             responses={201: {"model": BulkResult},
+                        207: {"model": BulkResult}},
+             response_model=BulkResult,
+             tags=["books_authors"])
+async def post_books_authors_bulk(books_authors: List[Books_Authors], chunk_size: int = Query(BULK_INSERT_CHUNK_SIZE, ge=1), unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a POST request for many books_authors.
+    The books_authors are inserted in chunks of 'chunk_size' rows and every one of them gets its own result,
+    so a failing books_authors (e.g. a duplicate) does not abort the others.
+    """
+    books_authors_list = []
+    for item in books_authors:
+        item_dict = item.dict()
+        del item_dict["links"]
+        books_authors_list.append(item_dict)
+
+    db_response = await unit_of_work.run(insert_many_books_authors, books_authors_list, chunk_size)
+    db_response = await unit_of_work.complete(db_response)
+
+    status_code = 201 if db_response.completed_operation else 207
+    # the whole batch fails if the commit does
+    response_body = get_bulk_result_body(db_response.payload or [db_response.error] * len(books_authors_list))
+
+    return JSONResponse(status_code=status_code, content=response_body)
+
+
+@router.post("/api/books_authors/import",
+             responses={200: {"model": ImportResult},
+                        500: {"model": Error}},
+             response_model=ImportResult,
+             tags=["books_authors"])
+async def import_books_authors(request: Request,
+                               format: Literal["ndjson", "csv"] = "ndjson",
+                               mode: Literal["insert", "upsert"] = "insert",
+                               chunk_size: int = Query(IMPORT_CHUNK_SIZE, ge=1),
+                               skip: int = Query(0, ge=0)):
+    """
+    Method that handles the import of a CSV (with a header line) or NDJSON file of books_authors, sent as the body of the request.
+    The records are validated, deduplicated and written in chunks of 'chunk_size' - 'mode' tells if the existing books_authors
+    are rejected or updated. The result counts the records and lists the first errors.
+    If the database fails, the error tells how many records were committed: a retry can skip them ('skip').
+    """
+    try:
+        response_body = await import_upload(request, "books_authors", format, mode, chunk_size, skip)
+        status_code = 200
+    except ImportAborted as e:
+        status_code = 500
+        response_body = get_error_body(status_code, str(e), "IMPORT_ABORTED")
+
+    return FastJSONResponse(status_code=status_code, content=response_body)
+
+
+@router.post("/api/books_authors/lookup",
+             responses={200: {"model": Books_AuthorsLookup},
+                        500: {"model": Error}},
+             response_model=Books_AuthorsLookup,
+             tags=["books_authors"])
+async def lookup_books_authors(ids: List[str] = Body(..., max_items=LOOKUP_MAX_IDENTIFIERS),
+                               chunk_size: int = Query(LOOKUP_CHUNK_SIZE, ge=1),
+                               unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a lookup of many books_authors by their 'id' field, in a single query per 'chunk_size' ids.
+    The found books_authors are returned in the order of the ids, the ids that do not exist are listed under 'missing'.
+    """
+    db_response = await unit_of_work.run(get_many_books_authors_by_ids, ids, chunk_size)
+    db_response = await unit_of_work.complete(db_response)
+
+    if db_response.error:
+        status_code = 500
+        response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
+    else:
+        status_code = 200
+        response_body = get_lookup_body(ids, db_response.payload, books_authors_serializer)
+
+    return FastJSONResponse(status_code=status_code, content=response_body)
+
+
 @router.put("/api/books_authors/{id}",
             responses={200: {"model": GenericSuccess},
                        201: {"model": GenericSuccess},
                        500: {"model": Error},
-                       406: {"model": Error}},
+                       406: {"model": Error},
+                       409: {"model": Error}},
             response_model=GenericSuccess,
             tags=["books_authors"])
-def put_books_authors(id: str, books_authors: Books_Authors):
+async def put_books_authors(id: str, books_authors: Books_Authors, unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
     """
     Method that handles a PUT request for a(n) books_authors by its 'id' field.
-    Creates the books_authors if it doesn't already exist.
+    Creates the books_authors if it doesn't already exist, in a single upsert statement.
+    The 'id' of the body has to match the one of the path.
     """
     request_body = books_authors.dict()
     del request_body["links"]
 
-    db_response = update_books_authors(id, request_body)
+    if str(request_body["id"]) != str(id):
+        return JSONResponse(status_code=406, content=IDENTIFIER_MISMATCH_BODY)
 
-    if db_response.error:
+    db_response = await unit_of_work.run(upsert_books_authors, request_body)
+    db_response = await unit_of_work.complete(db_response)
+
+    if isinstance(db_response.error, IntegrityError):
+        # e.g. another row already has the values of a unique key
+        status_code = 409
+        response_body = get_error_body(status_code, str(db_response.error), "CONFLICT")
+    elif db_response.error:
         status_code = 500
         response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-    elif db_response.completed_operation is False:
-        db_response = insert_books_authors(**request_body)
-
-        if db_response.error:
-            status_code = 500
-            response_body = get_error_body(status_code, str(db_response.error), "EXCEPTION")
-        else:
-            status_code = 201
-            response_body = CREATE_GENERIC_SUCCESS_STATUS_BODY
+    elif db_response.payload:
+        status_code = 201
+        response_body = CREATE_GENERIC_SUCCESS_STATUS_BODY
     else:
         status_code = 200
         response_body = GENERIC_SUCCESS_STATUS_BODY
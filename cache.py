@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ENTITY_CACHE_BACKEND = os.getenv("ENTITY_CACHE_BACKEND", "memory")
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "10000"))
+ENTITY_CACHE_TTL_SECONDS = float(os.getenv("ENTITY_CACHE_TTL_SECONDS", "60"))
+
+
+class CacheBackend:
+    """
+    Interface of the backends used by the entity cache.
+    The values are plain dictionaries of column values, so a shared backend (e.g. Redis)
+    only has to be able to store serializable data.
+    """
+    def get(self, key):
+        """
+        Returns the value stored for the key or None if it is missing or expired.
+        :param key: the key of the entry
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """
+        Stores a value for a key.
+        :param key: the key of the entry
+        :param value: the value of the entry
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Removes the entry of a key, if there is one.
+        :param key: the key of the entry
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Removes all the entries.
+        """
+        raise NotImplementedError
+
+    def statistics(self):
+        """
+        Returns the hit/miss/eviction counters of the backend.
+        """
+        raise NotImplementedError
+
+
+class InMemoryLRUCache(CacheBackend):
+    """
+    In-process cache bounded by the number of entries (least recently used entries are evicted first)
+    and by the age of the entries.
+    """
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def statistics(self):
+        with self.lock:
+            return {
+                "backend": "memory",
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+def create_cache_backend(backend_name):
+    """
+    Builds the cache backend configured by ENTITY_CACHE_BACKEND ('memory' or 'none').
+    :param backend_name: the name of the backend
+    """
+    if backend_name == "memory":
+        return InMemoryLRUCache(ENTITY_CACHE_MAX_ENTRIES, ENTITY_CACHE_TTL_SECONDS)
+    if backend_name == "none":
+        return None
+    raise ValueError(f"Unknown cache backend '{backend_name}'.")
+
+
+entity_cache = create_cache_backend(ENTITY_CACHE_BACKEND)
+
+
+def get_entity_cache_key(entity, identifier_key):
+    """
+    Returns the cache key of an entity identified by its primary key.
+    :param entity: the type of the entity
+    :param identifier_key: the canonical form of the primary key value
+    """
+    return f"{entity.__tablename__}:{identifier_key}"
+
+
+def get_cache_statistics():
+    """
+    Returns the counters of the entity cache.
+    """
+    if entity_cache is None:
+        return {"backend": "none"}
+    return entity_cache.statistics()
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from metrics import Counter, Gauge
+
+# the number of the most recent changes kept in memory - a subscriber can resume after any of them
+CHANGE_FEED_LOG_SIZE = int(os.getenv("CHANGE_FEED_LOG_SIZE", "10000"))
+# an idle subscription gets a heartbeat this often, so the proxies keep it open and a gone client is noticed
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+
+# the names of the entities in the changes, the same as in the paths of the API
+CHANGE_FEED_ENTITIES = ("books", "authors", "books_authors")
+
+change_feed_events_total = Counter("change_feed_events_total", "Number of changes published to the change feed.",
+                                   ("entity", "operation"))
+change_feed_subscribers = Gauge("change_feed_subscribers", "Number of open change feed subscriptions.")
+
+
+def parse_entity_names(entities):
+    """
+    Parses the comma separated names of the entities a subscriber is interested in - None (all of them) if missing.
+    Raises ValueError if a name is not one of CHANGE_FEED_ENTITIES.
+    :param entities: the comma separated names of the entities
+    """
+    if entities is None:
+        return None
+    entity_names = {entity_name.strip() for entity_name in entities.split(",") if entity_name.strip()}
+    unknown_names = entity_names.difference(CHANGE_FEED_ENTITIES)
+    if unknown_names:
+        raise ValueError(f"Unknown entities: {', '.join(sorted(unknown_names))}.")
+    return entity_names
+
+
+def encode_json(message):
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def encode_server_sent_event(message):
+    """
+    Encodes a message of the change feed as a Server-Sent Event - a comment line for a heartbeat (None).
+    The id of the event ('<epoch>-<sequence>') comes back in the 'Last-Event-ID' header when the client reconnects.
+    :param message: the change or reset message
+    """
+    if message is None:
+        return b": heartbeat\n\n"
+    return f"id: {message['epoch']}-{message['sequence']}\nevent: {message['type']}\ndata: {encode_json(message)}\n\n".encode("utf-8")
+
+
+def parse_event_id(event_id):
+    """
+    Returns the (epoch, sequence) of a Server-Sent Event id - (None, None) if it is malformed.
+    :param event_id: the value of the 'Last-Event-ID' header
+    """
+    epoch, _, sequence = event_id.rpartition("-")
+    try:
+        return epoch or None, int(sequence)
+    except ValueError:
+        return None, None
+
+
+class ChangeLog:
+    """
+    Bounded in-memory log of the committed writes, published by the write wrappers of the model.
+    Every change gets the next sequence number, so a subscriber resumes after the last change it received.
+    The subscribers that resume after a change the log no longer holds (or that was published by another run
+    of the process) get a reset message: they have to read the entities again, the changes follow from there on.
+    The changes are published from the threads of the threadpool, the subscribers are woken up on their event loop.
+    """
+    def __init__(self, max_events):
+        self.events = deque(maxlen=max_events)
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        # distinguishes the sequence numbers of this process from the ones of a previous run or of another worker
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def publish(self, entity_name, operation, key, data=None):
+        """
+        Appends a change to the log and wakes up the subscribers.
+        :param entity_name: the name of the entity (one of CHANGE_FEED_ENTITIES)
+        :param operation: 'insert', 'update', 'upsert' (inserted or updated), 'delete' or 'reload' (unknown rows were
+        written outside of the service, e.g. by the command line importer, so the entity has to be read again)
+        :param key: a dictionary with the identifier by which the written rows were matched - None for a reload
+        :param data: the written fields - None for a delete or a reload
+        """
+        with self.lock:
+            self.sequence += 1
+            self.events.append({"type": "change", "epoch": self.epoch, "sequence": self.sequence, "entity": entity_name,
+                                "operation": operation, "key": key, "data": data, "time": time.time()})
+            subscribers = list(self.subscribers)
+        change_feed_events_total.inc((entity_name, operation))
+
+        for loop, wakeup in subscribers:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # the event loop of the subscriber is closed
+                pass
+
+    def get_reset_message(self):
+        with self.lock:
+            return {"type": "reset", "epoch": self.epoch, "sequence": self.sequence}
+
+    def get_events(self, after):
+        """
+        Returns the changes published after a sequence number - None if some of them are no longer in the log.
+        :param after: the sequence number of the last change the subscriber received
+        """
+        with self.lock:
+            first_sequence = self.events[0]["sequence"] if self.events else self.sequence + 1
+            if after < first_sequence - 1 or after > self.sequence:
+                return None
+            return list(islice(self.events, after - first_sequence + 1, None))
+
+    async def follow(self, after=None, epoch=None, entity_names=None, heartbeat_seconds=CHANGE_FEED_HEARTBEAT_SECONDS):
+        """
+        Async generator of the messages of a subscription: the changes, the reset messages and a None heartbeat
+        whenever no change was published for 'heartbeat_seconds'. It only ends when the subscriber stops iterating.
+        :param after: the sequence number of the last change the subscriber received - None to follow the new changes only
+        :param epoch: the epoch of that change - None for the current one
+        :param entity_names: the names of the entities the subscriber is interested in - None for all of them
+        :param heartbeat_seconds: the maximum time without a message
+        """
+        wakeup = asyncio.Event()
+        subscriber = (asyncio.get_running_loop(), wakeup)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        change_feed_subscribers.inc()
+        try:
+            if after is None:
+                after = self.sequence
+            elif epoch is not None and epoch != self.epoch:
+                after = -1
+
+            while True:
+                # cleared before reading the log, so a change published meanwhile still wakes the subscriber up
+                wakeup.clear()
+                events = self.get_events(after)
+                if events is None:
+                    message = self.get_reset_message()
+                    after = message["sequence"]
+                    yield message
+                    continue
+
+                for event in events:
+                    after = event["sequence"]
+                    if entity_names is None or event["entity"] in entity_names:
+                        yield event
+                if events:
+                    continue
+
+                try:
+                    await asyncio.wait_for(wakeup.wait(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
+            change_feed_subscribers.dec()
+
+    def statistics(self):
+        with self.lock:
+            return {
+                "epoch": self.epoch,
+                "sequence": self.sequence,
+                "first_sequence": self.events[0]["sequence"] if self.events else self.sequence + 1,
+                "events": len(self.events),
+                "max_events": self.events.maxlen,
+                "subscribers": len(self.subscribers)
+            }
+
+
+change_log = ChangeLog(CHANGE_FEED_LOG_SIZE)
+
+
+def get_change_feed_statistics():
+    """
+    Returns the range of sequence numbers held by the change log and the number of subscribers.
+    """
+    return change_log.statistics()
@@ -0,0 +1,82 @@
+import anyio
+from fastapi import APIRouter, Header, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from changes import change_log, encode_json, encode_server_sent_event, parse_entity_names, parse_event_id
+from utils import get_error_body
+from serialization import FastJSONResponse
+from view import Error
+
+router = APIRouter()
+
+
+async def stream_server_sent_events(messages):
+    async for message in messages:
+        yield encode_server_sent_event(message)
+
+
+async def receive_until_disconnect(websocket, cancel_scope):
+    # the subscribers send nothing, their messages are only read to notice when they leave
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+    cancel_scope.cancel()
+
+
+@router.get("/api/changes",
+            responses={200: {"content": {"text/event-stream": {}}},
+                       400: {"model": Error}},
+            response_class=StreamingResponse,
+            tags=["changes"])
+async def get_changes(entities: Optional[str] = None,
+                      after: Optional[int] = Query(None, ge=0),
+                      epoch: Optional[str] = None,
+                      last_event_id: Optional[str] = Header(None)):
+    """
+    Method that handles a subscription to the change feed, as Server-Sent Events: every committed insert, update and
+    delete of the entities listed by 'entities' (e.g. 'books,authors', all of them if it is missing) is sent as
+    a 'change' event holding its sequence number, the key and the written fields of the entity - a 'reload' change
+    (without key) when rows were written outside of the service and the entity has to be read again.
+    The subscription resumes after the change whose sequence number (and epoch) is given by 'after' and 'epoch' or by
+    the 'Last-Event-ID' header of a reconnecting client, otherwise it starts with the next change. If some changes
+    are no longer held by the change log, a 'reset' event tells the subscriber to read the entities again.
+    """
+    try:
+        entity_names = parse_entity_names(entities)
+    except ValueError as e:
+        return FastJSONResponse(status_code=400, content=get_error_body(400, str(e), "INVALID_ENTITIES"))
+
+    if after is None and last_event_id is not None:
+        epoch, after = parse_event_id(last_event_id)
+
+    messages = change_log.follow(after, epoch, entity_names)
+    return StreamingResponse(stream_server_sent_events(messages), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/api/changes/ws")
+async def websocket_changes(websocket: WebSocket,
+                            entities: Optional[str] = None,
+                            after: Optional[int] = Query(None, ge=0),
+                            epoch: Optional[str] = None):
+    """
+    Method that handles a subscription to the change feed over a WebSocket: the same 'change' and 'reset' messages
+    as the Server-Sent Events of '/api/changes', sent as JSON text messages, and a 'heartbeat' message
+    whenever the feed is idle.
+    """
+    try:
+        entity_names = parse_entity_names(entities)
+    except ValueError as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
+
+    await websocket.accept()
+    messages = change_log.follow(after, epoch, entity_names)
+    try:
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(receive_until_disconnect, websocket, task_group.cancel_scope)
+            async for message in messages:
+                await websocket.send_text(encode_json(message if message is not None else {"type": "heartbeat"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await messages.aclose()
@@ -0,0 +1,117 @@
+import asyncio
+from starlette.requests import Request
+from starlette.responses import Response
+from async_model import UnitOfWork
+from db import get_bool_env, primary_reads
+from metrics import Counter, Gauge
+from replication import replicas_may_lag
+
+# when enabled, the identical reads that run at the same time share one database call and one serialized response
+READ_COALESCING = get_bool_env("READ_COALESCING", "true")
+
+read_coalescing_requests_total = Counter("read_coalescing_requests_total",
+                                         "Number of coalesced reads (role: leader if the read ran the database call, "
+                                         "joined if it got the response of a read already in flight).",
+                                         ("endpoint", "role"))
+read_coalescing_in_flight = Gauge("read_coalescing_in_flight", "Number of coalesced reads in flight.")
+
+
+def copy_response(response):
+    """
+    Returns a new response with the status code, the headers and the (already serialized) body of a response,
+    so that the middlewares of every request can add their own headers.
+    :param response: the response that is to be copied
+    """
+    return Response(content=response.body, status_code=response.status_code, headers=dict(response.headers))
+
+
+async def run_read(operation):
+    """
+    Runs a read on a read-only unit of work of its own and releases the unit of work afterwards.
+    :param operation: the coroutine function that is to be run - called with the unit of work, it returns the response
+    """
+    unit_of_work = UnitOfWork(read_only=True)
+    try:
+        return await operation(unit_of_work)
+    finally:
+        await unit_of_work.close()
+
+
+class ReadCoalescer:
+    """
+    Single-flight execution of the reads: the requests for the same path and query parameters that arrive while
+    the same read is in flight wait for its response instead of running their own database call.
+    The version of the read data (the ETag built out of the version counters, which 'register_entity_change' bumps
+    on every committed write) is part of the key, so a request that arrives after a write does not join the reads
+    started before it but starts a new one.
+    The read runs in a task of its own, so a client that disconnects does not cancel the read of the others.
+    A read of data written less than REPLICA_CATCH_UP_SECONDS ago goes to the primary: the version already counts
+    the write, which a lagging replica would not return, so its old data would be sent (and revalidated by 304s)
+    under the new ETag.
+    """
+    def __init__(self, enabled=READ_COALESCING):
+        self.enabled = enabled
+        self.flights = {}
+        self.leaders = 0
+        self.joined = 0
+
+    def get_key(self, request, version):
+        # the reads of a client that has to read its own writes from the primary do not share the reads from the replicas
+        return request.url.path, tuple(sorted(request.query_params.multi_items())), version, primary_reads.get()
+
+    def forget(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        read_coalescing_in_flight.dec()
+
+    async def run(self, request: Request, version, operation, written_at=None):
+        """
+        Returns the response of a read - the response of the identical read in flight, if there is one.
+        :param request: the request of the read
+        :param version: the version of the data the read returns (e.g. the ETag of the entity or of the whole table)
+        :param operation: the coroutine function that runs the read - called with a read-only unit of work,
+        it returns the response
+        :param written_at: the time.monotonic() of the last write on the data the read returns - None if unknown
+        """
+        if not primary_reads.get() and replicas_may_lag(written_at):
+            token = primary_reads.set(True)
+            try:
+                return await self.run(request, version, operation)
+            finally:
+                primary_reads.reset(token)
+
+        if not self.enabled:
+            return await run_read(operation)
+
+        endpoint = request.scope["endpoint"].__name__
+        key = self.get_key(request, version)
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = asyncio.get_running_loop().create_task(run_read(operation))
+            read_coalescing_in_flight.inc()
+            flight.add_done_callback(lambda _: self.forget(key, flight))
+            self.leaders += 1
+            read_coalescing_requests_total.inc((endpoint, "leader"))
+        else:
+            self.joined += 1
+            read_coalescing_requests_total.inc((endpoint, "joined"))
+
+        return copy_response(await asyncio.shield(flight))
+
+    def statistics(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self.flights),
+            "leaders": self.leaders,
+            "joined": self.joined
+        }
+
+
+read_coalescer = ReadCoalescer()
+
+
+def get_read_coalescing_statistics():
+    """
+    Returns the number of reads in flight and the number of reads that ran or joined a database call.
+    """
+    return read_coalescer.statistics()
@@ -6,6 +6,8 @@ CREATE TABLE `Books` (
 `title` varchar(100) NOT NULL,
 `year_of_publishing` int(11) NOT NULL,
 UNIQUE KEY `books_un_1` (`title`, `year_of_publishing`),
+KEY `books_ix_1` (`year_of_publishing`),
+FULLTEXT KEY `books_ft_1` (`title`),
 PRIMARY KEY (`isbn`)
 );
 
@@ -13,13 +15,18 @@ CREATE TABLE `Authors` (
 `author_id` int(11) NOT NULL,
 `first_name` varchar(100) NOT NULL,
 `last_name` varchar(100) NOT NULL,
+KEY `authors_ix_1` (`last_name`, `first_name`),
+KEY `authors_ix_2` (`first_name`),
+FULLTEXT KEY `authors_ft_1` (`first_name`, `last_name`),
 PRIMARY KEY (`author_id`)
 );
 
 CREATE TABLE `Books_Authors` (
 `id` int(11) NOT NULL,
-`isbn` int(11) NOT NULL,
+`isbn` varchar(100) NOT NULL,
 `author_id` int(11) NOT NULL,
+KEY `books_authors_ix_1` (`isbn`),
+KEY `books_authors_ix_2` (`author_id`),
 PRIMARY KEY (`id`)
 );
 
@@ -1,15 +1,404 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 Base = declarative_base()
 
+
+def get_bool_env(name, default="false"):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
 DB_TYPE = "mysql+mysqlconnector"
+ASYNC_DB_TYPE = "mysql+aiomysql"
 DB_USER = "root"
 DB_USER_PASS = "password"
 DB_HOST = "localhost"
 DB_PORT = 3306
 DB_INSTANCE = "generated_db"
 
-connection_string = f"{DB_TYPE}://{DB_USER}:{DB_USER_PASS}@{DB_HOST}:{DB_PORT}/{DB_INSTANCE}"
+# when enabled, the routers run the model operations on the asyncio engine instead of the threadpool
+DB_ASYNC = get_bool_env("DB_ASYNC")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = get_bool_env("DB_POOL_PRE_PING")
+
+# fraction (0 - 1) of the SQL statements that are logged - 0 turns the SQL logging off
+DB_SQL_LOG_SAMPLE_RATE = float(os.getenv("DB_SQL_LOG_SAMPLE_RATE", "0"))
+
+connection_string = os.getenv("DB_URL", f"{DB_TYPE}://{DB_USER}:{DB_USER_PASS}@{DB_HOST}:{DB_PORT}/{DB_INSTANCE}")
+async_connection_string = os.getenv("ASYNC_DB_URL", f"{ASYNC_DB_TYPE}://{DB_USER}:{DB_USER_PASS}@{DB_HOST}:{DB_PORT}/{DB_INSTANCE}")
+
+# comma separated URLs of the read replicas (and of their asyncio counterparts, in the same order) - none by default
+DB_REPLICA_URLS = [url for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url]
+ASYNC_DB_REPLICA_URLS = [url for url in os.getenv("ASYNC_DB_REPLICA_URLS", "").split(",") if url]
+# 'round_robin' or 'least_connections' (the replica with the fewest checked out connections)
+DB_REPLICA_SELECTION = os.getenv("DB_REPLICA_SELECTION", "round_robin")
+# a replica lagging behind the primary by more than this is taken out of the rotation until it catches up
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
+
+sql_logger = logging.getLogger("db.sql")
+
+
+class PoolWaitStatistics:
+    """
+    Keeps track of the time spent waiting for a connection to be checked out of a pool.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait_seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "total_wait_seconds": self.total_wait_seconds,
+                "average_wait_seconds": self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_wait_seconds": self.max_wait_seconds
+            }
+
+
+class WaitTimingPoolMixin:
+    """
+    Measures how long every checkout waits for a connection of the pool.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_statistics = PoolWaitStatistics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_statistics.record(time.perf_counter() - start)
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.wait_statistics = self.wait_statistics
+        return new_pool
+
+
+class WaitTimingQueuePool(WaitTimingPoolMixin, QueuePool):
+    pass
+
+
+class WaitTimingAsyncAdaptedQueuePool(WaitTimingPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def log_sampled_statement(conn, cursor, statement, parameters, context, executemany):
+    if random.random() < DB_SQL_LOG_SAMPLE_RATE:
+        sql_logger.info("%s %r", statement, parameters)
+
+
+def get_engine_options(poolclass):
+    return {
+        "isolation_level": "READ UNCOMMITTED",
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+
+def enable_sql_logging(sync_engine):
+    if DB_SQL_LOG_SAMPLE_RATE > 0:
+        if not sql_logger.handlers:
+            sql_logger.addHandler(logging.StreamHandler())
+        sql_logger.setLevel(logging.INFO)
+        event.listen(sync_engine, "before_cursor_execute", log_sampled_statement)
+
+
+engine = create_engine(connection_string, **get_engine_options(WaitTimingQueuePool))
+enable_sql_logging(engine)
+Session = sessionmaker()
+
+async_engine = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    async_engine = create_async_engine(async_connection_string, **get_engine_options(WaitTimingAsyncAdaptedQueuePool))
+    enable_sql_logging(async_engine.sync_engine)
+
+
+# set for the requests that have to read from the primary (e.g. right after a write of the same client)
+primary_reads = ContextVar("primary_reads", default=False)
+
+
+def get_replication_lag(connection):
+    """
+    Returns the number of seconds a replica lags behind its primary - None if its replication is broken.
+    A MariaDB/MySQL instance that replicates from nowhere (e.g. a second local instance) and the other
+    databases are taken as up to date, as long as they answer.
+    :param connection: a connection to the replica
+    """
+    if connection.dialect.name not in ("mysql", "mariadb"):
+        connection.execute(text("SELECT 1"))
+        return 0.0
+    status = connection.execute(text("SHOW SLAVE STATUS")).mappings().first()
+    if status is None:
+        return 0.0
+    lag = status["Seconds_Behind_Master"]
+    return float(lag) if lag is not None else None
+
+
+class Replica:
+    """
+    A read replica: its blocking engine, its asyncio engine (with DB_ASYNC enabled) and the outcome of its last health check.
+    """
+    def __init__(self, name, url, async_url=None):
+        self.name = name
+        self.engine = create_engine(url, **get_engine_options(WaitTimingQueuePool))
+        enable_sql_logging(self.engine)
+        self.async_engine = None
+        if async_url is not None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            self.async_engine = create_async_engine(async_url, **get_engine_options(WaitTimingAsyncAdaptedQueuePool))
+            enable_sql_logging(self.async_engine.sync_engine)
+        self.healthy = True
+        self.lag_seconds = None
+        self.last_error = None
+        self.last_check = None
+
+    def get_checked_out_connections(self):
+        pool = (self.async_engine.sync_engine if self.async_engine is not None else self.engine).pool
+        return pool.checkedout() if isinstance(pool, QueuePool) else 0
+
+    def check(self):
+        """
+        Measures the replication lag of the replica and takes it out of the rotation if it is too high,
+        if the replication is broken or if the replica does not answer.
+        """
+        try:
+            with self.engine.connect() as connection:
+                self.lag_seconds = get_replication_lag(connection)
+            self.last_error = None
+        except Exception as e:
+            self.lag_seconds = None
+            self.last_error = str(e)
+        self.healthy = self.lag_seconds is not None and self.lag_seconds <= DB_REPLICA_MAX_LAG_SECONDS
+        self.last_check = time.time()
+        return self.healthy
+
+
+if DB_ASYNC and len(ASYNC_DB_REPLICA_URLS) != len(DB_REPLICA_URLS):
+    raise ValueError("ASYNC_DB_REPLICA_URLS has to list the asyncio URLs of all the DB_REPLICA_URLS, in the same order.")
+
+replicas = [Replica(f"replica_{index}", url, ASYNC_DB_REPLICA_URLS[index] if DB_ASYNC else None)
+            for index, url in enumerate(DB_REPLICA_URLS)]
+replica_counter = count()
+
+
+def select_replica():
+    """
+    Returns the healthy replica that serves the next read-only session - None if the reads
+    have to go to the primary (no healthy replica, or the request reads its own writes).
+    """
+    if not replicas or primary_reads.get():
+        return None
+    healthy_replicas = [replica for replica in replicas if replica.healthy]
+    if not healthy_replicas:
+        return None
+    if DB_REPLICA_SELECTION == "least_connections":
+        return min(healthy_replicas, key=lambda replica: replica.get_checked_out_connections())
+    return healthy_replicas[next(replica_counter) % len(healthy_replicas)]
+
+
+def get_read_engine():
+    """
+    Returns the blocking engine that serves the next read-only session.
+    """
+    replica = select_replica()
+    return replica.engine if replica is not None else engine
+
+
+def get_async_read_engine():
+    """
+    Returns the asyncio engine that serves the next read-only session.
+    """
+    replica = select_replica()
+    return replica.async_engine if replica is not None else async_engine
+
+
+def is_replica_session(session):
+    """
+    Tells if a session reads from a replica, whose rows may be older than the ones of the primary.
+    :param session: the session of a model operation
+    """
+    if not replicas:
+        return False
+    bind = session.get_bind()
+    return any(bind is replica.engine or (replica.async_engine is not None and bind is replica.async_engine.sync_engine)
+               for replica in replicas)
+
+
+def get_pool_statistics(pool):
+    """
+    Returns the current state of a connection pool.
+    :param pool: the pool of an engine
+    """
+    statistics = {"status": pool.status()}
+    if isinstance(pool, QueuePool):
+        statistics.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow()
+        })
+    if isinstance(pool, WaitTimingPoolMixin):
+        statistics["wait"] = pool.wait_statistics.as_dict()
+    return statistics
+
+
+def get_all_pool_statistics():
+    """
+    Returns the state of the pools of all the configured engines.
+    """
+    statistics = {"engine": get_pool_statistics(engine.pool)}
+    if async_engine is not None:
+        statistics["async_engine"] = get_pool_statistics(async_engine.sync_engine.pool)
+    for replica in replicas:
+        statistics[replica.name] = get_pool_statistics(replica.engine.pool)
+        if replica.async_engine is not None:
+            statistics[f"{replica.name}_async"] = get_pool_statistics(replica.async_engine.sync_engine.pool)
+    return statistics
+
+
+def get_replica_statistics():
+    """
+    Returns the health, the replication lag and the checked out connections of the read replicas.
+    """
+    return {
+        "selection": DB_REPLICA_SELECTION,
+        "max_lag_seconds": DB_REPLICA_MAX_LAG_SECONDS,
+        "replicas": {
+            replica.name: {
+                "healthy": replica.healthy,
+                "lag_seconds": replica.lag_seconds,
+                "last_error": replica.last_error,
+                "last_check": replica.last_check,
+                "checked_out": replica.get_checked_out_connections()
+            }
+            for replica in replicas
+        }
+    }
+
+
+@contextmanager
+def session_scope(session=None, read_only=False):
+    """
+    Yields the given session or, if there is none, a new Session bound to the engine
+    that is closed on exit. The sessions of the read-only operations are bound to a replica:
+    a new one right away, a given one if it was opened with a 'read_bind' and has not been used yet.
+    :param session: an already opened session
+    :param read_only: True if the operation only reads
+    """
+    if session is not None:
+        read_bind = session.info.get("read_bind")
+        if read_only and read_bind is not None and not session.in_transaction():
+            session.info.setdefault("primary_bind", session.bind)
+            session.bind = read_bind
+        yield session
+    else:
+        with Session(bind=get_read_engine() if read_only else engine, info={"primary_bind": engine}) as new_session:
+            yield new_session
+
+
+@contextmanager
+def primary_session_scope(session):
+    """
+    Yields a session that reads from the primary: the given session if it is not bound to a replica,
+    otherwise a new Session bound to the primary the given session was opened on, closed on exit.
+    :param session: the session of a model operation
+    """
+    if not is_replica_session(session):
+        yield session
+    else:
+        with Session(bind=session.info.get("primary_bind", engine)) as primary_session:
+            yield primary_session
+
+
+def get_unit_of_work(session):
+    """
+    Returns the unit of work a session belongs to - None for the sessions opened by a single model operation.
+    :param session: the session of a model operation
+    """
+    return session.info.get("unit_of_work")
+
+
+def commit_session(session):
+    """
+    Commits the transaction of a session. The session of a unit of work is only flushed:
+    the unit of work commits the writes of all its operations at once, when it is completed.
+    :param session: the session whose transaction is to be committed
+    """
+    unit_of_work = get_unit_of_work(session)
+    if unit_of_work is None:
+        session.commit()
+    else:
+        session.flush()
+        unit_of_work.written = True
+
+
+def rollback_session(session, error):
+    """
+    Rolls back the transaction of a session after a failed operation. The transaction of a unit of work
+    holds the writes of all its operations, so the whole unit of work fails.
+    :param session: the session whose transaction is to be rolled back
+    :param error: the error that made the operation fail
+    """
+    session.rollback()
+    unit_of_work = get_unit_of_work(session)
+    if unit_of_work is not None and unit_of_work.error is None:
+        unit_of_work.error = error
+
+
+def after_commit(session, callback, *args):
+    """
+    Calls a function that registers the writes of an operation (e.g. invalidates the cached rows) once they are committed.
+    In a unit of work it is called right away, so that the next operations do not read the written rows out of date,
+    and once more when the unit of work ends, for whatever concurrent requests read in between.
+    :param session: the session in which the writes were made
+    :param callback: the function that is to be called
+    :param args: the arguments of the function
+    """
+    callback(*args)
+    unit_of_work = get_unit_of_work(session)
+    if unit_of_work is not None:
+        unit_of_work.after_commit_callbacks.append((callback, args))
+
 
-engine = create_engine(connection_string, echo=True, isolation_level="READ UNCOMMITTED")
-Session = sessionmaker()
\ No newline at end of file
+def on_commit(session, callback, *args):
+    """
+    Calls a function that publishes the writes of an operation (e.g. to the change feed) once they are committed,
+    and only then: right away for a single operation, which is already committed, when the unit of work commits
+    for an operation of a unit of work - never if the unit of work rolls back.
+    :param session: the session in which the writes were made
+    :param callback: the function that is to be called
+    :param args: the arguments of the function
+    """
+    unit_of_work = get_unit_of_work(session)
+    if unit_of_work is None:
+        callback(*args)
+    else:
+        unit_of_work.commit_callbacks.append((callback, args))
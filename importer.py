@@ -0,0 +1,358 @@
+"""
+Streaming importer of CSV/NDJSON files into the Books, Authors and Books_Authors tables.
+
+    python importer.py books books.csv --format csv --mode upsert --checkpoint books.checkpoint
+
+The file flows through a generator pipeline: its records are read in chunks, parsed and validated by the view models
+in a process pool, deduplicated by primary key within every chunk and written by chunked multi-row inserts
+(or native upserts). Only a bounded number of chunks is in flight, so the memory stays constant whatever the size
+of the file. The CSV files have a header line with the names of the fields; the NDJSON files hold one object
+per line (extra keys, e.g. the links of an export, are ignored) - the exports of the service can be imported back.
+With '--checkpoint' the number of committed records is saved after every chunk and a later run with the same
+checkpoint resumes after them; the checkpoint is removed once the import completes.
+The running service only sees its own writes, so the command line notifies the imported rows to every URL given by
+'--notify-url' (or IMPORT_NOTIFY_URLS) through 'POST /api/admin/invalidate': the cache, the ETags, the search index
+and the change feed of every process of the service have to learn about them.
+The same pipeline serves the 'POST /api/{entities}/import' upload endpoints, without the process pool.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import SpooledTemporaryFile
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+import view
+
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(os.cpu_count() or 1)))
+# the number of errors listed by the result of an import - all of them are counted
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "100"))
+# the size above which an uploaded file is spooled to disk
+IMPORT_UPLOAD_SPOOL_SIZE = int(os.getenv("IMPORT_UPLOAD_SPOOL_SIZE", str(8 * 1024 * 1024)))
+# comma separated base URLs of the processes of the service (e.g. 'http://localhost:8000') notified after an import
+IMPORT_NOTIFY_URLS = os.getenv("IMPORT_NOTIFY_URLS", "")
+IMPORT_NOTIFY_TIMEOUT_SECONDS = float(os.getenv("IMPORT_NOTIFY_TIMEOUT_SECONDS", "5"))
+
+# entity name -> (view model, primary key field, insert wrapper, upsert wrapper) - the wrappers of 'model' are named,
+# so that the workers and the command line (which sets the database URL first) do not import the database layer
+IMPORTABLE_ENTITIES = {
+    "books": (view.Book, "isbn", "insert_books", "upsert_books"),
+    "authors": (view.Author, "author_id", "insert_authors", "upsert_authors"),
+    "books_authors": (view.Books_Authors, "id", "insert_many_books_authors", "upsert_many_books_authors")
+}
+
+
+class ImportAborted(Exception):
+    """
+    Raised when the database fails (e.g. the connection is lost) rather than the rows: the chunk is not counted
+    as committed, so an import resumed from its checkpoint writes it again.
+    """
+
+
+def read_chunks(text_file, import_format, chunk_size, skip=0):
+    """
+    Generator of the raw records of a file, in chunks: (number of the first record, header, records), where the records
+    are the lines of an NDJSON file or the rows (lists of values) of a CSV file. The records are numbered from 1,
+    the blank NDJSON lines and the CSV header are not records.
+    :param text_file: the file, opened in text mode (with newline='' for CSV)
+    :param import_format: 'ndjson' or 'csv'
+    :param chunk_size: the maximum number of records of a chunk
+    :param skip: the number of records that are skipped (already imported)
+    """
+    if import_format == "csv":
+        records = csv.reader(text_file)
+        header = next(records, None)
+    else:
+        records = (line for line in text_file if line.strip())
+        header = None
+
+    record_number = 0
+    chunk = []
+    for record in records:
+        record_number += 1
+        if record_number <= skip:
+            continue
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield record_number - len(chunk) + 1, header, chunk
+            chunk = []
+    if chunk:
+        yield record_number - len(chunk) + 1, header, chunk
+
+
+def validate_chunk(entity_name, first_record_number, header, records):
+    """
+    Parses and validates a chunk of raw records by the view model of an entity - runs in the workers of the process pool.
+    Returns the (record number, fields) pairs of the valid records and the (record number, message) pairs of the others.
+    :param entity_name: the name of the entity (one of IMPORTABLE_ENTITIES)
+    :param first_record_number: the number of the first record of the chunk
+    :param header: the names of the fields of the CSV rows - None for NDJSON lines
+    :param records: the raw records
+    """
+    view_model = IMPORTABLE_ENTITIES[entity_name][0]
+    field_names = [name for name in view_model.__fields__ if name != "links"]
+    rows = []
+    errors = []
+    for record_number, record in enumerate(records, start=first_record_number):
+        try:
+            values = dict(zip(header, record)) if header is not None else json.loads(record)
+            if not isinstance(values, dict):
+                raise ValueError("The record is not an object.")
+            instance = view_model(**values)
+            rows.append((record_number, {name: getattr(instance, name) for name in field_names}))
+        # the links of the view models raise an AttributeError when a field they refer to is missing
+        except (ValueError, TypeError, AttributeError, ValidationError) as e:
+            errors.append((record_number, str(e).replace("\n", " ")))
+    return rows, errors
+
+
+def get_validated_chunks(chunks, entity_name, executor, max_in_flight):
+    """
+    Generator of the validated chunks, in the order of the file. At most 'max_in_flight' chunks are validated at a time.
+    :param chunks: the iterator of the raw chunks (see 'read_chunks')
+    :param entity_name: the name of the entity
+    :param executor: the process pool that validates the chunks - None to validate them in the caller
+    :param max_in_flight: the maximum number of chunks submitted to the pool and not consumed yet
+    """
+    if executor is None:
+        for first_record_number, header, records in chunks:
+            yield len(records), validate_chunk(entity_name, first_record_number, header, records)
+        return
+
+    pending = []
+    for first_record_number, header, records in chunks:
+        pending.append((len(records), executor.submit(validate_chunk, entity_name, first_record_number, header, records)))
+        if len(pending) >= max_in_flight:
+            record_count, future = pending.pop(0)
+            yield record_count, future.result()
+    for record_count, future in pending:
+        yield record_count, future.result()
+
+
+def deduplicate(rows, primary_key_name):
+    """
+    Keeps the last of the rows of a chunk that share a primary key value. Returns the kept rows and the number of dropped ones.
+    :param rows: the (record number, fields) pairs of the chunk
+    :param primary_key_name: the name of the primary key field
+    """
+    kept_rows = {}
+    for record_number, fields in rows:
+        kept_rows[fields[primary_key_name]] = (record_number, fields)
+    return sorted(kept_rows.values(), key=lambda row: row[0]), len(rows) - len(kept_rows)
+
+
+def load_checkpoint(checkpoint_path, source):
+    """
+    Returns the number of records already imported from a source according to a checkpoint (0 without checkpoint).
+    :param checkpoint_path: the path of the checkpoint file - None if there is no checkpoint
+    :param source: the description of the import (entity, file, format, mode) the checkpoint has to match
+    """
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint.get("source") != source:
+        raise ValueError(f"The checkpoint {checkpoint_path} belongs to another import: {checkpoint.get('source')}.")
+    return checkpoint["records_done"]
+
+
+def save_checkpoint(checkpoint_path, source, records_done):
+    # written aside and renamed, so a crash never leaves a truncated checkpoint
+    temporary_path = f"{checkpoint_path}.tmp"
+    with open(temporary_path, "w") as checkpoint_file:
+        json.dump({"source": source, "records_done": records_done}, checkpoint_file)
+    os.replace(temporary_path, checkpoint_path)
+
+
+def import_records(text_file, entity_name, import_format="ndjson", mode="insert", chunk_size=1000, workers=0,
+                   skip=0, on_chunk=None, on_error=None):
+    """
+    Imports the records of a file into the table of an entity and returns the summary of the import
+    (the counts of the records, the first IMPORT_MAX_REPORTED_ERRORS errors and the throughput).
+    Raises ImportAborted if the database fails, after the chunks committed so far.
+    :param text_file: the file, opened in text mode (with newline='' for CSV)
+    :param entity_name: the name of the entity (one of IMPORTABLE_ENTITIES)
+    :param import_format: 'ndjson' or 'csv'
+    :param mode: 'insert' to reject the existing rows, 'upsert' to update them
+    :param chunk_size: the number of records validated and written at a time
+    :param workers: the number of processes that parse and validate the records - 0 to do it in the caller
+    :param skip: the number of records that are skipped (already imported)
+    :param on_chunk: a function called with the summary after every committed chunk (e.g. to save a checkpoint)
+    :param on_error: a function called with every (record number, code, message) error
+    """
+    import model
+    from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
+
+    _, primary_key_name, insert_wrapper, upsert_wrapper = IMPORTABLE_ENTITIES[entity_name]
+    write_operation = getattr(model, upsert_wrapper if mode == "upsert" else insert_wrapper)
+    summary = {"records": skip, "skipped": skip, "imported": 0, "invalid": 0, "duplicates": 0, "failed": 0,
+               "elapsed_seconds": 0.0, "rows_per_second": 0.0, "errors": []}
+    start = time.perf_counter()
+
+    def report_error(record_number, code, message):
+        if len(summary["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            summary["errors"].append({"record": record_number, "code": code, "message": message})
+        if on_error is not None:
+            on_error(record_number, code, message)
+
+    executor = ProcessPoolExecutor(workers) if workers > 0 else None
+    try:
+        chunks = read_chunks(text_file, import_format, chunk_size, skip)
+        for record_count, (rows, errors) in get_validated_chunks(chunks, entity_name, executor, max(2 * workers, 1)):
+            for record_number, message in errors:
+                report_error(record_number, 422, message)
+            rows, duplicates = deduplicate(rows, primary_key_name)
+
+            db_response = write_operation([fields for _, fields in rows], chunk_size)
+            if any(isinstance(error, (OperationalError, InterfaceError)) for error in db_response.payload):
+                error = next(error for error in db_response.payload if isinstance(error, (OperationalError, InterfaceError)))
+                raise ImportAborted(f"The database failed after {summary['records']} records were committed: {error}")
+            failed = 0
+            for (record_number, _), error in zip(rows, db_response.payload):
+                if error is not None:
+                    failed += 1
+                    report_error(record_number, 409 if isinstance(error, IntegrityError) else 500, str(error).replace("\n", " "))
+
+            summary["records"] += record_count
+            summary["imported"] += len(rows) - failed
+            summary["invalid"] += len(errors)
+            summary["duplicates"] += duplicates
+            summary["failed"] += failed
+            summary["elapsed_seconds"] = time.perf_counter() - start
+            summary["rows_per_second"] = (summary["records"] - skip) / summary["elapsed_seconds"]
+            if on_chunk is not None:
+                on_chunk(summary)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    summary["elapsed_seconds"] = time.perf_counter() - start
+    summary["rows_per_second"] = (summary["records"] - skip) / summary["elapsed_seconds"] if summary["elapsed_seconds"] else 0.0
+    return summary
+
+
+async def import_upload(request, entity_name, import_format, mode, chunk_size, skip):
+    """
+    Imports the body of an upload request: the body is spooled (to disk beyond IMPORT_UPLOAD_SPOOL_SIZE bytes)
+    and imported in the threadpool, the records being validated in the same thread.
+    :param request: the request whose body is the CSV/NDJSON file
+    :param entity_name: the name of the entity (one of IMPORTABLE_ENTITIES)
+    :param import_format: 'ndjson' or 'csv'
+    :param mode: 'insert' or 'upsert'
+    :param chunk_size: the number of records validated and written at a time
+    :param skip: the number of records that are skipped (e.g. the 'records' of a previous, aborted upload)
+    """
+    with SpooledTemporaryFile(max_size=IMPORT_UPLOAD_SPOOL_SIZE) as body:
+        async for data in request.stream():
+            body.write(data)
+        body.seek(0)
+        text_file = io.TextIOWrapper(body, encoding="utf-8-sig", newline="")
+        try:
+            return await run_in_threadpool(import_records, text_file, entity_name, import_format, mode, chunk_size, 0, skip)
+        finally:
+            text_file.detach()
+
+
+def notify_service(base_urls, entity_name):
+    """
+    Notifies the writes of an import to the processes of the service, which then drop their cached entries
+    and versions of the entity. Returns True if every process was notified.
+    :param base_urls: the base URLs of the processes of the service
+    :param entity_name: the name of the imported entity (one of IMPORTABLE_ENTITIES)
+    """
+    notified = True
+    for base_url in base_urls:
+        url = f"{base_url.rstrip('/')}/api/admin/invalidate?{urllib.parse.urlencode({'entities': entity_name})}"
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, method="POST"), timeout=IMPORT_NOTIFY_TIMEOUT_SECONDS):
+                pass
+        except OSError as e:
+            print(f"Could not notify {base_url} of the import: {e}", file=sys.stderr)
+            notified = False
+    return notified
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Streaming importer of CSV/NDJSON files into the tables of the service.")
+    parser.add_argument("entity", choices=sorted(IMPORTABLE_ENTITIES))
+    parser.add_argument("path", help="path of the CSV/NDJSON file")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="format of the file - guessed from its extension if missing")
+    parser.add_argument("--mode", choices=["insert", "upsert"], default="insert",
+                        help="'insert' rejects the rows that already exist, 'upsert' updates them")
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("IMPORT_CHUNK_SIZE", "1000")))
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="processes that parse and validate the records (0: none)")
+    parser.add_argument("--checkpoint", help="path of the checkpoint file, to resume an interrupted import")
+    parser.add_argument("--errors", help="path of an NDJSON file receiving every rejected record")
+    parser.add_argument("--db-url", help="SQLAlchemy URL of the database (default: DB_URL)")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between two progress lines")
+    parser.add_argument("--notify-url", action="append",
+                        default=[url.strip() for url in IMPORT_NOTIFY_URLS.split(",") if url.strip()],
+                        help="base URL of a process of the service that is notified of the imported rows (repeatable, "
+                             "default: IMPORT_NOTIFY_URLS)")
+    return parser.parse_args()
+
+
+def main():
+    arguments = get_arguments()
+    # 'db' reads its configuration when it is imported, so it has to be set before
+    if arguments.db_url:
+        os.environ["DB_URL"] = arguments.db_url
+
+    import_format = arguments.format or ("csv" if arguments.path.lower().endswith(".csv") else "ndjson")
+    source = {"entity": arguments.entity, "path": os.path.abspath(arguments.path), "format": import_format, "mode": arguments.mode}
+    skip = load_checkpoint(arguments.checkpoint, source)
+    if skip:
+        print(f"Resuming after {skip} records", file=sys.stderr)
+
+    last_progress = time.perf_counter()
+    # the rows committed so far, which an aborted import keeps too
+    imported = 0
+
+    def on_chunk(summary):
+        nonlocal last_progress, imported
+        imported = summary["imported"]
+        if arguments.checkpoint:
+            save_checkpoint(arguments.checkpoint, source, summary["records"])
+        if time.perf_counter() - last_progress >= arguments.progress_interval:
+            last_progress = time.perf_counter()
+            print(f"{summary['records']} records, {summary['imported']} imported, "
+                  f"{summary['invalid'] + summary['failed']} rejected - {summary['rows_per_second']:.0f} rows/s", file=sys.stderr)
+
+    errors_file = open(arguments.errors, "a") if arguments.errors else None
+
+    def on_error(record_number, code, message):
+        if errors_file is not None:
+            errors_file.write(json.dumps({"record": record_number, "code": code, "message": message}) + "\n")
+
+    try:
+        with open(arguments.path, encoding="utf-8-sig", newline="") as text_file:
+            summary = import_records(text_file, arguments.entity, import_format, arguments.mode, arguments.chunk_size,
+                                     arguments.workers, skip, on_chunk, on_error)
+    except ImportAborted as e:
+        print(f"Import aborted ({e}) - run it again with the same checkpoint to resume.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if errors_file is not None:
+            errors_file.close()
+        if imported:
+            if not arguments.notify_url:
+                print(f"The service was not notified of the import: POST /api/admin/invalidate?entities={arguments.entity} "
+                      f"to every process of the service, or pass --notify-url.", file=sys.stderr)
+            elif not notify_service(arguments.notify_url, arguments.entity):
+                print(f"Notify the other processes with POST /api/admin/invalidate?entities={arguments.entity}.", file=sys.stderr)
+
+    if arguments.checkpoint and os.path.exists(arguments.checkpoint):
+        os.remove(arguments.checkpoint)
+
+    del summary["errors"]
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
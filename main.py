@@ -4,13 +4,38 @@ from fastapi_hypermodel import HyperModel
 import book_router
 import author_router
 import books_authors_router
+import search_router
+import changes_router
+import admin_router
+from metrics import METRICS_ENABLED, MetricsMiddleware
+from write_batching import close_write_batchers
+from db import replicas
+from replication import ReadYourWritesMiddleware, replica_health_checker
+from admission import ADMISSION_CONTROL, AdmissionControlMiddleware
 
 
 app = FastAPI()
 
+if replicas:
+    app.add_middleware(ReadYourWritesMiddleware)
+    app.add_event_handler("startup", replica_health_checker.start)
+    app.add_event_handler("shutdown", replica_health_checker.stop)
+
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionControlMiddleware)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(book_router.router)
 app.include_router(author_router.router)
 app.include_router(books_authors_router.router)
+app.include_router(search_router.router)
+app.include_router(changes_router.router)
+app.include_router(admin_router.router)
+
+# the inserts still waiting in the write batchers are committed before the application stops
+app.add_event_handler("shutdown", close_write_batchers)
 
 HyperModel.init_app(app)
 
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from starlette.routing import Match
+
+# when disabled, no middleware is installed and the timing hooks are no-ops
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+NO_TIMER = nullcontext()
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(label_names, label_values, extra_label=None):
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra_label:
+        labels.append(extra_label)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """
+    Base of the metrics: a family of series identified by their label values, rendered in the Prometheus text format.
+    """
+    type_name = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.series = {}
+        registry.append(self)
+
+    def render_series(self, label_values, value):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"]
+        with self.lock:
+            series = list(self.series.items())
+        for label_values, value in series:
+            lines.extend(self.render_series(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render_series(self, label_values, value):
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {value}"]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, label_values=(), amount=1):
+        self.inc(label_values, -amount)
+
+    def set(self, label_values=(), value=0):
+        with self.lock:
+            self.series[label_values] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # [bucket counts (the last one is +Inf), sum, count]
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render_series(self, label_values, value):
+        bucket_counts, total, count = value
+        lines = []
+        cumulative_count = 0
+        for bucket, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+            cumulative_count += bucket_count
+            labels = format_labels(self.label_names, label_values, f'le="{bucket}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+        labels = format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+registry = []
+
+http_requests_total = Counter("http_requests_total", "Number of handled HTTP requests.",
+                              ("method", "route", "status"))
+http_request_duration_seconds = Histogram("http_request_duration_seconds", "Latency of the HTTP requests.",
+                                          ("method", "route"))
+http_requests_in_flight = Gauge("http_requests_in_flight", "Number of HTTP requests being handled.")
+operation_stage_duration_seconds = Histogram("operation_stage_duration_seconds",
+                                             "Time spent in every stage (database, hydration, serialization, pydantic, json_encoding) "
+                                             "of the model and serialization operations.",
+                                             ("operation", "entity", "stage"))
+
+
+class StageTimer:
+    def __init__(self, label_values):
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        operation_stage_duration_seconds.observe(self.label_values, time.perf_counter() - self.start)
+
+
+def time_stage(operation, entity, stage):
+    """
+    Returns a context manager that records the time spent in a stage of an operation.
+    :param operation: the name of the operation (e.g. 'get_all_entities')
+    :param entity: the name of the entity (table or view model) the operation works on
+    :param stage: the name of the stage (database, hydration, serialization, pydantic, json_encoding)
+    """
+    if not METRICS_ENABLED:
+        return NO_TIMER
+    return StageTimer((operation, entity, stage))
+
+
+def get_route_template(scope):
+    """
+    Returns the path template of the route that handled a request, which keeps the number of series bounded.
+    :param scope: the ASGI scope of the request
+    """
+    partial_match = None
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial_match is None:
+            partial_match = route.path
+    return partial_match or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency, status code and in-flight count of the HTTP requests.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            route = get_route_template(scope)
+            http_request_duration_seconds.observe((scope["method"], route), duration)
+            http_requests_total.inc((scope["method"], route, str(status_code)))
+
+
+def render_metrics():
+    """
+    Renders all the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,48 @@
+import threading
+from sqlalchemy import and_, bindparam, case, delete, func, insert, or_, select, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from Book import Book
 from Author import Author
 from Books_Authors import Books_Authors
-from db import Session, engine
+from db import session_scope, primary_session_scope, get_unit_of_work, commit_session, rollback_session, after_commit, on_commit, is_replica_session, primary_reads
+from cache import entity_cache, get_entity_cache_key
+from versions import entity_versions
+from changes import change_log
+from metrics import time_stage
+from search import get_boolean_mode_query, get_search_index, get_search_terms, uses_fulltext
+
+# the columns matched by the searches, by searchable entity
+SEARCHABLE_COLUMNS = {
+    Book: ("title",),
+    Author: ("first_name", "last_name")
+}
+SEARCH_INDEX_CHUNK_SIZE = 500
+
+# the insert id of a MariaDB/MySQL upsert that updated an existing row, or that met a row with another primary key
+# on a secondary unique key: the update clause sets it by LAST_INSERT_ID(expr), an inserted row leaves it at 0
+# (none of the tables has an AUTO_INCREMENT column)
+UPSERT_UPDATED_ID = 1
+UPSERT_CONFLICT_ID = 2
+
+# taken by the invalidations and by the fills of the entity cache, so that a read cannot check the version of a row
+# and then cache its values after a write has bumped the version and removed the entry in between
+entity_cache_lock = threading.Lock()
+
+
+class UniqueKeyConflict(IntegrityError):
+    """
+    Raised when an upsert meets an existing row with another primary key on a secondary unique key
+    (e.g. a book with the same title and year of publishing), like the IntegrityError a plain insert gets.
+    """
+    def __init__(self, message):
+        super().__init__(None, None, Exception(message))
+        self.message = message
+
+    def __str__(self):
+        return self.message
 
 
 class OperationResponseWrapper:
@@ -11,242 +52,1236 @@ class OperationResponseWrapper:
         self.completed_operation = completed_operation
 
 
-def get_all_entities(entity, **kwargs):
+def get_primary_key_column(entity):
+    """
+    Returns the primary key column of an entity - used for ordering and keyset pagination.
+    :param entity: the type of the entity
+    """
+    return entity.__mapper__.primary_key[0]
+
+
+def get_entity_values(entity_instance):
+    """
+    Returns the column values of an entity instance as a dictionary.
+    :param entity_instance: the instance of the entity
+    """
+    return {column.key: getattr(entity_instance, column.key) for column in entity_instance.__table__.columns}
+
+
+def get_identifier_key(entity, identifier_value):
+    """
+    Returns the canonical form of a primary key value, used to key the cache and the versions
+    (e.g. '01' and 1 are the same author_id) - None if the value is not valid for the column.
+    :param entity: the type of the entity
+    :param identifier_value: the value of the primary key
+    """
+    try:
+        return str(get_primary_key_column(entity).type.python_type(identifier_value))
+    except (TypeError, ValueError):
+        return None
+
+
+def register_entity_change(entity, *identifier_values):
+    """
+    Registers a committed write on some rows of an entity: their cached entries are removed
+    and their versions are bumped.
+    :param entity: the type of the entity
+    :param identifier_values: the primary key values of the written rows
+    """
+    identifier_keys = [get_identifier_key(entity, identifier_value) for identifier_value in identifier_values
+                       if identifier_value is not None]
+    identifier_keys = [identifier_key for identifier_key in identifier_keys if identifier_key is not None]
+    with entity_cache_lock:
+        entity_versions.bump(entity.__tablename__, identifier_keys)
+        if entity_cache is not None:
+            for identifier_key in identifier_keys:
+                entity_cache.delete(get_entity_cache_key(entity, identifier_key))
+    if entity in SEARCHABLE_COLUMNS:
+        primary_key_type = get_primary_key_column(entity).type.python_type
+        get_search_index(entity.__tablename__).mark_changed([primary_key_type(identifier_key) for identifier_key in identifier_keys])
+
+
+def register_entity_change_by_identifier(entity, identifier_name, identifier_value):
+    """
+    Registers a committed write on the rows of an entity matched by an identifier. The cached entries and
+    the row versions are keyed by the primary key, so matching by any other column affects all the rows.
+    :param entity: the type of the entity
+    :param identifier_name: the column/field by which the rows were matched
+    :param identifier_value: the value of the identifier column
+    """
+    if identifier_name == get_primary_key_column(entity).key:
+        register_entity_change(entity, identifier_value)
+        return
+    register_unknown_entity_changes(entity)
+
+
+def register_unknown_entity_changes(entity):
+    """
+    Registers writes on unknown rows of an entity - e.g. the ones made outside of this process (by the command line
+    importer or by hand), which the cache, the version counters and the search index can not see otherwise:
+    the cached entries are removed, all the row versions are bumped and the search index is built again.
+    :param entity: the type of the entity
+    """
+    with entity_cache_lock:
+        entity_versions.bump(entity.__tablename__)
+        if entity_cache is not None:
+            entity_cache.clear()
+    if entity in SEARCHABLE_COLUMNS:
+        get_search_index(entity.__tablename__).mark_changed()
+
+
+def publish_entity_change(entity, operation, identifier_name, identifier_value, entity_fields=None):
+    """
+    Publishes a committed write on the rows of an entity matched by an identifier to the change feed.
+    :param entity: the type of the entity
+    :param operation: 'insert', 'update', 'upsert' or 'delete'
+    :param identifier_name: the column/field by which the rows were matched
+    :param identifier_value: the value of the identifier column
+    :param entity_fields: the written attributes - None for a delete
+    """
+    primary_key = get_primary_key_column(entity)
+    if identifier_name == primary_key.key and get_identifier_key(entity, identifier_value) is not None:
+        # the identifiers of the paths are strings, the changes hold the values of the column (e.g. 1 for '01')
+        identifier_value = primary_key.type.python_type(identifier_value)
+    change_log.publish(entity.__tablename__.lower(), operation, {identifier_name: identifier_value}, entity_fields)
+
+
+def publish_entity_changes(entity, operation, entities_fields):
+    """
+    Publishes the committed writes of many instances of an entity to the change feed, one change per instance.
+    :param entity: the type of the entity
+    :param operation: 'insert' or 'upsert'
+    :param entities_fields: a list of dictionaries containing the attributes of the instances
+    """
+    primary_key_name = get_primary_key_column(entity).key
+    for entity_fields in entities_fields:
+        publish_entity_change(entity, operation, primary_key_name, entity_fields.get(primary_key_name), entity_fields)
+
+
+# the statements of the generic wrappers, built once and reused by every call - the values are bound parameters,
+# so SQLAlchemy neither rebuilds the expression nor computes its cache key again
+prebuilt_statements = {}
+
+
+def get_select_by_identifier_statement(entity, identifier_name, columns=None):
+    """
+    Returns the statement that selects an Entity (or some of its columns) by an identifier bound as 'identifier_value'.
+    :param entity: the type of the entity
+    :param identifier_name: the column/field by which the entity is selected
+    :param columns: the names of the columns that are to be selected instead of the entity
+    """
+    key = ("select", entity, identifier_name, tuple(columns) if columns else None)
+    statement = prebuilt_statements.get(key)
+    if statement is None:
+        if columns:
+            statement = select(*(getattr(entity, column_name) for column_name in columns))
+        else:
+            statement = select(entity)
+        statement = prebuilt_statements[key] = statement\
+            .where(getattr(entity, identifier_name) == bindparam("identifier_value"))\
+            .limit(1)
+    return statement
+
+
+def get_select_by_identifiers_statement(entity):
+    """
+    Returns the statement that selects the instances of an entity whose primary key is in the list bound as 'identifier_values'.
+    :param entity: the type of the entity
+    """
+    key = ("select_in", entity)
+    statement = prebuilt_statements.get(key)
+    if statement is None:
+        statement = prebuilt_statements[key] = select(entity)\
+            .where(get_primary_key_column(entity).in_(bindparam("identifier_values", expanding=True)))
+    return statement
+
+
+def get_select_identifier_statement(entity, identifier_name):
+    """
+    Returns the statement that selects the identifier of the rows matched by the identifier bound as 'identifier_value'.
+    :param entity: the type of the entity
+    :param identifier_name: the column/field by which the rows are matched
+    """
+    key = ("select_identifier", entity, identifier_name)
+    statement = prebuilt_statements.get(key)
+    if statement is None:
+        identifier_column = getattr(entity, identifier_name)
+        statement = prebuilt_statements[key] = select(identifier_column)\
+            .where(identifier_column == bindparam("identifier_value"))
+    return statement
+
+
+def get_update_by_identifier_statement(entity, identifier_name, field_names):
+    """
+    Returns the statement that updates some fields of the rows matched by the identifier bound as 'identifier_value',
+    the new value of every field being bound as 'new_<field name>'.
+    :param entity: the type of the entity
+    :param identifier_name: the column/field by which the rows are matched
+    :param field_names: the names of the updated fields
+    """
+    key = ("update", entity, identifier_name, tuple(sorted(field_names)))
+    statement = prebuilt_statements.get(key)
+    if statement is None:
+        statement = prebuilt_statements[key] = update(entity)\
+            .where(getattr(entity, identifier_name) == bindparam("identifier_value"))\
+            .values({field_name: bindparam(f"new_{field_name}") for field_name in key[3]})\
+            .execution_options(synchronize_session=False)
+    return statement
+
+
+def get_delete_by_identifier_statement(entity, identifier_name):
+    """
+    Returns the statement that deletes the rows matched by the identifier bound as 'identifier_value'.
+    :param entity: the type of the entity
+    :param identifier_name: the column/field by which the rows are matched
+    """
+    key = ("delete", entity, identifier_name)
+    statement = prebuilt_statements.get(key)
+    if statement is None:
+        statement = prebuilt_statements[key] = delete(entity)\
+            .where(getattr(entity, identifier_name) == bindparam("identifier_value"))\
+            .execution_options(synchronize_session=False)
+    return statement
+
+
+def get_upsert_statement(entity, dialect_name, field_names):
+    """
+    Returns the native upsert statement of an entity: INSERT ... ON DUPLICATE KEY UPDATE on MariaDB/MySQL,
+    INSERT ... ON CONFLICT DO UPDATE on SQLite - None on the other databases (see 'upsert_rows'). The values are bound by the names of the fields, so the same
+    statement inserts one row or, executed with a list of rows, many.
+    Only a row with the same primary key is updated. ON DUPLICATE KEY UPDATE fires on any unique key, so on MariaDB/MySQL
+    a row met on another unique key is left as it is and the insert id of the statement is set to UPSERT_CONFLICT_ID
+    (see 'check_upsert_conflicts'); SQLite raises an IntegrityError, as its ON CONFLICT clause names the primary key.
+    Otherwise the update clause sets the insert id to UPSERT_UPDATED_ID, so a single row upsert tells an update from
+    an insert by itself (the affected rows can not: with CLIENT_FOUND_ROWS an unchanged row counts as one, like an
+    inserted one).
+    :param entity: the type of the entity
+    :param dialect_name: the name of the SQLAlchemy dialect of the database
+    :param field_names: the names of the fields of the rows, including the primary key
+    """
+    key = ("upsert", entity, dialect_name, tuple(field_names))
+    statement = prebuilt_statements.get(key)
+    if statement is None:
+        primary_key = get_primary_key_column(entity)
+        updated_fields = [field for field in field_names if field != primary_key.key]
+        if dialect_name in ("mysql", "mariadb"):
+            statement = mysql.insert(entity)
+            # in the update clause the columns hold the values of the existing row
+            same_key = primary_key == statement.inserted[primary_key.key]
+            updated_values = [(field, case((same_key, statement.inserted[field]), else_=getattr(entity, field)))
+                              for field in updated_fields]
+            # the assignments are evaluated in order, the first one also runs LAST_INSERT_ID(expr)
+            field, _ = updated_values[0]
+            outcome = func.last_insert_id(case((same_key, UPSERT_UPDATED_ID), else_=UPSERT_CONFLICT_ID))
+            updated_values[0] = (field, case((outcome == UPSERT_UPDATED_ID, statement.inserted[field]), else_=getattr(entity, field)))
+            statement = statement.on_duplicate_key_update(updated_values)
+        elif dialect_name == "sqlite":
+            statement = sqlite.insert(entity)
+            statement = statement.on_conflict_do_update(index_elements=[primary_key],
+                                                        set_={field: statement.excluded[field] for field in updated_fields})
+        else:
+            return None
+        prebuilt_statements[key] = statement
+    return statement
+
+
+def get_keyset_condition(sort_column, primary_key, after, descending):
+    """
+    Returns the condition that selects the rows placed after a keyset cursor value.
+    :param sort_column: the column by which the rows are ordered, None if they are ordered by the primary key
+    :param primary_key: the primary key column of the entity
+    :param after: the primary key value or, when sorting by another column, a [column value, primary key value] pair
+    :param descending: True if the rows are ordered descending
+    """
+    if sort_column is None:
+        return primary_key < after if descending else primary_key > after
+
+    sort_value, primary_key_value = after
+    if descending:
+        return or_(sort_column < sort_value, and_(sort_column == sort_value, primary_key < primary_key_value))
+    return or_(sort_column > sort_value, and_(sort_column == sort_value, primary_key > primary_key_value))
+
+
+def get_all_entities(entity, page=None, items_per_page=None, after=None, sort_by=None, descending=False,
+                     ranges=None, columns=None, session=None, **kwargs):
     """
     Wrapper for a generic ORM call that is retrieving all instances of
     any entity also using some filter parameters.
+    The rows are ordered by the sort column (ties broken by the primary key) and the pagination is done in the database:
+    either by LIMIT/OFFSET (page) or by keyset (after), the latter having constant cost on deep pages.
     :param entity: the type of the entity that is to be retrieved
+    :param page: the 1-based number of the page that is to be retrieved (ignored if 'after' is given)
+    :param items_per_page: the maximum number of rows that are to be retrieved
+    :param after: the primary key value after which the rows are retrieved or, when sorting by another column,
+    a [column value, primary key value] pair
+    :param sort_by: the column by which the rows are ordered - the primary key if missing
+    :param descending: True if the rows are to be ordered descending
+    :param ranges: a dictionary of column -> (minimum, maximum) inclusive bounds, None meaning unbounded
+    :param columns: the names of the columns that are to be retrieved as plain rows instead of ORM instances
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the parameters by which the filters will be made
     """
-    with Session(bind=engine) as session:
+    with session_scope(session, read_only=True) as session:
         response = OperationResponseWrapper()
 
         try:
-            response.payload = session.query(entity).filter_by(**kwargs).all()
+            primary_key = get_primary_key_column(entity)
+            sort_column = getattr(entity, sort_by) if sort_by and sort_by != primary_key.key else None
+            if columns:
+                statement = select(*(getattr(entity, column_name) for column_name in columns))
+            else:
+                statement = select(entity)
+            statement = statement.filter_by(**kwargs)
+
+            for column_name, (minimum, maximum) in (ranges or {}).items():
+                if minimum is not None:
+                    statement = statement.where(getattr(entity, column_name) >= minimum)
+                if maximum is not None:
+                    statement = statement.where(getattr(entity, column_name) <= maximum)
+
+            if after is not None:
+                statement = statement.where(get_keyset_condition(sort_column, primary_key, after, descending))
+            order_columns = [primary_key] if sort_column is None else [sort_column, primary_key]
+            statement = statement.order_by(*(column.desc() if descending else column.asc() for column in order_columns))
+
+            if items_per_page is not None:
+                if after is None and page is not None:
+                    statement = statement.offset((page - 1) * items_per_page)
+                statement = statement.limit(items_per_page)
+
+            with time_stage("get_all_entities", entity.__tablename__, "database"):
+                result = session.execute(statement)
+            with time_stage("get_all_entities", entity.__tablename__, "hydration"):
+                response.payload = result.all() if columns else result.scalars().all()
             response.completed_operation = True
         except Exception as e:
-            session.rollback()
+            rollback_session(session, e)
             response.error = e
             response.completed_operation = False
 
         return response
 
 
-def get_entity_by_identifier(entity, identifier_name, identifier_value):
+def stream_entities(entity, batch_size, columns=None, session=None):
+    """
+    Generator of all the instances of an entity, ordered by the primary key, yielded in lists of at most 'batch_size' rows.
+    Every batch is read by a query of its own that starts after the primary key of the previous batch (keyset
+    pagination), so only one batch is held in memory and the first batch is yielded before the rest is read,
+    whether the driver supports server-side cursors or not (mysql-connector buffers every result).
+    :param entity: the type of the entity that is to be retrieved
+    :param batch_size: the number of rows fetched at a time
+    :param columns: the names of the columns that are to be retrieved as plain rows instead of ORM instances
+    (the primary key is added to them if it is missing)
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    with session_scope(session, read_only=True) as session:
+        primary_key = get_primary_key_column(entity)
+        if columns:
+            if primary_key.key not in columns:
+                columns = [*columns, primary_key.key]
+            statement = select(*(getattr(entity, column_name) for column_name in columns))
+        else:
+            statement = select(entity)
+        statement = statement.order_by(primary_key).limit(batch_size)
+        next_statement = statement.where(primary_key > bindparam("after_value"))
+
+        after_value = None
+        while True:
+            with time_stage("stream_entities", entity.__tablename__, "database"):
+                if after_value is None:
+                    partition = session.execute(statement).all()
+                else:
+                    partition = session.execute(next_statement, {"after_value": after_value}).all()
+            if partition:
+                yield partition
+            if len(partition) < batch_size:
+                return
+            last_row = partition[-1]
+            after_value = getattr(last_row if columns else last_row[0], primary_key.key)
+
+
+def fill_entity_cache(entity, identifier_key, row_version, entity_instance):
+    """
+    Caches the values of an entity read from the database, unless its row was written since its version was read
+    (before the query): the values may then be older than the write that already removed the entry.
+    :param entity: the type of the entity
+    :param identifier_key: the canonical primary key value of the entity
+    :param row_version: the version of the row, read before the query
+    :param entity_instance: the instance of the entity
+    """
+    with entity_cache_lock:
+        if entity_versions.get_row_version(entity.__tablename__, identifier_key) == row_version:
+            entity_cache.set(get_entity_cache_key(entity, identifier_key), get_entity_values(entity_instance))
+
+
+def get_entity_by_identifier(entity, identifier_name, identifier_value, columns=None, session=None):
     """
     Wrapper for a generic ORM call that is retrieving an Entity by an identifier.
+    A cached Entity is served whole; otherwise, if 'columns' are given, only these columns are selected
+    (as a plain row, which is not cached).
+    The cache is only filled by the reads from the primary (a replica may return a row older than a write that
+    already removed it from the cache) that start a transaction of their own and whose row was not written meanwhile,
+    and it is skipped by the requests that have to read their own writes.
     :param entity: the type of the entity that is to be retrieved
     :param identifier_name: the column/field by which the identifier will be searched
     :param identifier_value: the value of the identifier column
+    :param columns: the names of the columns that are to be retrieved as a plain row instead of an ORM instance
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    with Session(bind=engine) as session:
+    cache_key = None
+    identifier_key = get_identifier_key(entity, identifier_value)
+    if entity_cache is not None and identifier_name == get_primary_key_column(entity).key and identifier_key is not None:
+        cache_key = get_entity_cache_key(entity, identifier_key)
+        cached_values = entity_cache.get(cache_key) if not primary_reads.get() else None
+        if cached_values is not None:
+            return OperationResponseWrapper(payload=entity(**cached_values))
+
+    with session_scope(session, read_only=True) as session:
         response = OperationResponseWrapper()
+        # the snapshot of a transaction that is already open may be older than the version read now
+        fill_cache = cache_key is not None and not columns and not session.in_transaction() and not is_replica_session(session)
+        row_version = entity_versions.get_row_version(entity.__tablename__, identifier_key) if fill_cache else None
 
         try:
-            response.payload = session\
-                .query(entity)\
-                .filter(getattr(entity, identifier_name) == identifier_value)\
-                .first()
+            statement = get_select_by_identifier_statement(entity, identifier_name, columns)
+            with time_stage("get_entity_by_identifier", entity.__tablename__, "database"):
+                result = session.execute(statement, {"identifier_value": identifier_value})
+            with time_stage("get_entity_by_identifier", entity.__tablename__, "hydration"):
+                response.payload = result.first() if columns else result.scalars().first()
             if not response.payload:
                 response.completed_operation = False
             else:
                 response.completed_operation = True
+                if fill_cache:
+                    fill_entity_cache(entity, identifier_key, row_version, response.payload)
+        except Exception as e:
+            rollback_session(session, e)
+            response.error = e
+            response.completed_operation = False
+
+        return response
+
+
+def get_entities_by_identifiers(entity, identifier_values, chunk_size, session=None):
+    """
+    Wrapper for a generic ORM call that is retrieving many instances of an entity by their primary keys.
+    The cached instances are served from the cache, the others are retrieved by 'WHERE pk IN (...)'
+    queries of at most 'chunk_size' values each. The cache is filled and skipped as in 'get_entity_by_identifier'.
+    The payload is a list with the instance of every identifier, in the order of the identifiers
+    (None for the identifiers that do not exist).
+    :param entity: the type of the entity that is to be retrieved
+    :param identifier_values: the values of the primary key
+    :param chunk_size: the maximum number of values of a single IN list
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    primary_key = get_primary_key_column(entity)
+    identifier_keys = [get_identifier_key(entity, identifier_value) for identifier_value in identifier_values]
+    found_entities = {}
+
+    if entity_cache is not None and not primary_reads.get():
+        for identifier_key in set(identifier_keys) - {None}:
+            cached_values = entity_cache.get(get_entity_cache_key(entity, identifier_key))
+            if cached_values is not None:
+                found_entities[identifier_key] = entity(**cached_values)
+
+    missing_keys = list(dict.fromkeys(identifier_key for identifier_key in identifier_keys
+                                      if identifier_key is not None and identifier_key not in found_entities))
+
+    with session_scope(session, read_only=True) as session:
+        response = OperationResponseWrapper()
+
+        fill_cache = entity_cache is not None and not session.in_transaction() and not is_replica_session(session)
+        row_versions = {identifier_key: entity_versions.get_row_version(entity.__tablename__, identifier_key)
+                        for identifier_key in missing_keys} if fill_cache else {}
+
+        try:
+            for chunk_start in range(0, len(missing_keys), chunk_size):
+                chunk = [primary_key.type.python_type(identifier_key)
+                         for identifier_key in missing_keys[chunk_start:chunk_start + chunk_size]]
+                with time_stage("get_entities_by_identifiers", entity.__tablename__, "database"):
+                    result = session.execute(get_select_by_identifiers_statement(entity), {"identifier_values": chunk})
+                with time_stage("get_entities_by_identifiers", entity.__tablename__, "hydration"):
+                    instances = result.scalars().all()
+
+                for instance in instances:
+                    identifier_key = get_identifier_key(entity, getattr(instance, primary_key.key))
+                    found_entities[identifier_key] = instance
+                    if fill_cache:
+                        fill_entity_cache(entity, identifier_key, row_versions[identifier_key], instance)
+
+            response.payload = [found_entities.get(identifier_key) for identifier_key in identifier_keys]
+            response.completed_operation = True
+        except Exception as e:
+            rollback_session(session, e)
+            response.error = e
+            response.completed_operation = False
+
+        return response
+
+
+def get_search_documents(session, entity, identifier_values=None):
+    """
+    Generator of the (primary key value, searchable text) pairs of the rows of a searchable entity.
+    :param session: the session in which the rows are read
+    :param entity: the type of the entity
+    :param identifier_values: the primary key values of the rows that are to be read - all the rows if missing
+    """
+    primary_key = get_primary_key_column(entity)
+    statement = select(primary_key, *(getattr(entity, column_name) for column_name in SEARCHABLE_COLUMNS[entity]))
+
+    if identifier_values is None:
+        statements = [statement.execution_options(yield_per=SEARCH_INDEX_CHUNK_SIZE)]
+    else:
+        identifier_values = list(identifier_values)
+        statements = [statement.where(primary_key.in_(identifier_values[chunk_start:chunk_start + SEARCH_INDEX_CHUNK_SIZE]))
+                      for chunk_start in range(0, len(identifier_values), SEARCH_INDEX_CHUNK_SIZE)]
+
+    for statement in statements:
+        for identifier_value, *texts in session.execute(statement):
+            yield identifier_value, " ".join(texts)
+
+
+def search_entities(entity, query, page, items_per_page, columns=None, session=None):
+    """
+    Wrapper for a generic ORM call that is retrieving a page of the instances of a searchable entity whose
+    searchable columns contain every search term of a query (each matched as a prefix of a word), the best matches first.
+    The stopwords and the words shorter than FULLTEXT_MIN_TOKEN_SIZE are not search terms.
+    On MariaDB/MySQL the search is done by a FULLTEXT index in boolean mode, ranked by its relevance; on the other
+    databases by the in-process search index, ranked by the number of words matched exactly.
+    Ties are broken by the primary key.
+    :param entity: the type of the entity that is to be searched (one of SEARCHABLE_COLUMNS)
+    :param query: the text searched by the client
+    :param page: the 1-based number of the page that is to be retrieved
+    :param items_per_page: the maximum number of rows that are to be retrieved
+    :param columns: the names of the columns that are to be retrieved as plain rows instead of ORM instances
+    (the primary key has to be one of them)
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    with session_scope(session, read_only=True) as session:
+        response = OperationResponseWrapper(payload=[])
+
+        try:
+            # the stopwords and the short words are not searched on any backend, so a query made of them matches nothing
+            if get_search_terms(query):
+                primary_key = get_primary_key_column(entity)
+                if columns:
+                    statement = select(*(getattr(entity, column_name) for column_name in columns))
+                else:
+                    statement = select(entity)
+                offset = (page - 1) * items_per_page
+
+                if uses_fulltext(session.get_bind().dialect.name):
+                    relevance = match(*(getattr(entity, column_name) for column_name in SEARCHABLE_COLUMNS[entity]),
+                                      against=get_boolean_mode_query(query)).in_boolean_mode()
+                    statement = statement.where(relevance)\
+                        .order_by(relevance.desc(), primary_key)\
+                        .offset(offset)\
+                        .limit(items_per_page)
+                    with time_stage("search_entities", entity.__tablename__, "database"):
+                        result = session.execute(statement)
+                    with time_stage("search_entities", entity.__tablename__, "hydration"):
+                        response.payload = result.all() if columns else result.scalars().all()
+                else:
+                    search_index = get_search_index(entity.__tablename__)
+                    # a replica may not have the changed rows yet, which the index would then take for deleted ones
+                    with time_stage("search_entities", entity.__tablename__, "index"), primary_session_scope(session) as primary_session:
+                        search_index.refresh(lambda: get_search_documents(primary_session, entity),
+                                             lambda identifier_values: dict(get_search_documents(primary_session, entity, identifier_values)))
+                        identifier_values = search_index.search(query, offset, items_per_page)
+                    if identifier_values:
+                        with time_stage("search_entities", entity.__tablename__, "database"):
+                            result = session.execute(statement.where(primary_key.in_(identifier_values)))
+                        with time_stage("search_entities", entity.__tablename__, "hydration"):
+                            rows = result.all() if columns else result.scalars().all()
+                        ranks = {identifier_value: rank for rank, identifier_value in enumerate(identifier_values)}
+                        response.payload = sorted(rows, key=lambda row: ranks[getattr(row, primary_key.key)])
+            response.completed_operation = True
+        except Exception as e:
+            rollback_session(session, e)
+            response.error = e
+            response.completed_operation = False
+
+        return response
+
+
+def get_related_entities(entity, identifier_name, identifier_value, relationship_name, session=None):
+    """
+    Wrapper for a generic ORM call that is retrieving the entities related to an Entity identified by an identifier.
+    The related entities are loaded by a single 'selectin' query, whatever their number is.
+    The payload is the list of the related entities - the operation is not completed if the Entity does not exist.
+    :param entity: the type of the entity whose relationship is to be retrieved
+    :param identifier_name: the column/field by which the identifier will be searched
+    :param identifier_value: the value of the identifier column
+    :param relationship_name: the name of the relationship of the entity
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    with session_scope(session, read_only=True) as session:
+        response = OperationResponseWrapper()
+
+        try:
+            statement = select(entity)\
+                .options(selectinload(getattr(entity, relationship_name)))\
+                .where(getattr(entity, identifier_name) == identifier_value)
+            with time_stage("get_related_entities", entity.__tablename__, "database"):
+                related_entity = session.execute(statement).scalars().first()
+
+            if related_entity is None:
+                response.completed_operation = False
+            else:
+                response.payload = getattr(related_entity, relationship_name)
+                response.completed_operation = True
         except Exception as e:
-            session.rollback()
+            rollback_session(session, e)
             response.error = e
             response.completed_operation = False
 
         return response
 
 
-def delete_entity_by_identifier(entity, identifier_name, identifier_value):
+def delete_entity_by_identifier(entity, identifier_name, identifier_value, session=None):
     """
     Wrapper for a generic ORM call that is deleting an Entity by an identifier.
+    A single DELETE statement is issued, the affected row count tells if the entity existed.
     :param entity: the type of the entity that is to be deleted
     :param identifier_name: the column/field by which the identifier will be searched and deleted
     :param identifier_value: the value of the identifier column
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    with Session(bind=engine) as session:
+    with session_scope(session) as session:
         response = OperationResponseWrapper()
 
         try:
-            entity_to_delete = session\
-                .query(entity)\
-                .filter(getattr(entity, identifier_name) == identifier_value)\
-                .first()
-
-            if entity_to_delete:
-                session.delete(entity_to_delete)
-                session.commit()
+            statement = get_delete_by_identifier_statement(entity, identifier_name)
+            with time_stage("delete_entity_by_identifier", entity.__tablename__, "database"):
+                deleted_rows = session.execute(statement, {"identifier_value": identifier_value}).rowcount
+                commit_session(session)
+
+            if deleted_rows:
+                after_commit(session, register_entity_change_by_identifier, entity, identifier_name, identifier_value)
+                on_commit(session, publish_entity_change, entity, "delete", identifier_name, identifier_value)
             else:
                 response.completed_operation = False
 
         except Exception as e:
-            session.rollback()
+            rollback_session(session, e)
             response.completed_operation = False
             response.error = e
 
         return response
 
 
-def update_entity_by_identifier(entity, identifier_name, identifier_value, updated_entity_fields):
+def update_entity_by_identifier(entity, identifier_name, identifier_value, updated_entity_fields, session=None):
     """
     Wrapper for a generic ORM call that is updating an Entity by an identifier.
+    A single UPDATE statement is issued, the affected (matched) row count tells if the entity existed.
     :param entity: the type of the entity that is to be updated
     :param identifier_name: the column/field by which the identifier will be searched
     :param identifier_value: the value of the identifier column
     :param updated_entity_fields: a dictionary that contains the new values of the entity
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    with Session(bind=engine) as session:
+    with session_scope(session) as session:
         response = OperationResponseWrapper()
 
         try:
-            entity_to_update = session\
-                .query(entity)\
-                .filter(getattr(entity, identifier_name) == identifier_value)\
-                .first()
+            with time_stage("update_entity_by_identifier", entity.__tablename__, "database"):
+                if updated_entity_fields:
+                    statement = get_update_by_identifier_statement(entity, identifier_name, updated_entity_fields)
+                    parameters = {f"new_{field_name}": value for field_name, value in updated_entity_fields.items()}
+                    parameters["identifier_value"] = identifier_value
+                    updated_rows = session.execute(statement, parameters).rowcount
+                else:
+                    statement = get_select_identifier_statement(entity, identifier_name)
+                    updated_rows = len(session.execute(statement, {"identifier_value": identifier_value}).all())
+                commit_session(session)
 
-            if entity_to_update:
-                for field in updated_entity_fields:
-                    setattr(entity_to_update, field, updated_entity_fields[field])
-
-                session.add(entity_to_update)
-                session.commit()
+            if updated_rows:
+                primary_key_name = get_primary_key_column(entity).key
+                after_commit(session, register_entity_change_by_identifier, entity, identifier_name, identifier_value)
+                after_commit(session, register_entity_change, entity, updated_entity_fields.get(primary_key_name))
+                on_commit(session, publish_entity_change, entity, "update", identifier_name, identifier_value, updated_entity_fields)
                 response.completed_operation = True
-                response.payload = entity_to_update
             else:
                 response.completed_operation = False
         except Exception as e:
-            session.rollback()
+            rollback_session(session, e)
             response.completed_operation = False
             response.error = e
 
         return response
 
-def insert_entity(entity, **kwargs):
+def insert_entity(entity, session=None, **kwargs):
     """
     Wrapper for an ORM call that inserts a book into the database.
     :param entity: the type of the entity
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the attributes of the entity
     """
-    with Session(bind=engine) as session:
+    with session_scope(session) as session:
         response = OperationResponseWrapper()
 
         entity_to_insert = entity(**kwargs)
         try:
-            session.add(entity_to_insert)
-            session.commit()
+            with time_stage("insert_entity", entity.__tablename__, "database"):
+                session.add(entity_to_insert)
+                commit_session(session)
+            primary_key_name = get_primary_key_column(entity).key
+            after_commit(session, register_entity_change, entity, kwargs.get(primary_key_name))
+            on_commit(session, publish_entity_change, entity, "insert", primary_key_name, kwargs.get(primary_key_name), kwargs)
             response.completed_operation = True
             response.payload = entity_to_insert
         except Exception as e:
-            session.rollback()
+            rollback_session(session, e)
             response.completed_operation = False
             response.error = e
 
         return response
 
 
-def get_book_by_isbn(isbn):
+def upsert_rows(session, entity, entities_fields):
+    """
+    Upserts rows on the databases without a native upsert statement: every row is updated by its primary key
+    and inserted if no row was matched, in the transaction of the session.
+    Returns a list telling for every row if it was created.
+    :param session: the session in which the rows are upserted
+    :param entity: the type of the entity
+    :param entities_fields: the rows, all with the same fields, including the primary key
+    """
+    primary_key_name = get_primary_key_column(entity).key
+    updated_fields = [field_name for field_name in entities_fields[0] if field_name != primary_key_name]
+    if updated_fields:
+        statement = get_update_by_identifier_statement(entity, primary_key_name, updated_fields)
+    else:
+        statement = get_select_identifier_statement(entity, primary_key_name)
+
+    created = []
+    for fields in entities_fields:
+        parameters = {f"new_{field_name}": fields[field_name] for field_name in updated_fields}
+        parameters["identifier_value"] = fields[primary_key_name]
+        result = session.execute(statement, parameters)
+        matched_rows = result.rowcount if updated_fields else len(result.all())
+        if not matched_rows:
+            session.execute(insert(entity), fields)
+        created.append(not matched_rows)
+    return created
+
+
+def check_upsert_conflicts(session, entity, result, entities_fields):
+    """
+    Raises UniqueKeyConflict if a MariaDB/MySQL upsert met an existing row with another primary key on a secondary
+    unique key: that row was left as it is and the upserted row was not created.
+    :param session: the session in which the upsert ran
+    :param entity: the type of the entity
+    :param result: the result of the upsert
+    :param entities_fields: the rows of the upsert
+    """
+    if len(entities_fields) == 1:
+        conflict = result.lastrowid == UPSERT_CONFLICT_ID
+    else:
+        # the insert id of a multi-row upsert only tells about its last updated row, so the rows are counted instead
+        primary_key = get_primary_key_column(entity)
+        identifier_values = {fields[primary_key.key] for fields in entities_fields}
+        conflict = session.execute(select(func.count()).select_from(entity).where(primary_key.in_(identifier_values)))\
+            .scalar() < len(identifier_values)
+    if conflict:
+        raise UniqueKeyConflict(f"An existing {entity.__tablename__} row with another primary key has the same "
+                                f"values of a unique key.")
+
+
+def upsert_entity(entity, entity_fields, session=None):
+    """
+    Wrapper for a native upsert of an entity that runs in one transaction: a single INSERT ... ON DUPLICATE KEY UPDATE
+    on MariaDB/MySQL, whose insert id tells if the row was created or updated, so concurrent upserts of the same new key
+    get one creation and one update whatever the isolation level is. An entity that has the values of a secondary unique
+    key of another row is rejected with an IntegrityError (see 'get_upsert_statement'). SQLite (INSERT ... ON CONFLICT DO UPDATE) always
+    reports one affected row, so the existing row is selected first - its writers are serialized by the database lock.
+    The databases without a native upsert get an update by primary key followed, if no row was matched, by an insert.
+    The payload is True if the entity was created and False if it was updated.
+    :param entity: the type of the entity
+    :param entity_fields: a dictionary that contains all the fields of the entity, including the primary key
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    with session_scope(session) as session:
+        response = OperationResponseWrapper()
+        primary_key = get_primary_key_column(entity)
+
+        try:
+            with time_stage("upsert_entity", entity.__tablename__, "database"):
+                dialect_name = session.get_bind().dialect.name
+                statement = get_upsert_statement(entity, dialect_name, entity_fields)
+
+                if statement is None:
+                    response.payload = upsert_rows(session, entity, [entity_fields])[0]
+                elif dialect_name in ("mysql", "mariadb"):
+                    result = session.execute(statement, entity_fields)
+                    check_upsert_conflicts(session, entity, result, [entity_fields])
+                    response.payload = result.lastrowid != UPSERT_UPDATED_ID
+                else:
+                    existing_row = session.execute(get_select_identifier_statement(entity, primary_key.key),
+                                                   {"identifier_value": entity_fields[primary_key.key]}).first()
+                    session.execute(statement, entity_fields)
+                    response.payload = existing_row is None
+
+                commit_session(session)
+            after_commit(session, register_entity_change, entity, entity_fields[primary_key.key])
+            on_commit(session, publish_entity_change, entity, "insert" if response.payload else "update",
+                      primary_key.key, entity_fields[primary_key.key], entity_fields)
+            response.completed_operation = True
+        except Exception as e:
+            rollback_session(session, e)
+            response.completed_operation = False
+            response.error = e
+
+        return response
+
+
+def insert_entities(entity, entities_fields, chunk_size, upsert=False, session=None):
+    """
+    Wrapper for an ORM call that inserts (or upserts) many instances of an entity into the database.
+    Every chunk is inserted by a single multi-row INSERT (or native upsert, see 'upsert_rows' for the databases without
+    one) and committed on its own. If a chunk fails (e.g. on a duplicate key), its rows are inserted one by one,
+    each in its own savepoint, so that only the faulty rows are rejected. In a unit of work every chunk runs in a savepoint instead of its own transaction.
+    The payload is a list with the error of every instance (None if it was inserted).
+    :param entity: the type of the entity
+    :param entities_fields: a list of dictionaries containing the attributes of the instances
+    :param chunk_size: the maximum number of rows inserted by a single statement
+    :param upsert: True if the existing instances are to be updated instead of rejected
+    (all the instances must then have the same fields) - the instances that have the values of a secondary unique key
+    of another row are still rejected
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    with session_scope(session) as session:
+        response = OperationResponseWrapper(payload=[None] * len(entities_fields))
+        primary_key_name = get_primary_key_column(entity).key
+        unit_of_work = get_unit_of_work(session)
+        operation_name = "upsert_entities" if upsert else "insert_entities"
+        dialect_name = session.get_bind().dialect.name
+        if upsert and entities_fields:
+            statement = get_upsert_statement(entity, dialect_name, entities_fields[0])
+        else:
+            statement = insert(entity)
+        check_conflicts = upsert and dialect_name in ("mysql", "mariadb")
+
+        def execute(rows):
+            if statement is None:
+                upsert_rows(session, entity, rows)
+                return
+            result = session.execute(statement, rows)
+            if check_conflicts:
+                check_upsert_conflicts(session, entity, result, rows)
+
+        for chunk_start in range(0, len(entities_fields), chunk_size):
+            chunk = entities_fields[chunk_start:chunk_start + chunk_size]
+            with time_stage(operation_name, entity.__tablename__, "database"):
+                try:
+                    if unit_of_work is None:
+                        execute(chunk)
+                        session.commit()
+                    else:
+                        # a failed chunk must not roll back the writes of the other operations of the unit of work
+                        with session.begin_nested():
+                            execute(chunk)
+                        commit_session(session)
+                except Exception:
+                    if unit_of_work is None:
+                        session.rollback()
+                    for index, fields in enumerate(chunk, start=chunk_start):
+                        try:
+                            with session.begin_nested():
+                                execute([fields])
+                        except Exception as e:
+                            response.payload[index] = e
+                    try:
+                        commit_session(session)
+                    except Exception as e:
+                        rollback_session(session, e)
+                        for index in range(chunk_start, chunk_start + len(chunk)):
+                            response.payload[index] = response.payload[index] or e
+
+            after_commit(session, register_entity_change, entity, *(fields.get(primary_key_name) for fields in chunk))
+            on_commit(session, publish_entity_changes, entity, "upsert" if upsert else "insert",
+                      [fields for index, fields in enumerate(chunk, start=chunk_start) if response.payload[index] is None])
+
+        response.completed_operation = not any(response.payload)
+        return response
+
+
+def get_entity_etag(entity, identifier_value):
+    """
+    Returns the ETag of an Entity, built out of the version counters - no database call is made.
+    None is returned if the identifier is not a valid primary key value.
+    :param entity: the type of the entity
+    :param identifier_value: the value of the primary key
+    """
+    identifier_key = get_identifier_key(entity, identifier_value)
+    if identifier_key is None:
+        return None
+    return entity_versions.get_row_etag(entity.__tablename__, identifier_key)
+
+
+def get_entities_etag(entity):
+    """
+    Returns the ETag of all the instances of an entity, built out of the version counters - no database call is made.
+    :param entity: the type of the entity
+    """
+    return entity_versions.get_table_etag(entity.__tablename__)
+
+
+def get_entities_written_at(entity):
+    """
+    Returns the time.monotonic() of the last write on the instances of an entity - None if there was none.
+    :param entity: the type of the entity
+    """
+    return entity_versions.get_table_written_at(entity.__tablename__)
+
+
+def get_book_by_isbn(isbn, columns=None, session=None):
     """
     Wrapper for an ORM call that is retrieving a(n) entity by its isbn.
     :param isbn: TODO
+    :param columns: the names of the columns that are to be retrieved - all of them if missing
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return get_entity_by_identifier(Book, "isbn", isbn)
+    return get_entity_by_identifier(Book, "isbn", isbn, columns=columns, session=session)
 
-def get_author_by_author_id(author_id):
+def get_author_by_author_id(author_id, columns=None, session=None):
     """
     Wrapper for an ORM call that is retrieving a(n) entity by its author_id.
     :param author_id: TODO
+    :param columns: the names of the columns that are to be retrieved - all of them if missing
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return get_entity_by_identifier(Author, "author_id", author_id)
+    return get_entity_by_identifier(Author, "author_id", author_id, columns=columns, session=session)
 
-def get_books_authors_by_id(id):
+def get_books_authors_by_id(id, columns=None, session=None):
     """
     Wrapper for an ORM call that is retrieving a(n) entity by its id.
     :param id: TODO
+    :param columns: the names of the columns that are to be retrieved - all of them if missing
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return get_entity_by_identifier(Books_Authors, "id", id)
+    return get_entity_by_identifier(Books_Authors, "id", id, columns=columns, session=session)
 
 
-def get_all_books_with_filters(**kwargs):
+def stream_books(batch_size, columns=None, session=None):
+    """
+    Wrapper for an ORM call that is streaming all the books in batches.
+    :param batch_size: the number of books fetched at a time
+    :param columns: the names of the columns that are to be retrieved
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return stream_entities(Book, batch_size, columns=columns, session=session)
+def stream_authors(batch_size, columns=None, session=None):
+    """
+    Wrapper for an ORM call that is streaming all the authors in batches.
+    :param batch_size: the number of authors fetched at a time
+    :param columns: the names of the columns that are to be retrieved
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return stream_entities(Author, batch_size, columns=columns, session=session)
+def stream_books_authors(batch_size, columns=None, session=None):
+    """
+    Wrapper for an ORM call that is streaming all the books_authors in batches.
+    :param batch_size: the number of books_authors fetched at a time
+    :param columns: the names of the columns that are to be retrieved
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return stream_entities(Books_Authors, batch_size, columns=columns, session=session)
+
+
+def search_books(query, page, items_per_page, columns=None, session=None):
+    """
+    Wrapper for an ORM call that is searching the books by their title.
+    :param query: the words searched in the titles
+    :param page: the 1-based number of the page that is to be retrieved
+    :param items_per_page: the maximum number of books that are to be retrieved
+    :param columns: the names of the columns that are to be retrieved
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return search_entities(Book, query, page, items_per_page, columns=columns, session=session)
+def search_authors(query, page, items_per_page, columns=None, session=None):
+    """
+    Wrapper for an ORM call that is searching the authors by their first and last name.
+    :param query: the words searched in the names
+    :param page: the 1-based number of the page that is to be retrieved
+    :param items_per_page: the maximum number of authors that are to be retrieved
+    :param columns: the names of the columns that are to be retrieved
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return search_entities(Author, query, page, items_per_page, columns=columns, session=session)
+
+
+def get_books_by_isbns(isbns, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is retrieving many books by their isbn.
+    :param isbns: the isbns of the books, in the order in which the books are returned
+    :param chunk_size: the maximum number of isbns of a single query
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return get_entities_by_identifiers(Book, isbns, chunk_size, session=session)
+def get_authors_by_author_ids(author_ids, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is retrieving many authors by their author_id.
+    :param author_ids: the author_ids of the authors, in the order in which the authors are returned
+    :param chunk_size: the maximum number of author_ids of a single query
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return get_entities_by_identifiers(Author, author_ids, chunk_size, session=session)
+def get_many_books_authors_by_ids(ids, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is retrieving many books_authors by their id.
+    :param ids: the ids of the books_authors, in the order in which the books_authors are returned
+    :param chunk_size: the maximum number of ids of a single query
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return get_entities_by_identifiers(Books_Authors, ids, chunk_size, session=session)
+
+
+def get_authors_of_book(isbn, session=None):
+    """
+    Wrapper for an ORM call that is retrieving the authors of a(n) book by its isbn.
+    :param isbn: isbn of the book
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return get_related_entities(Book, "isbn", isbn, "authors", session=session)
+def get_books_of_author(author_id, session=None):
+    """
+    Wrapper for an ORM call that is retrieving the books of a(n) author by its author_id.
+    :param author_id: author_id of the author
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return get_related_entities(Author, "author_id", author_id, "books", session=session)
+
+
+def invalidate_entities(entity_names=None):
+    """
+    Registers the writes made outside of this process on some entities - see 'register_unknown_entity_changes' -
+    and publishes a 'reload' change of every entity to the change feed. Returns the names of the invalidated entities.
+    :param entity_names: the names of the entities, as in the paths of the API - None for all of them
+    """
+    entities = {entity.__tablename__.lower(): entity for entity in (Book, Author, Books_Authors)}
+    invalidated_names = sorted(entities if entity_names is None else entity_names)
+    for entity_name in invalidated_names:
+        register_unknown_entity_changes(entities[entity_name])
+        change_log.publish(entity_name, "reload", None)
+    return invalidated_names
+
+
+def get_book_etag(isbn):
+    """
+    Returns the ETag of a(n) book by its isbn.
+    :param isbn: isbn of the book
+    """
+    return get_entity_etag(Book, isbn)
+def get_author_etag(author_id):
+    """
+    Returns the ETag of a(n) author by its author_id.
+    :param author_id: author_id of the author
+    """
+    return get_entity_etag(Author, author_id)
+def get_books_authors_etag(id):
+    """
+    Returns the ETag of a(n) books_authors by its id.
+    :param id: id of the books_authors
+    """
+    return get_entity_etag(Books_Authors, id)
+def get_books_etag():
+    """
+    Returns the ETag of all the books.
+    """
+    return get_entities_etag(Book)
+def get_authors_etag():
+    """
+    Returns the ETag of all the authors.
+    """
+    return get_entities_etag(Author)
+def get_all_books_authors_etag():
+    """
+    Returns the ETag of all the books_authors.
+    """
+    return get_entities_etag(Books_Authors)
+def get_books_written_at():
+    """
+    Returns the time of the last write on the books.
+    """
+    return get_entities_written_at(Book)
+def get_authors_written_at():
+    """
+    Returns the time of the last write on the authors.
+    """
+    return get_entities_written_at(Author)
+def get_books_authors_written_at():
+    """
+    Returns the time of the last write on the books_authors.
+    """
+    return get_entities_written_at(Books_Authors)
+
+
+def get_all_books_with_filters(session=None, **kwargs):
     """
     Wrapper for an ORM call that is retrieving all books by isbn
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the parameters by which the filters will be made
     """
-    return get_all_entities(Book, **kwargs)
-def get_all_authors_with_filters(**kwargs):
+    return get_all_entities(Book, session=session, **kwargs)
+def get_all_authors_with_filters(session=None, **kwargs):
     """
     Wrapper for an ORM call that is retrieving all authors by author_id
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the parameters by which the filters will be made
     """
-    return get_all_entities(Author, **kwargs)
-def get_all_books_authors_with_filters(**kwargs):
+    return get_all_entities(Author, session=session, **kwargs)
+def get_all_books_authors_with_filters(session=None, **kwargs):
     """
     Wrapper for an ORM call that is retrieving all books_authors by id
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the parameters by which the filters will be made
     """
-    return get_all_entities(Books_Authors, **kwargs)
+    return get_all_entities(Books_Authors, session=session, **kwargs)
 
 
-def update_book(isbn, book):
+def update_book(isbn, book, session=None):
     """
     Wrapper for an ORM call that updates a(n) book in the database.
     :param isbn: the identifier of the Book
     :param book: a dictionary containing the fields of the book - can be partial
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return update_entity_by_identifier(Book, "isbn", isbn, book)
-def update_author(author_id, author):
+    return update_entity_by_identifier(Book, "isbn", isbn, book, session=session)
+def update_author(author_id, author, session=None):
     """
     Wrapper for an ORM call that updates a(n) author in the database.
     :param author_id: the identifier of the Author
     :param author: a dictionary containing the fields of the author - can be partial
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return update_entity_by_identifier(Author, "author_id", author_id, author)
-def update_books_authors(id, books_authors):
+    return update_entity_by_identifier(Author, "author_id", author_id, author, session=session)
+def update_books_authors(id, books_authors, session=None):
     """
     Wrapper for an ORM call that updates a(n) books_authors in the database.
     :param id: the identifier of the Books_Authors
     :param books_authors: a dictionary containing the fields of the books_authors - can be partial
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return update_entity_by_identifier(Books_Authors, "id", id, books_authors, session=session)
+
+
+def upsert_book(book, session=None):
+    """
+    Wrapper for an ORM call that creates or updates a(n) book in the database.
+    :param book: a dictionary containing all the fields of the book
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return upsert_entity(Book, book, session=session)
+def upsert_author(author, session=None):
     """
-    return update_entity_by_identifier(Books_Authors, "id", id, books_authors)
+    Wrapper for an ORM call that creates or updates a(n) author in the database.
+    :param author: a dictionary containing all the fields of the author
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return upsert_entity(Author, author, session=session)
+def upsert_books_authors(books_authors, session=None):
+    """
+    Wrapper for an ORM call that creates or updates a(n) books_authors in the database.
+    :param books_authors: a dictionary containing all the fields of the books_authors
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return upsert_entity(Books_Authors, books_authors, session=session)
 
 
-def delete_book_by_isbn(isbn):
+def delete_book_by_isbn(isbn, session=None):
     """
     Wrapper for an ORM call that is deleting a(n) book by its isbn.
     :param isbn: isbn of the book that is to be deleted
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return delete_entity_by_identifier(Book, "isbn", isbn)
-def delete_author_by_author_id(author_id):
+    return delete_entity_by_identifier(Book, "isbn", isbn, session=session)
+def delete_author_by_author_id(author_id, session=None):
     """
     Wrapper for an ORM call that is deleting a(n) author by its author_id.
     :param author_id: author_id of the author that is to be deleted
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return delete_entity_by_identifier(Author, "author_id", author_id)
-def delete_books_authors_by_id(id):
+    return delete_entity_by_identifier(Author, "author_id", author_id, session=session)
+def delete_books_authors_by_id(id, session=None):
     """
     Wrapper for an ORM call that is deleting a(n) books_authors by its id.
     :param id: id of the books_authors that is to be deleted
+    :param session: the session in which the operation runs - a new one is opened if missing
     """
-    return delete_entity_by_identifier(Books_Authors, "id", id)
+    return delete_entity_by_identifier(Books_Authors, "id", id, session=session)
 
 
-def insert_book(**kwargs):
+def insert_book(session=None, **kwargs):
     """
     Wrapper for an ORM call that is creating a(n) book.
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the attributes of the Book that is to be created
     """
-    return insert_entity(Book, **kwargs)
-def insert_author(**kwargs):
+    return insert_entity(Book, session=session, **kwargs)
+def insert_author(session=None, **kwargs):
     """
     Wrapper for an ORM call that is creating a(n) author.
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the attributes of the Author that is to be created
     """
-    return insert_entity(Author, **kwargs)
-def insert_books_authors(**kwargs):
+    return insert_entity(Author, session=session, **kwargs)
+def insert_books_authors(session=None, **kwargs):
     """
     Wrapper for an ORM call that is creating a(n) books_authors.
+    :param session: the session in which the operation runs - a new one is opened if missing
     :param kwargs: the attributes of the Books_Authors that is to be created
     """
-    return insert_entity(Books_Authors, **kwargs)
+    return insert_entity(Books_Authors, session=session, **kwargs)
+
+
+def insert_books(books, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is creating many books.
+    :param books: a list with the attributes of the Books that are to be created
+    :param chunk_size: the maximum number of rows inserted by a single statement
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return insert_entities(Book, books, chunk_size, session=session)
+def insert_authors(authors, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is creating many authors.
+    :param authors: a list with the attributes of the Authors that are to be created
+    :param chunk_size: the maximum number of rows inserted by a single statement
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return insert_entities(Author, authors, chunk_size, session=session)
+def insert_many_books_authors(books_authors, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is creating many books_authors.
+    :param books_authors: a list with the attributes of the Books_Authors that are to be created
+    :param chunk_size: the maximum number of rows inserted by a single statement
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return insert_entities(Books_Authors, books_authors, chunk_size, session=session)
+
 
+def upsert_books(books, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is creating or updating many books.
+    :param books: a list with all the fields of the Books that are to be created or updated
+    :param chunk_size: the maximum number of rows upserted by a single statement
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return insert_entities(Book, books, chunk_size, upsert=True, session=session)
+def upsert_authors(authors, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is creating or updating many authors.
+    :param authors: a list with all the fields of the Authors that are to be created or updated
+    :param chunk_size: the maximum number of rows upserted by a single statement
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return insert_entities(Author, authors, chunk_size, upsert=True, session=session)
+def upsert_many_books_authors(books_authors, chunk_size, session=None):
+    """
+    Wrapper for an ORM call that is creating or updating many books_authors.
+    :param books_authors: a list with all the fields of the Books_Authors that are to be created or updated
+    :param chunk_size: the maximum number of rows upserted by a single statement
+    :param session: the session in which the operation runs - a new one is opened if missing
+    """
+    return insert_entities(Books_Authors, books_authors, chunk_size, upsert=True, session=session)
@@ -0,0 +1,129 @@
+import math
+import os
+import threading
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from db import DB_REPLICA_MAX_LAG_SECONDS, replicas, primary_reads
+from metrics import Gauge
+
+# after a write, the reads of the same client go to the primary for this many seconds
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+DB_REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_CHECK_INTERVAL", "5"))
+# a replica in the rotation lagged at most DB_REPLICA_MAX_LAG_SECONDS at its last health check,
+# so a write has reached all of them once this long has passed
+REPLICA_CATCH_UP_SECONDS = DB_REPLICA_MAX_LAG_SECONDS + DB_REPLICA_HEALTH_CHECK_INTERVAL
+
+LAST_WRITE_COOKIE = "last_write"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# the POST routes that only read (their identifiers do not fit in a query string), so they are handled as reads:
+# they run on a read-only unit of work and do not send the reads of the client to the primary
+READ_ONLY_POST_ROUTES = frozenset(("/api/books/lookup", "/api/authors/lookup", "/api/books_authors/lookup"))
+
+db_replica_healthy = Gauge("db_replica_healthy", "1 if the replica serves reads, 0 if it is out of the rotation.",
+                           ("replica",))
+db_replica_lag_seconds = Gauge("db_replica_lag_seconds", "Replication lag of the replica at its last health check.",
+                               ("replica",))
+
+
+def check_replicas():
+    """
+    Runs the health check of every replica and records its outcome in the metrics.
+    """
+    for replica in replicas:
+        replica.check()
+        db_replica_healthy.set((replica.name,), int(replica.healthy))
+        # -1 if the lag is unknown (broken replication or unreachable replica)
+        db_replica_lag_seconds.set((replica.name,), replica.lag_seconds if replica.lag_seconds is not None else -1)
+
+
+def replicas_may_lag(written_at):
+    """
+    Tells if the replicas may not have applied a write yet.
+    :param written_at: the time.monotonic() of the write - None if there was none
+    """
+    return bool(replicas) and written_at is not None and time.monotonic() - written_at < REPLICA_CATCH_UP_SECONDS
+
+
+def is_write_request(scope):
+    """
+    Tells if a request may write, by its method and, for a POST, by its route.
+    :param scope: the ASGI scope of the request
+    """
+    return scope["method"] in WRITE_METHODS and not (scope["method"] == "POST" and scope["path"] in READ_ONLY_POST_ROUTES)
+
+
+class ReplicaHealthChecker:
+    """
+    Background thread that checks the replicas every DB_REPLICA_HEALTH_CHECK_INTERVAL seconds, so that
+    the lagging or unreachable ones leave the rotation (and come back once they caught up).
+    """
+    def __init__(self, interval=DB_REPLICA_HEALTH_CHECK_INTERVAL):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            check_replicas()
+
+    def start(self):
+        if not replicas or self.thread is not None:
+            return
+        # the replicas are checked once before the first request
+        check_replicas()
+        self.thread = threading.Thread(target=self.run, name="replica-health-checker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.stopped.clear()
+
+
+replica_health_checker = ReplicaHealthChecker()
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware that keeps the reads of a client on the primary right after its own writes, which the replicas
+    may not have applied yet: a successful write request sets a cookie with the time of the write, and the requests
+    that carry it within DB_READ_YOUR_WRITES_SECONDS read from the primary.
+    """
+    def __init__(self, app, window_seconds=DB_READ_YOUR_WRITES_SECONDS):
+        self.app = app
+        self.window_seconds = window_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if is_write_request(scope):
+            async def send_with_cookie(message):
+                if message["type"] == "http.response.start" and message["status"] < 400:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("set-cookie", f"{LAST_WRITE_COOKIE}={time.time():.3f}; Max-Age={math.ceil(self.window_seconds)}; "
+                                                 f"Path=/; HttpOnly; SameSite=Lax")
+                await send(message)
+
+            await self.app(scope, receive, send_with_cookie)
+            return
+
+        try:
+            last_write = float(HTTPConnection(scope).cookies.get(LAST_WRITE_COOKIE, "-inf"))
+        except ValueError:
+            last_write = float("-inf")
+
+        if time.time() - last_write >= self.window_seconds:
+            await self.app(scope, receive, send)
+            return
+
+        token = primary_reads.set(True)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            primary_reads.reset(token)
@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+
+# 'fulltext' uses the FULLTEXT indexes of MariaDB/MySQL, 'index' the in-process inverted index,
+# 'auto' picks the former on MariaDB/MySQL and the latter on any other database (e.g. the SQLite stand-in)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# the words the FULLTEXT indexes do not hold: the ones shorter than their minimum token size (innodb_ft_min_token_size)
+# and the stopwords (the default stopword list of InnoDB) - a boolean mode query that requires one of them matches nothing
+FULLTEXT_MIN_TOKEN_SIZE = int(os.getenv("FULLTEXT_MIN_TOKEN_SIZE", "3"))
+FULLTEXT_STOPWORDS = frozenset((
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how", "i", "in", "is", "it",
+    "la", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "who", "will", "with", "und", "www"))
+
+
+def get_tokens(text):
+    """
+    Splits a text into lowercase words.
+    :param text: the text that is to be split
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def get_search_terms(query):
+    """
+    Returns the words of a query that a search requires: the stopwords and the words shorter than
+    FULLTEXT_MIN_TOKEN_SIZE are left out (e.g. 'the hobbit' requires 'hobbit' only), on every backend,
+    so a query matches the same rows whether it is served by the FULLTEXT indexes or by the in-process index.
+    :param query: the text searched by the client
+    """
+    return [token for token in get_tokens(query) if len(token) >= FULLTEXT_MIN_TOKEN_SIZE and token not in FULLTEXT_STOPWORDS]
+
+
+def get_boolean_mode_query(query):
+    """
+    Builds a FULLTEXT boolean mode query that requires every search term of a query (see 'get_search_terms'),
+    matched as a prefix, so the query is empty if it has no search term.
+    The words only hold word characters, so they can not carry boolean mode operators.
+    :param query: the text searched by the client
+    """
+    return " ".join(f"+{term}*" for term in get_search_terms(query))
+
+
+def uses_fulltext(dialect_name):
+    """
+    Checks if the searches on a database are served by its FULLTEXT indexes.
+    :param dialect_name: the name of the SQLAlchemy dialect of the database
+    """
+    if SEARCH_BACKEND == "auto":
+        return dialect_name in ("mysql", "mariadb")
+    return SEARCH_BACKEND == "fulltext"
+
+
+class SearchIndex:
+    """
+    In-process inverted index of the words of the searchable columns of a table, keyed by the primary key.
+    It is built from the database on the first search; afterwards the writes registered by the model only
+    mark their rows as changed and the changed rows are read again before the next search.
+    Only the writes made by this process are seen, like by the entity cache and the version counters.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.built = False
+        self.changed_keys = set()
+        self.documents = {}
+        self.postings = {}
+        self.sorted_tokens = []
+
+    def mark_changed(self, keys=None):
+        """
+        Registers a write on some rows of the table.
+        :param keys: the primary key values of the written rows - None if they are not known
+        """
+        with self.lock:
+            if not self.built:
+                return
+            if keys is None:
+                self.built = False
+                self.changed_keys.clear()
+            else:
+                self.changed_keys.update(keys)
+
+    def refresh(self, get_all_documents, get_documents):
+        """
+        Brings the index up to date before a search: it is built if it was never built (or if a write
+        changed unknown rows), otherwise the rows marked as changed are indexed again.
+        The writes registered while the index is refreshed are marked for the next refresh.
+        :param get_all_documents: a function returning an iterable of (key, text) pairs for all the rows
+        :param get_documents: a function returning a dictionary of key -> text for the given keys
+        (the keys that are missing belong to deleted rows)
+        """
+        with self.refresh_lock:
+            with self.lock:
+                built = self.built
+                changed_keys = self.changed_keys
+                self.changed_keys = set()
+                self.built = True
+
+            try:
+                if not built:
+                    documents = {}
+                    postings = {}
+                    for key, text in get_all_documents():
+                        tokens = set(get_tokens(text))
+                        documents[key] = tokens
+                        for token in tokens:
+                            postings.setdefault(token, set()).add(key)
+                    with self.lock:
+                        self.documents = documents
+                        self.postings = postings
+                        self.sorted_tokens = sorted(postings)
+                elif changed_keys:
+                    texts = get_documents(changed_keys)
+                    for key in changed_keys:
+                        self.update(key, texts.get(key))
+            except Exception:
+                # the refresh is retried by the next search
+                with self.lock:
+                    if built:
+                        self.changed_keys.update(changed_keys)
+                    else:
+                        self.built = False
+                raise
+
+    def update(self, key, text):
+        """
+        Indexes the text of a row, replacing the previous one.
+        :param key: the primary key value of the row
+        :param text: the searchable text of the row - None if the row was deleted
+        """
+        tokens = set(get_tokens(text)) if text is not None else set()
+        with self.lock:
+            old_tokens = self.documents.pop(key, set())
+            for token in old_tokens - tokens:
+                keys = self.postings[token]
+                keys.discard(key)
+                if not keys:
+                    del self.postings[token]
+                    del self.sorted_tokens[bisect_left(self.sorted_tokens, token)]
+            for token in tokens - old_tokens:
+                if token not in self.postings:
+                    self.postings[token] = set()
+                    insort(self.sorted_tokens, token)
+                self.postings[token].add(key)
+            if tokens:
+                self.documents[key] = tokens
+
+    def search(self, query, offset, limit):
+        """
+        Returns the keys of a page of the rows that contain every search term of a query (see 'get_search_terms')
+        as a prefix of one of their words, ranked by the number of terms matched exactly, ties broken by the key.
+        A query without search term matches nothing, like an empty FULLTEXT boolean mode query.
+        :param query: the text searched by the client
+        :param offset: the number of ranked rows that are skipped
+        :param limit: the maximum number of keys that are returned
+        """
+        terms = set(get_search_terms(query))
+        if not terms:
+            return []
+
+        scores = None
+        with self.lock:
+            for term in terms:
+                term_scores = {}
+                position = bisect_left(self.sorted_tokens, term)
+                while position < len(self.sorted_tokens) and self.sorted_tokens[position].startswith(term):
+                    token = self.sorted_tokens[position]
+                    for key in self.postings[token]:
+                        term_scores[key] = max(term_scores.get(key, 0), 2 if token == term else 1)
+                    position += 1
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+                if not scores:
+                    return []
+
+        ranked_keys = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [key for key, _ in ranked_keys[offset:offset + limit]]
+
+
+search_indexes = {}
+search_indexes_lock = threading.Lock()
+
+
+def get_search_index(table_name):
+    """
+    Returns the in-process search index of a table.
+    :param table_name: the name of the table
+    """
+    with search_indexes_lock:
+        return search_indexes.setdefault(table_name, SearchIndex())
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Literal
+from async_model import UnitOfWork, get_unit_of_work
+from model import search_books, search_authors
+from utils import get_error_body
+from serialization import FastJSONResponse, HALSerializer
+from view import Error, Book, Author, SearchResult
+
+router = APIRouter()
+book_serializer = HALSerializer(Book)
+author_serializer = HALSerializer(Author)
+
+
+@router.get("/api/search",
+            responses={200: {"model": SearchResult},
+                       500: {"model": Error}},
+            response_model=SearchResult,
+            tags=["search"])
+async def search(q: str = Query(..., min_length=1, max_length=200),
+                 type: Literal["all", "books", "authors"] = "all",
+                 page: int = Query(1, ge=1),
+                 items_per_page: int = Query(15, ge=1),
+                 unit_of_work: UnitOfWork = Depends(get_unit_of_work)):
+    """
+    Method that handles a search of the books by their title and of the authors by their first and last name.
+    Every word of 'q' has to match the beginning of a word of the book or author, the best matches come first;
+    the stopwords (e.g. 'the') and the words shorter than FULLTEXT_MIN_TOKEN_SIZE are ignored, whatever the database.
+    'type' restricts the search to the books or to the authors; every list is paginated on its own.
+    Both searches run on the same connection.
+    """
+    response_body = {"books": [], "authors": []}
+
+    for searched_type, operation, serializer in (("books", search_books, book_serializer),
+                                                 ("authors", search_authors, author_serializer)):
+        if type not in ("all", searched_type):
+            continue
+
+        db_response = await unit_of_work.run(operation, q, page, items_per_page, columns=serializer.field_names)
+        if db_response.error:
+            await unit_of_work.close()
+            status_code = 500
+            return FastJSONResponse(status_code=status_code, content=get_error_body(status_code, str(db_response.error), "EXCEPTION"))
+        response_body[searched_type] = serializer.serialize(db_response.payload)
+
+    await unit_of_work.complete()
+    return FastJSONResponse(status_code=200, content=response_body)
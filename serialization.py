@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import urllib.parse
+from operator import attrgetter
+from fastapi.responses import JSONResponse
+from fastapi_hypermodel import HyperModel
+from starlette.routing import Route
+from metrics import time_stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse that is encoded by orjson when it is installed - the output is the same compact
+    UTF-8 JSON that the standard 'json' module produces.
+    """
+    def render(self, content):
+        with time_stage("render", "response", "json_encoding"):
+            if orjson is None:
+                return super().render(content)
+            return orjson.dumps(content)
+
+
+def get_path_parameter(value):
+    """
+    Converts a value into a path parameter the same way fastapi_hypermodel does.
+    :param value: the value of the field
+    """
+    if isinstance(value, str):
+        return urllib.parse.quote(value)
+    return str(value)
+
+
+class HALSerializer:
+    """
+    Serializes rows (plain SQL rows or ORM instances) into the same dictionaries that
+    'view_model.from_orm(row).dict()' produces, without validating every row through Pydantic.
+    The HAL links are rendered from the path templates of their routes, which are resolved only once.
+    """
+    def __init__(self, view_model):
+        self.name = view_model.__name__
+        self.field_names = [name for name in view_model.__fields__ if name != "links"]
+        self.link_set = view_model.__fields__["links"].default
+        # the fields whose values are the parameters of the links
+        self.link_field_names = list(dict.fromkeys(field[1:-1] for link in self.link_set.values()
+                                                   for field in link._param_values.values()))
+        self.link_templates = None
+        self.value_getters = {}
+
+    def parse_fields(self, fields):
+        """
+        Parses the value of a 'fields' query parameter (a comma separated list of field names, 'links' included)
+        into the names of the requested fields, in the order of the view model, and whether the links are requested.
+        Raises ValueError if a field is unknown or if no field is given.
+        :param fields: the value of the parameter - None for all the fields and the links
+        """
+        if fields is None:
+            return self.field_names, True
+
+        requested_fields = {field.strip() for field in fields.split(",")} - {""}
+        unknown_fields = requested_fields - set(self.field_names) - {"links"}
+        if unknown_fields or not requested_fields:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown_fields))}." if unknown_fields else "No fields.")
+        return [name for name in self.field_names if name in requested_fields], "links" in requested_fields
+
+    def get_columns(self, field_names, include_links, *required_field_names):
+        """
+        Returns the names of the columns that have to be selected to serialize some fields.
+        :param field_names: the names of the serialized fields
+        :param include_links: True if the links are serialized
+        :param required_field_names: the names of other fields needed by the caller (e.g. to build the pagination cursor)
+        """
+        required_field_names = set(field_names) | set(required_field_names)
+        if include_links:
+            required_field_names.update(self.link_field_names)
+        return [name for name in self.field_names if name in required_field_names]
+
+    def get_value_getter(self, field_names):
+        field_names = tuple(field_names)
+        value_getter = self.value_getters.get(field_names)
+        if value_getter is None:
+            if len(field_names) == 1:
+                single_getter = attrgetter(field_names[0])
+                value_getter = lambda row: (single_getter(row),)
+            elif field_names:
+                value_getter = attrgetter(*field_names)
+            else:
+                value_getter = lambda row: ()
+            self.value_getters[field_names] = value_getter
+        return value_getter
+
+    def compile_links(self):
+        app = HyperModel._hypermodel_bound_app
+        link_templates = []
+
+        for link_name, link in self.link_set.items():
+            parameter_fields = {parameter: field[1:-1] for parameter, field in link._param_values.items()}
+            routes = [route for route in app.routes if isinstance(route, Route) and route.name == link._endpoint]
+            # the method is the one of the first route named after the endpoint and the path is the one of the
+            # route that has exactly these parameters - just like HALFor and 'url_path_for' pick them
+            path_route = next(route for route in routes if set(route.param_convertors) == set(parameter_fields))
+            method = next(iter(routes[0].methods), None) if routes[0].methods else None
+            link_templates.append((link_name, path_route.path_format, parameter_fields, method, link._description))
+
+        self.link_templates = link_templates
+
+    def get_links(self, row):
+        links = {}
+        for link_name, path_format, parameter_fields, method, description in self.link_templates:
+            parameters = {parameter: get_path_parameter(getattr(row, field)) for parameter, field in parameter_fields.items()}
+            links[link_name] = {
+                "href": path_format.format(**parameters),
+                "method": method,
+                "description": description
+            }
+        return links
+
+    def serialize(self, rows, field_names=None, include_links=True):
+        """
+        Serializes the rows into a list of dictionaries.
+        :param rows: the rows that are to be serialized, having an attribute for every serialized field
+        (and for the parameters of the links, if they are serialized)
+        :param field_names: the names of the serialized fields - all the fields of the view model if missing
+        :param include_links: True if the links are to be serialized
+        """
+        if include_links and self.link_templates is None:
+            self.compile_links()
+
+        field_names = self.field_names if field_names is None else field_names
+        get_values = self.get_value_getter(field_names)
+        serialized_rows = []
+        with time_stage("serialize", self.name, "serialization"):
+            for row in rows:
+                serialized_row = dict(zip(field_names, get_values(row)))
+                if include_links:
+                    serialized_row["links"] = self.get_links(row)
+                serialized_rows.append(serialized_row)
+        return serialized_rows
+
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+def encode_ndjson(serialized_rows):
+    """
+    Encodes serialized rows as newline delimited JSON, one row per line.
+    :param serialized_rows: the dictionaries of the rows
+    """
+    if orjson is None:
+        return "".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in serialized_rows).encode("utf-8")
+    return b"".join(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in serialized_rows)
+
+
+def encode_csv(field_names, rows, header=False):
+    """
+    Encodes the fields of some rows as CSV lines.
+    :param field_names: the names of the fields, in the order of the columns
+    :param rows: the rows, having an attribute for every field
+    :param header: True if the line with the names of the fields is to be written first
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(field_names)
+    writer.writerows([getattr(row, field_name) for field_name in field_names] for row in rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+async def stream_export(serializer, export_format, first_partition, partitions):
+    """
+    Encodes partitions of rows as they arrive, so the body of an export is streamed with constant memory.
+    NDJSON lines hold the same objects as the list endpoints (links included), CSV lines only the fields.
+    :param serializer: the HALSerializer of the view model of the rows
+    :param export_format: 'ndjson' or 'csv'
+    :param first_partition: the partition that was already fetched (used to report errors before the response starts)
+    :param partitions: the async iterator of the remaining partitions
+    """
+    if export_format == "csv":
+        yield encode_csv(serializer.field_names, first_partition, header=True)
+        async for partition in partitions:
+            yield encode_csv(serializer.field_names, partition)
+        return
+
+    yield encode_ndjson(serializer.serialize(first_partition))
+    async for partition in partitions:
+        yield encode_ndjson(serializer.serialize(partition))
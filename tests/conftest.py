@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+# 'db' reads its configuration when it is imported, so the tests run on a SQLite database of their own
+database_directory = tempfile.mkdtemp()
+os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(database_directory, 'test.db')}")
+os.environ.setdefault("ASYNC_DB_URL", f"sqlite+aiosqlite:///{os.path.join(database_directory, 'test.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import delete
+import db
+import model
+
+
+@pytest.fixture
+def database():
+    """
+    Creates the tables and, once the test is done, removes their rows and invalidates the cached entities.
+    """
+    db.Base.metadata.create_all(db.engine)
+    yield db.engine
+    with db.engine.begin() as connection:
+        for table in reversed(db.Base.metadata.sorted_tables):
+            connection.execute(delete(table))
+    model.invalidate_entities()
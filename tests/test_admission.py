@@ -0,0 +1,156 @@
+import asyncio
+import httpx
+import pytest
+import admission
+from admission import AdmissionControlMiddleware, ConcurrencyLimiter
+
+
+def test_limiter_hands_released_slots_over_in_arrival_order():
+    async def run():
+        limiter = ConcurrencyLimiter("test", 1, queue_size=2, queue_timeout=1)
+        assert await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.statistics()["queued"] == 2
+
+        limiter.release()
+        assert await first
+        assert not second.done()
+        limiter.release()
+        assert await second
+        limiter.release()
+
+        statistics = limiter.statistics()
+        assert (statistics["active"], statistics["queued"], statistics["admitted"]) == (0, 0, 3)
+
+    asyncio.run(run())
+
+
+def test_limiter_rejects_when_the_queue_is_full():
+    async def run():
+        limiter = ConcurrencyLimiter("test", 1, queue_size=1, queue_timeout=1)
+        assert await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+
+        assert not await limiter.acquire()
+        limiter.release()
+        assert await waiting
+        limiter.release()
+
+        statistics = limiter.statistics()
+        assert (statistics["active"], statistics["rejected"], statistics["timed_out"]) == (0, 1, 0)
+
+    asyncio.run(run())
+
+
+def test_limiter_rejects_when_the_wait_times_out():
+    async def run():
+        limiter = ConcurrencyLimiter("test", 1, queue_size=1, queue_timeout=0.01)
+        assert await limiter.acquire()
+
+        assert not await limiter.acquire()
+        statistics = limiter.statistics()
+        assert (statistics["active"], statistics["queued"], statistics["timed_out"]) == (1, 0, 1)
+        # the slot is not handed over to the request that gave up
+        limiter.release()
+        assert limiter.statistics()["active"] == 0
+
+    asyncio.run(run())
+
+
+def test_limiter_frees_the_slot_of_a_cancelled_waiter():
+    async def run():
+        limiter = ConcurrencyLimiter("test", 1, queue_size=1, queue_timeout=1)
+        assert await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        limiter.release()
+        statistics = limiter.statistics()
+        assert (statistics["active"], statistics["queued"]) == (0, 0)
+
+    asyncio.run(run())
+
+
+class BlockingApp:
+    """
+    ASGI application whose responses wait until they are released.
+    """
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.released = asyncio.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.started.set()
+        await self.released.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+
+async def get_responses(application, limiter, path="/api/books/"):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=AdmissionControlMiddleware(application, retry_after_seconds=3)),
+                                 base_url="http://test") as client:
+        admitted = asyncio.create_task(client.get(path))
+        await application.started.wait()
+        shed = await client.get(path)
+        application.released.set()
+        return await admitted, shed, limiter.statistics()
+
+
+def test_saturated_limiter_answers_503_when_the_queue_is_full(monkeypatch):
+    limiter = ConcurrencyLimiter("read", 1, queue_size=0, queue_timeout=1)
+    monkeypatch.setattr(admission, "read_limiter", limiter)
+
+    admitted, shed, statistics = asyncio.run(get_responses(BlockingApp(), limiter))
+
+    assert admitted.status_code == 200
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "3"
+    assert shed.json()["error_reason"] == "OVERLOADED"
+    assert (statistics["active"], statistics["rejected"]) == (0, 1)
+
+
+def test_saturated_limiter_answers_503_when_the_wait_times_out(monkeypatch):
+    limiter = ConcurrencyLimiter("write", 1, queue_size=1, queue_timeout=0.01)
+    monkeypatch.setattr(admission, "write_limiter", limiter)
+
+    async def run():
+        application = BlockingApp()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=AdmissionControlMiddleware(application)),
+                                     base_url="http://test") as client:
+            admitted = asyncio.create_task(client.delete("/api/books/1"))
+            await application.started.wait()
+            shed = await client.delete("/api/books/2")
+            application.released.set()
+            return await admitted, shed
+
+    admitted, shed = asyncio.run(run())
+
+    assert admitted.status_code == 200
+    assert shed.status_code == 503
+    assert "retry-after" in shed.headers
+    statistics = limiter.statistics()
+    assert (statistics["active"], statistics["timed_out"]) == (0, 1)
+
+
+def test_admin_routes_are_never_held_back(monkeypatch):
+    limiter = ConcurrencyLimiter("read", 1, queue_size=0, queue_timeout=1)
+    monkeypatch.setattr(admission, "read_limiter", limiter)
+
+    async def run():
+        # the only slot is taken, so the API requests are shed
+        assert await limiter.acquire()
+        application = BlockingApp()
+        application.released.set()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=AdmissionControlMiddleware(application)),
+                                     base_url="http://test") as client:
+            return await client.get("/api/admin/pool"), await client.get("/api/books/")
+
+    admin_response, api_response = asyncio.run(run())
+
+    assert (admin_response.status_code, api_response.status_code) == (200, 503)
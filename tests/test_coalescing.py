@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+from starlette.requests import Request
+from starlette.responses import Response
+from coalescing import ReadCoalescer
+
+
+async def get_books():
+    pass
+
+
+def get_request(path="/api/books/", query_string=b"page=1"):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query_string,
+                    "headers": [], "endpoint": get_books})
+
+
+class Read:
+    """
+    A read that blocks until it is released and counts its database calls.
+    """
+    def __init__(self, body=b"[]", error=None):
+        self.body = body
+        self.error = error
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.released = asyncio.Event()
+
+    async def __call__(self, unit_of_work):
+        self.calls += 1
+        self.started.set()
+        await self.released.wait()
+        if self.error is not None:
+            raise self.error
+        return Response(content=self.body, headers={"ETag": '"1"'})
+
+
+def test_identical_reads_share_one_call():
+    async def run():
+        coalescer = ReadCoalescer(enabled=True)
+        read = Read(b'[{"isbn": "1"}]')
+        leader = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await read.started.wait()
+        joined = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await asyncio.sleep(0)
+        read.released.set()
+        responses = await asyncio.gather(leader, joined)
+
+        assert read.calls == 1
+        assert [response.body for response in responses] == [b'[{"isbn": "1"}]'] * 2
+        # every request gets a response of its own, so that its middlewares do not share the headers
+        assert responses[0] is not responses[1]
+        assert responses[1].headers["etag"] == '"1"'
+        assert coalescer.statistics() == {"enabled": True, "in_flight": 0, "leaders": 1, "joined": 1}
+
+    asyncio.run(run())
+
+
+def test_different_reads_do_not_share_a_call():
+    async def run():
+        coalescer = ReadCoalescer(enabled=True)
+        read = Read()
+        read.released.set()
+        await asyncio.gather(coalescer.run(get_request(query_string=b"page=1"), "v1", read),
+                             coalescer.run(get_request(query_string=b"page=2"), "v1", read),
+                             # a read that arrives after a write has a new version and does not join the older reads
+                             coalescer.run(get_request(query_string=b"page=1"), "v2", read))
+
+        assert read.calls == 3
+        assert coalescer.statistics()["joined"] == 0
+
+    asyncio.run(run())
+
+
+def test_completed_read_is_not_reused():
+    async def run():
+        coalescer = ReadCoalescer(enabled=True)
+        read = Read()
+        read.released.set()
+        await coalescer.run(get_request(), "v1", read)
+        await coalescer.run(get_request(), "v1", read)
+
+        assert read.calls == 2
+        assert coalescer.statistics()["leaders"] == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_does_not_cancel_the_joined_reads():
+    async def run():
+        coalescer = ReadCoalescer(enabled=True)
+        read = Read(b"body")
+        leader = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await read.started.wait()
+        joined = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await asyncio.sleep(0)
+
+        # the client of the leader disconnects
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        read.released.set()
+
+        assert (await joined).body == b"body"
+        assert read.calls == 1
+        assert coalescer.statistics()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_joined_read_does_not_cancel_the_leader():
+    async def run():
+        coalescer = ReadCoalescer(enabled=True)
+        read = Read(b"body")
+        leader = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await read.started.wait()
+        joined = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await asyncio.sleep(0)
+
+        joined.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await joined
+        read.released.set()
+
+        assert (await leader).body == b"body"
+        assert read.calls == 1
+
+    asyncio.run(run())
+
+
+def test_failed_read_fails_every_waiting_request():
+    async def run():
+        coalescer = ReadCoalescer(enabled=True)
+        read = Read(error=RuntimeError("database failed"))
+        leader = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await read.started.wait()
+        joined = asyncio.create_task(coalescer.run(get_request(), "v1", read))
+        await asyncio.sleep(0)
+        read.released.set()
+
+        results = await asyncio.gather(leader, joined, return_exceptions=True)
+        assert [str(result) for result in results] == ["database failed"] * 2
+        assert read.calls == 1
+        assert coalescer.statistics()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_disabled_coalescer_runs_every_read():
+    async def run():
+        coalescer = ReadCoalescer(enabled=False)
+        read = Read()
+        read.released.set()
+        await asyncio.gather(coalescer.run(get_request(), "v1", read), coalescer.run(get_request(), "v1", read))
+
+        assert read.calls == 2
+
+    asyncio.run(run())
@@ -0,0 +1,96 @@
+import asyncio
+from async_model import UnitOfWork, run_model_operation
+from db import after_commit, commit_session, on_commit, rollback_session, session_scope
+from model import get_book_by_isbn, insert_book
+
+
+def get_book(isbn):
+    return {"isbn": isbn, "title": f"Title {isbn}", "year_of_publishing": 2000}
+
+
+def get_write(calls, name, error=None):
+    """
+    Returns a model operation that registers callbacks and writes (or fails, if 'error' is given).
+    """
+    def write(session=None):
+        with session_scope(session) as session:
+            after_commit(session, calls.append, f"{name} after commit")
+            on_commit(session, calls.append, f"{name} on commit")
+            if error is not None:
+                rollback_session(session, error)
+            else:
+                commit_session(session)
+    return write
+
+
+def test_completed_unit_of_work_runs_the_callbacks_in_order(database):
+    calls = []
+
+    async def run():
+        unit_of_work = UnitOfWork()
+        await unit_of_work.run(get_write(calls, "first"))
+        await unit_of_work.run(get_write(calls, "second"))
+        # the after commit callbacks run right away, the commit callbacks wait for the commit
+        assert calls == ["first after commit", "second after commit"]
+        return await unit_of_work.complete()
+
+    assert asyncio.run(run()) is None
+    assert calls == ["first after commit", "second after commit",
+                     "first after commit", "second after commit",
+                     "first on commit", "second on commit"]
+
+
+def test_closed_unit_of_work_runs_the_after_commit_callbacks_only(database):
+    calls = []
+
+    async def run():
+        unit_of_work = UnitOfWork()
+        await unit_of_work.run(get_write(calls, "first"))
+        await unit_of_work.close()
+
+    asyncio.run(run())
+    # the rolled back rows may have been cached meanwhile, so they are registered all the same - but never published
+    assert calls == ["first after commit", "first after commit"]
+
+
+def test_failed_operation_fails_the_unit_of_work(database):
+    calls = []
+    error = RuntimeError("database failed")
+
+    async def run():
+        unit_of_work = UnitOfWork()
+        await unit_of_work.run(insert_book, **get_book("1"))
+        await unit_of_work.run(get_write(calls, "first"))
+        await unit_of_work.run(get_write(calls, "second", error))
+        return await unit_of_work.complete()
+
+    response = asyncio.run(run())
+
+    assert response.error is error
+    assert not response.completed_operation
+    assert calls == ["first after commit", "second after commit", "first after commit", "second after commit"]
+    # the writes of the other operations are rolled back too
+    assert asyncio.run(run_model_operation(get_book_by_isbn, "1")).payload is None
+
+
+def test_completed_unit_of_work_commits_every_operation(database):
+    async def run():
+        unit_of_work = UnitOfWork()
+        first = await unit_of_work.run(insert_book, **get_book("1"))
+        second = await unit_of_work.run(insert_book, **get_book("2"))
+        assert first.completed_operation and second.completed_operation
+        return await unit_of_work.complete(second)
+
+    response = asyncio.run(run())
+
+    assert response.completed_operation
+    for isbn in ("1", "2"):
+        assert asyncio.run(run_model_operation(get_book_by_isbn, isbn)).payload.isbn == isbn
+
+
+def test_operation_without_unit_of_work_runs_the_callbacks_at_once(database):
+    calls = []
+
+    asyncio.run(run_model_operation(get_write(calls, "single")))
+
+    assert calls == ["single after commit", "single on commit"]
@@ -0,0 +1,97 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from Book import Book
+from model import insert_books
+from write_batching import WriteBatcher, write_batchers
+
+
+def get_book(isbn, title=None):
+    return {"isbn": isbn, "title": title or f"Title {isbn}", "year_of_publishing": 2000}
+
+
+def get_isbns(database):
+    with database.connect() as connection:
+        return sorted(connection.execute(select(Book.isbn)).scalars())
+
+
+def get_write_batcher(insert_many_operation=insert_books, **kwargs):
+    write_batcher = WriteBatcher("Books", insert_many_operation, **kwargs)
+    # the test batchers are not the ones of the application
+    write_batchers.remove(write_batcher)
+    return write_batcher
+
+
+async def submit_all(write_batcher, books):
+    try:
+        return await asyncio.gather(*(write_batcher.submit(book) for book in books))
+    finally:
+        await write_batcher.close()
+
+
+def test_concurrent_inserts_are_committed_in_one_batch(database):
+    write_batcher = get_write_batcher(max_items=10, max_delay_ms=50)
+    responses = asyncio.run(submit_all(write_batcher, [get_book(str(number)) for number in range(5)]))
+
+    assert all(response.completed_operation and response.error is None for response in responses)
+    assert get_isbns(database) == ["0", "1", "2", "3", "4"]
+    statistics = write_batcher.statistics()
+    assert (statistics["batches"], statistics["items"], statistics["max_batch_size"]) == (1, 5, 5)
+
+
+def test_every_request_gets_the_result_of_its_own_row(database):
+    write_batcher = get_write_batcher(max_items=10, max_delay_ms=50)
+    asyncio.run(submit_all(write_batcher, [get_book("existing")]))
+
+    responses = asyncio.run(submit_all(write_batcher, [
+        get_book("1"),
+        get_book("existing", "Another title"),  # the primary key of a committed row
+        get_book("2"),
+        get_book("2", "Another title"),  # the primary key of a row of the same batch
+        get_book("3", "Title 1")  # the unique key of a row of the same batch
+    ]))
+
+    assert [response.completed_operation for response in responses] == [True, False, True, False, False]
+    assert [type(response.error) for response in responses] == [type(None), IntegrityError, type(None),
+                                                                 IntegrityError, IntegrityError]
+    assert get_isbns(database) == ["1", "2", "existing"]
+    assert write_batcher.statistics()["batches"] == 2
+
+
+def test_batches_are_split_by_max_items(database):
+    write_batcher = get_write_batcher(max_items=2, max_delay_ms=50)
+    responses = asyncio.run(submit_all(write_batcher, [get_book(str(number)) for number in range(5)]))
+
+    assert all(response.completed_operation for response in responses)
+    statistics = write_batcher.statistics()
+    assert (statistics["batches"], statistics["items"], statistics["max_batch_size"]) == (3, 5, 2)
+
+
+def test_failed_batch_fails_every_request():
+    def insert_many_operation(entities_fields, chunk_size, session=None):
+        raise RuntimeError("database failed")
+
+    write_batcher = get_write_batcher(insert_many_operation, max_items=10, max_delay_ms=50)
+    responses = asyncio.run(submit_all(write_batcher, [get_book("1"), get_book("2")]))
+
+    assert [str(response.error) for response in responses] == ["database failed"] * 2
+    assert not any(response.completed_operation for response in responses)
+
+
+def test_cancelled_request_does_not_fail_its_batch(database):
+    async def run(write_batcher):
+        cancelled = asyncio.create_task(write_batcher.submit(get_book("1")))
+        waiting = asyncio.create_task(write_batcher.submit(get_book("2")))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        try:
+            return await waiting
+        finally:
+            await write_batcher.close()
+
+    write_batcher = get_write_batcher(max_items=10, max_delay_ms=50)
+    response = asyncio.run(run(write_batcher))
+
+    assert response.completed_operation
+    # the insert of the cancelled request was already queued, so it is committed all the same
+    assert get_isbns(database) == ["1", "2"]
@@ -1,4 +1,10 @@
+import base64
+import json
+import os
+from typing import List
 from pydantic import BaseModel
+from starlette.responses import Response
+from sqlalchemy.exc import IntegrityError
 
 BOOK_NOT_FOUND_BODY = {
     "error_code": 404,
@@ -16,6 +22,12 @@ BOOKS_AUTHORS_NOT_FOUND_BODY = {
     "error_reason": 'NONEXISTENT_RESOURCE'
 }
 
+IDENTIFIER_MISMATCH_BODY = {
+    "error_code": 406,
+    "error_source": 'The identifier of the body does not match the one of the path.',
+    "error_reason": 'IDENTIFIER_MISMATCH'
+}
+
 GENERIC_SUCCESS_STATUS_BODY = {
     'code': 200,
     'message': 'Operation was completed successfully.'
@@ -26,13 +38,146 @@ CREATE_GENERIC_SUCCESS_STATUS_BODY = {
     'message': 'Operation was completed successfully.'
 }
 
+INVALID_CURSOR_BODY = {
+    "error_code": 400,
+    "error_source": "Malformed 'after' cursor.",
+    "error_reason": 'INVALID_CURSOR'
+}
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+BULK_INSERT_CHUNK_SIZE = int(os.getenv("BULK_INSERT_CHUNK_SIZE", "1000"))
+
+LOOKUP_CHUNK_SIZE = int(os.getenv("LOOKUP_CHUNK_SIZE", "500"))
+LOOKUP_MAX_IDENTIFIERS = int(os.getenv("LOOKUP_MAX_IDENTIFIERS", "10000"))
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
 class GenericSuccess(BaseModel):
     code: int
     message: str
 
+class BulkItemResult(BaseModel):
+    index: int
+    code: int
+    message: str
+
+class BulkResult(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BulkItemResult]
+
+class ImportRecordError(BaseModel):
+    record: int
+    code: int
+    message: str
+
+class ImportResult(BaseModel):
+    records: int
+    skipped: int
+    imported: int
+    invalid: int
+    duplicates: int
+    failed: int
+    elapsed_seconds: float
+    rows_per_second: float
+    errors: List[ImportRecordError]
+
 def get_error_body(code, source, reason):
     return {
         "error_code": code,
         "error_source": source,
         "error_reason": reason
-    }
\ No newline at end of file
+    }
+
+def encode_cursor(value):
+    """
+    Builds an opaque keyset cursor out of the sort key of a row.
+    :param value: the sort key (primary key value or [column value, primary key value]) of the last row of a page
+    """
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor, composite=False):
+    """
+    Retrieves the sort key out of a cursor built by 'encode_cursor'.
+    Raises ValueError if the cursor is malformed.
+    :param cursor: the opaque cursor received from the client
+    :param composite: True if the rows are sorted by a column other than the primary key,
+    in which case the sort key is a [column value, primary key value] pair
+    """
+    value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if isinstance(value, list) != composite or (composite and len(value) != 2):
+        raise ValueError("The cursor does not match the sort order.")
+    return value
+
+def get_next_cursor_headers(rows, items_per_page, identifier_name, sort_by=None):
+    """
+    Returns the headers that point to the next page if the current page is full (no headers otherwise).
+    :param rows: the rows of the current page
+    :param items_per_page: the size of a page
+    :param identifier_name: the name of the primary key field
+    :param sort_by: the name of the field by which the rows are sorted
+    """
+    if len(rows) < items_per_page:
+        return {}
+    if sort_by is None or sort_by == identifier_name:
+        return {NEXT_CURSOR_HEADER: encode_cursor(getattr(rows[-1], identifier_name))}
+    return {NEXT_CURSOR_HEADER: encode_cursor([getattr(rows[-1], sort_by), getattr(rows[-1], identifier_name)])}
+
+def get_bulk_result_body(errors):
+    """
+    Builds the body of a bulk create response out of the per-item errors of the operation.
+    :param errors: a list with the error of every item (None if the item was created)
+    """
+    results = []
+    for index, error in enumerate(errors):
+        if error is None:
+            results.append({"index": index, "code": 201, "message": CREATE_GENERIC_SUCCESS_STATUS_BODY["message"]})
+        else:
+            code = 409 if isinstance(error, IntegrityError) else 500
+            results.append({"index": index, "code": code, "message": str(error)})
+
+    failed = sum(1 for error in errors if error is not None)
+    return {
+        "inserted": len(errors) - failed,
+        "failed": failed,
+        "results": results
+    }
+
+def get_lookup_body(identifier_values, entities, serializer):
+    """
+    Builds the body of a lookup response: the found entities, in the order of the identifiers,
+    and the identifiers that were not found.
+    :param identifier_values: the requested identifiers
+    :param entities: the entity of every identifier (None if it was not found)
+    :param serializer: the HALSerializer of the view model of the entities
+    """
+    return {
+        "items": serializer.serialize([entity for entity in entities if entity is not None]),
+        "missing": [identifier_value for identifier_value, entity in zip(identifier_values, entities) if entity is None]
+    }
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Checks if an 'If-None-Match' header holds an ETag (weak comparison, as RFC 7232 requires for this header).
+    :param if_none_match: the value of the 'If-None-Match' header
+    :param etag: the current ETag of the resource
+    """
+    if if_none_match is None or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def get_not_modified_response(if_none_match, etag):
+    """
+    Returns a 304 response if the client already has the current version of the resource, None otherwise.
+    :param if_none_match: the value of the 'If-None-Match' header
+    :param etag: the current ETag of the resource
+    """
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
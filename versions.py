@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+VERSIONS_MAX_ROWS = int(os.getenv("VERSIONS_MAX_ROWS", "100000"))
+
+
+class TableVersions:
+    """
+    Version counters of a table and of its rows.
+    Every write takes the next table version, the written rows keep it as their row version.
+    Only the most recently written rows are tracked: the rows that are not tracked share the 'floor'
+    version, which is raised to the version of every forgotten row, so a row never goes back to a version
+    it had before a write.
+    """
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.version = 0
+        self.floor = 0
+        self.row_versions = OrderedDict()
+        # the time.monotonic() of the last write - None if the table was not written
+        self.written_at = None
+
+    def bump(self, keys):
+        self.version += 1
+        self.written_at = time.monotonic()
+        if keys is None:
+            # the written rows are unknown, so all the rows get a new version
+            self.row_versions.clear()
+            self.floor = self.version
+            return
+
+        for key in keys:
+            self.row_versions[key] = self.version
+            self.row_versions.move_to_end(key)
+        while len(self.row_versions) > self.max_rows:
+            _, forgotten_version = self.row_versions.popitem(last=False)
+            self.floor = max(self.floor, forgotten_version)
+
+    def get_row_version(self, key):
+        return self.row_versions.get(key, self.floor)
+
+
+class VersionCounters:
+    """
+    In-process version counters of all the tables, bumped by the write wrappers of the model.
+    The counters (and so the ETags built out of them) only see the writes made by this process: the writes made
+    outside of it (the command line importer, a manual SQL statement) have to be notified by 'POST /api/admin/invalidate'.
+    """
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.tables = {}
+        # distinguishes the versions of this process from the ones of a previous run or of another worker
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def get_table(self, table_name):
+        table = self.tables.get(table_name)
+        if table is None:
+            table = self.tables.setdefault(table_name, TableVersions(self.max_rows))
+        return table
+
+    def bump(self, table_name, keys=None):
+        """
+        Registers a write on a table.
+        :param table_name: the name of the table
+        :param keys: the primary key values of the written rows - None if they are not known
+        """
+        with self.lock:
+            self.get_table(table_name).bump(None if keys is None else [str(key) for key in keys if key is not None])
+
+    def get_table_version(self, table_name):
+        with self.lock:
+            return self.get_table(table_name).version
+
+    def get_table_written_at(self, table_name):
+        """
+        Returns the time.monotonic() of the last write on a table - None if it was not written by this process.
+        :param table_name: the name of the table
+        """
+        with self.lock:
+            return self.get_table(table_name).written_at
+
+    def get_row_version(self, table_name, key):
+        with self.lock:
+            return self.get_table(table_name).get_row_version(str(key))
+
+    def get_table_etag(self, table_name):
+        """
+        Returns the strong ETag of the content of a table.
+        :param table_name: the name of the table
+        """
+        return f'"{self.epoch}-{table_name}-{self.get_table_version(table_name)}"'
+
+    def get_row_etag(self, table_name, key):
+        """
+        Returns the strong ETag of a row of a table.
+        :param table_name: the name of the table
+        :param key: the primary key value of the row
+        """
+        return f'"{self.epoch}-{table_name}-row-{self.get_row_version(table_name, key)}"'
+
+
+entity_versions = VersionCounters(VERSIONS_MAX_ROWS)
@@ -1,4 +1,5 @@
 from fastapi_hypermodel import HyperModel, LinkSet, HALFor
+from typing import List
 from pydantic import constr, BaseModel
 
 
@@ -36,7 +37,7 @@ class Author(HyperModel):
 
 class Books_Authors(HyperModel):
     id: int
-    isbn: int
+    isbn: constr(min_length=1, max_length=100)
     author_id: int
 
     links = LinkSet(
@@ -54,4 +55,24 @@ class Books_Authors(HyperModel):
 class Error(BaseModel):
     error_code: int
     error_source: str
-    error_reason: str
\ No newline at end of file
+    error_reason: str
+
+
+class BookLookup(BaseModel):
+    items: List[Book]
+    missing: List[str]
+
+
+class AuthorLookup(BaseModel):
+    items: List[Author]
+    missing: List[str]
+
+
+class Books_AuthorsLookup(BaseModel):
+    items: List[Books_Authors]
+    missing: List[str]
+
+
+class SearchResult(BaseModel):
+    books: List[Book]
+    authors: List[Author]
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import threading
+import time
+from async_model import run_model_operation
+from db import get_bool_env
+from metrics import Gauge, Histogram
+from model import OperationResponseWrapper, insert_books, insert_authors, insert_many_books_authors
+
+# when enabled, the single-entity POSTs are inserted by the write batchers instead of one transaction per request
+WRITE_BATCHING = get_bool_env("WRITE_BATCHING")
+WRITE_BATCH_MAX_ITEMS = int(os.getenv("WRITE_BATCH_MAX_ITEMS", "100"))
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "5"))
+WRITE_BATCH_QUEUE_SIZE = int(os.getenv("WRITE_BATCH_QUEUE_SIZE", "10000"))
+
+write_batch_queue_depth = Gauge("write_batch_queue_depth", "Number of inserts waiting in the queue of a write batcher.",
+                                ("entity",))
+write_batch_size = Histogram("write_batch_size", "Number of inserts committed by a single transaction of a write batcher.",
+                             ("entity",), buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+write_batch_duration_seconds = Histogram("write_batch_duration_seconds", "Time spent flushing a batch of inserts.",
+                                         ("entity",))
+
+write_batchers = []
+
+
+class WriteBatcher:
+    """
+    Group commit of the inserts of an entity: the inserts of concurrent requests wait in a bounded queue and a background
+    task flushes them in a single transaction every 'max_items' inserts or 'max_delay_ms' milliseconds after the first one,
+    whichever comes first. The rows that are rejected (e.g. duplicates) are retried one by one in the same transaction,
+    so every request still gets the result of its own insert once the batch commits.
+    While a batch is flushed the next one fills up, so the batches grow with the load.
+    """
+    def __init__(self, name, insert_many_operation, max_items=WRITE_BATCH_MAX_ITEMS,
+                 max_delay_ms=WRITE_BATCH_MAX_DELAY_MS, queue_size=WRITE_BATCH_QUEUE_SIZE):
+        """
+        :param name: the name of the entity, used by the metrics
+        :param insert_many_operation: the model wrapper that inserts many instances of the entity
+        (e.g. 'insert_books', called with the list of attributes and the chunk size)
+        :param max_items: the maximum number of inserts of a batch
+        :param max_delay_ms: the maximum time a batch waits for more inserts after its first one
+        :param queue_size: the maximum number of waiting inserts - the requests wait for room beyond it
+        """
+        self.name = name
+        self.insert_many_operation = insert_many_operation
+        self.max_items = max_items
+        self.max_delay = max_delay_ms / 1000
+        self.queue_size = queue_size
+        self.loop = None
+        self.queue = None
+        self.worker = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        write_batchers.append(self)
+
+    def start(self):
+        # the worker belongs to the event loop of the application (a new loop, e.g. of a test client, gets a new worker)
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop or self.worker.done():
+            self.loop = loop
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.worker = loop.create_task(self.run())
+
+    async def submit(self, entity_fields):
+        """
+        Queues the insert of an entity and waits until its batch is committed.
+        Returns an OperationResponseWrapper, like the 'insert_*' wrappers of the model.
+        :param entity_fields: the attributes of the entity that is to be inserted
+        """
+        self.start()
+        result = self.loop.create_future()
+        await self.queue.put((entity_fields, result))
+        write_batch_queue_depth.inc((self.name,))
+        return await result
+
+    async def get_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_items:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        write_batch_queue_depth.dec((self.name,), len(batch))
+        return batch
+
+    async def flush(self, batch):
+        start = time.perf_counter()
+        try:
+            entities_fields = [entity_fields for entity_fields, _ in batch]
+            db_response = await run_model_operation(self.insert_many_operation, entities_fields, len(batch))
+            errors = db_response.payload
+        except Exception as e:
+            errors = [e] * len(batch)
+
+        for (_, result), error in zip(batch, errors):
+            # the request may have been cancelled while it was waiting
+            if not result.done():
+                result.set_result(OperationResponseWrapper(error=error, completed_operation=error is None))
+
+        write_batch_size.observe((self.name,), len(batch))
+        write_batch_duration_seconds.observe((self.name,), time.perf_counter() - start)
+        with self.lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+
+    async def run(self):
+        while True:
+            batch = await self.get_batch()
+            try:
+                await self.flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def close(self):
+        """
+        Waits until the queued inserts are committed and stops the worker.
+        """
+        if self.worker is None or self.loop is not asyncio.get_running_loop():
+            return
+        await self.queue.join()
+        self.worker.cancel()
+
+    def statistics(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+                "queue_size": self.queue_size,
+                "max_items": self.max_items,
+                "max_delay_ms": self.max_delay * 1000,
+                "batches": self.batches,
+                "items": self.items,
+                "average_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size
+            }
+
+
+book_write_batcher = WriteBatcher("Books", insert_books)
+author_write_batcher = WriteBatcher("Authors", insert_authors)
+books_authors_write_batcher = WriteBatcher("Books_Authors", insert_many_books_authors)
+
+
+async def close_write_batchers():
+    """
+    Commits the queued inserts of all the write batchers - called when the application shuts down.
+    """
+    for write_batcher in write_batchers:
+        await write_batcher.close()
+
+
+def get_write_batching_statistics():
+    """
+    Returns the queue depth and the batch sizes of all the write batchers.
+    """
+    return {
+        "enabled": WRITE_BATCHING,
+        "batchers": {write_batcher.name: write_batcher.statistics() for write_batcher in write_batchers}
+    }